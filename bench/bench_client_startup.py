@@ -0,0 +1,142 @@
+"""
+客户端冷启动耗时测试
+
+以 --profile-startup --exit-after-startup 多次启动 client/main.py (默认使用 Qt 的 offscreen 平台，
+无需显示器)，解析客户端输出的 STARTUP_REPORT，统计登录窗口可交互的时间、各启动阶段耗时
+和进程总耗时；再用 python -X importtime 启动一次，按顶层包汇总导入耗时。
+
+可以用 --compare 与之前保存的结果对比，登录窗口就绪时间的中位数变慢超过 --max-regression
+时以非零状态码退出，用于防止启动耗时回退。
+
+用法:
+    python bench/bench_client_startup.py --runs 10 --output startup.json
+    python bench/bench_client_startup.py --compare startup.json --max-regression 15
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import load_test
+
+CLIENT_SCRIPT = os.path.join(load_test.REPO_ROOT, 'client', 'main.py')
+REPORT_PREFIX = 'STARTUP_REPORT '
+READY_MARK = 'login_window_ready'
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S+)')
+
+
+def _env(platform):
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', platform)
+    return env
+
+
+def run_once(workdir, platform, extra_python_args=()):
+    """ 启动一次客户端，返回 (报告, 进程总耗时秒, stderr) """
+    cmd = [sys.executable, *extra_python_args, CLIENT_SCRIPT, '--profile-startup', '--exit-after-startup']
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=workdir, env=_env(platform), capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - start
+    report = None
+    for line in proc.stdout.splitlines():
+        if line.startswith(REPORT_PREFIX):
+            report = json.loads(line[len(REPORT_PREFIX):])
+    if report is None:
+        raise RuntimeError(f"客户端没有输出启动报告 (退出码 {proc.returncode}):\n{proc.stderr[-2000:]}")
+    return report, elapsed, proc.stderr
+
+
+def import_breakdown(stderr, top=15):
+    """ 按顶层包汇总 -X importtime 的 self 耗时 (毫秒) """
+    totals = {}
+    for line in stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if not m:
+            continue
+        package = m.group(3).split('.', 1)[0]
+        totals[package] = totals.get(package, 0) + int(m.group(1))
+    ranked = sorted(totals.items(), key=lambda kv: -kv[1])[:top]
+    return {name: round(us / 1000, 2) for name, us in ranked}
+
+
+def summarize(reports, wall_times):
+    ready = [r["marks_ms"][READY_MARK] for r in reports]
+    phases = {}
+    for r in reports:
+        for p in r["phases"]:
+            phases.setdefault(p["name"], []).append(p["ms"])
+    return {
+        "runs": len(reports),
+        "login_ready_ms_p50": round(statistics.median(ready), 2),
+        "login_ready_ms_min": round(min(ready), 2),
+        "process_ms_p50": round(statistics.median(wall_times) * 1000, 2),
+        "phases_ms_p50": {name: round(statistics.median(v), 2) for name, v in phases.items()},
+        "modules_total": reports[-1]["modules_total"],
+    }
+
+
+def compare(current, baseline_path, max_regression):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)["summary"]
+    old, new = baseline["login_ready_ms_p50"], current["login_ready_ms_p50"]
+    change = (new - old) / old * 100 if old else 0.0
+    print(f"登录窗口就绪 p50: {old:.1f} ms -> {new:.1f} ms ({change:+.1f}%)")
+    for name, ms in current["phases_ms_p50"].items():
+        before = baseline.get("phases_ms_p50", {}).get(name)
+        if before is not None:
+            print(f"  {name:<24} {before:8.1f} -> {ms:8.1f} ms")
+    if change > max_regression:
+        print(f"启动耗时回退超过 {max_regression}%")
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="客户端冷启动耗时测试")
+    parser.add_argument("--runs", type=int, default=5, help="启动次数 (默认: 5)")
+    parser.add_argument("--platform", type=str, default='offscreen',
+                        help="未设置 QT_QPA_PLATFORM 时使用的 Qt 平台 (默认: offscreen)")
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    parser.add_argument("--compare", type=str, help="与之前保存的结果 JSON 对比")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="允许的登录窗口就绪时间回退百分比 (默认: 20)")
+    args = parser.parse_args(argv)
+
+    # 在临时目录中运行，日志和下载缓存不会写进仓库
+    workdir = tempfile.mkdtemp(prefix='yunpan_startup_')
+    try:
+        reports, wall_times = [], []
+        for _ in range(args.runs):
+            report, elapsed, _ = run_once(workdir, args.platform)
+            reports.append(report)
+            wall_times.append(elapsed)
+        _, _, stderr = run_once(workdir, args.platform, ('-X', 'importtime'))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(reports, wall_times)
+    breakdown = import_breakdown(stderr)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    print("导入耗时 (按顶层包，ms):")
+    for name, ms in breakdown.items():
+        print(f"  {name:<24} {ms:8.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": {"git_commit": load_test.git_revision()}, "summary": summary,
+                       "imports_ms": breakdown, "runs": reports}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    if args.compare and not compare(summary, args.compare, args.max_regression):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
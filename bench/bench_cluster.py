@@ -0,0 +1,141 @@
+"""
+集群扩展性测试
+
+依次以 1..N 个节点启动集群 (每个节点一个本地进程、一个独立目录)，客户端用 ClusterPool
+按一致性哈希直接连到每个文件的主节点，测量并发上传和下载的吞吐量随节点数的变化。
+所有节点在同一台机器上时磁盘和 CPU 是共享的，结果反映的是单进程瓶颈被拆开后的提升；
+要测真实的扩展性，请用 --workdirs 把各节点放到不同的磁盘上。
+
+用法:
+    python bench/bench_cluster.py
+    python bench/bench_cluster.py --nodes 1,2,4 --replicas 1 --files 400 --size 1048576 --output cluster.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import load_test
+
+sys.path.insert(0, os.path.join(load_test.REPO_ROOT, 'client'))
+from common.core import FileClient
+from common.cluster import ClusterPool
+
+DEFAULT_NODES = '1,2,3'
+
+
+def start_cluster(count, replicas, parents):
+    """ 启动 count 个节点，返回 (节点进程列表, 工作目录列表) """
+    ports = [load_test.find_free_port() for _ in range(count)]
+    nodes = ','.join(f'127.0.0.1:{port}' for port in ports)
+    servers, workdirs = [], []
+    try:
+        for i, port in enumerate(ports):
+            workdir = tempfile.mkdtemp(prefix=f'cluster_bench_{i}_', dir=parents[i % len(parents)])
+            workdirs.append(workdir)
+            server = load_test.ServerProcess(workdir, port, [
+                '--cluster', nodes, '--advertise', f'127.0.0.1:{port}', '--replicas', str(replicas),
+                '--rebalance-interval', '0'])
+            server.start()
+            servers.append(server)
+    except Exception:
+        stop_cluster(servers, workdirs)
+        raise
+    return servers, workdirs
+
+
+def stop_cluster(servers, workdirs):
+    for server in servers:
+        server.stop()
+    for workdir in workdirs:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def wait_replicated(servers, timeout=60):
+    """ 等到所有节点的复制队列为空 """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        queued = 0
+        for server in servers:
+            with FileClient('127.0.0.1', server.port) as client:
+                queued += client.stats()["cluster"]["queued"]
+        if not queued:
+            return
+        time.sleep(0.2)
+
+
+def run_phase(pool, fn, items, size):
+    started = time.perf_counter()
+    errors = sum(1 for _, _, error in pool.map(fn, items) if error is not None)
+    elapsed = time.perf_counter() - started
+    done = len(items) - errors
+    return {
+        "ops_per_sec": round(done / elapsed, 1) if elapsed > 0 else None,
+        "mb_per_sec": round(done * size / elapsed / 1048576, 1) if elapsed > 0 else None,
+        "errors": errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="集群扩展性测试")
+    parser.add_argument("--nodes", type=str, default=DEFAULT_NODES, help=f"依次测试的节点数 (默认: {DEFAULT_NODES})")
+    parser.add_argument("--replicas", type=int, default=1, help="副本数 (默认: 1，只测主节点的吞吐量)")
+    parser.add_argument("--files", type=int, default=200, help="文件数 (默认: 200)")
+    parser.add_argument("--size", type=int, default=256 << 10, help="单个文件大小，字节 (默认: 256KB)")
+    parser.add_argument("--jobs", type=int, default=16, help="客户端并发连接数 (默认: 16)")
+    parser.add_argument("--workdirs", type=str, help="逗号分隔的节点工作目录父目录，按节点轮流使用 (默认: 系统临时目录)")
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    args = parser.parse_args(argv)
+
+    parents = args.workdirs.split(',') if args.workdirs else [None]
+    scratch = tempfile.mkdtemp(prefix='cluster_bench_src_')
+    names = [f'scale_{i}.bin' for i in range(args.files)]
+    results = []
+    try:
+        block = os.urandom(args.size)
+        for name in names:
+            with open(os.path.join(scratch, name), 'wb') as f:
+                f.write(block)
+        download_dir = os.path.join(scratch, 'downloads')
+        os.makedirs(download_dir)
+
+        def upload(client, name):
+            client.upload(os.path.join(scratch, name), name)
+            return args.size
+
+        def download(client, name):
+            client.download(name, os.path.join(download_dir, name))
+            return args.size
+
+        print(f"{'节点':>4}{'上传 MB/s':>12}{'上传 ops/s':>12}{'下载 MB/s':>12}{'下载 ops/s':>12}{'错误':>6}")
+        for count in (int(n) for n in args.nodes.split(',')):
+            servers, workdirs = start_cluster(count, min(args.replicas, count), parents)
+            try:
+                with FileClient('127.0.0.1', servers[0].port) as client:
+                    info = client.hello()["cluster"]
+                with ClusterPool(info, size=args.jobs, timeout=60) as pool:
+                    up = run_phase(pool, upload, names, args.size)
+                    wait_replicated(servers)
+                    down = run_phase(pool, download, names, args.size)
+            finally:
+                stop_cluster(servers, workdirs)
+            print(f"{count:>4}{up['mb_per_sec']:>12}{up['ops_per_sec']:>12}"
+                  f"{down['mb_per_sec']:>12}{down['ops_per_sec']:>12}{up['errors'] + down['errors']:>6}")
+            results.append({"nodes": count, "upload": up, "download": down})
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"files": args.files, "size": args.size, "replicas": args.replicas, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+下载发送路径对比测试
+
+分别以不同的 --send-mode 启动服务器，在冷缓存下对比原始的单线程读取/发送循环 (sequential)
+与预读流水线 (readahead) 的下载吞吐量。每轮开始前用 posix_fadvise(DONTNEED) 把测试文件
+逐出页缓存 (以 root 运行并加 --drop-caches 时改为写 /proc/sys/vm/drop_caches)，
+让读取真正落到磁盘上；文件放在机械硬盘或网络存储上时 (--workdir) 差别最明显。
+
+用法:
+    python bench/bench_download_send.py
+    python bench/bench_download_send.py --workdir /mnt/nfs/tmp --size 268435456 --concurrency 1,4 --output send.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import load_test
+
+DEFAULT_MODES = 'sequential,readahead'
+DEFAULT_CONCURRENCY = '1,4'
+
+
+def evict(paths, drop_caches=False):
+    """ 把文件逐出页缓存；返回是否成功 """
+    if drop_caches:
+        try:
+            os.sync()
+            with open('/proc/sys/vm/drop_caches', 'w') as f:
+                f.write('1\n')
+            return True
+        except OSError as e:
+            print(f"无法写入 drop_caches ({e})，改用 posix_fadvise", file=sys.stderr)
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def run_round(port, names, size, clients):
+    """ clients 个连接同时各下载一个不同的文件，返回总吞吐量和单个下载的耗时 """
+    latencies = []
+    errors = []
+    barrier = threading.Barrier(clients)
+
+    def download(name):
+        client = load_test.BenchClient('127.0.0.1', port, timeout=120)
+        try:
+            barrier.wait()
+            started = time.perf_counter()
+            client.download(name)
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=download, args=(name,)) for name in names[:clients]]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    done = len(latencies)
+    return {
+        "mb_per_sec": round(done * size / elapsed / 1048576, 1) if elapsed > 0 else None,
+        "max_s": round(max(latencies), 3) if latencies else None,
+        "errors": len(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="下载发送路径对比测试")
+    parser.add_argument("--modes", type=str, default=DEFAULT_MODES, help=f"发送方式 (默认: {DEFAULT_MODES})")
+    parser.add_argument("--concurrency", type=str, default=DEFAULT_CONCURRENCY,
+                        help=f"并发下载数 (默认: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--size", type=int, default=64 << 20, help="单个文件大小，字节 (默认: 64MB)")
+    parser.add_argument("--rounds", type=int, default=3, help="每种组合重复的次数，取中位数 (默认: 3)")
+    parser.add_argument("--workdir", type=str, help="测试文件所在的父目录 (默认: 系统临时目录)")
+    parser.add_argument("--drop-caches", action='store_true', help="用 /proc/sys/vm/drop_caches 清空页缓存 (需要 root)")
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(',')]
+    names = [f'cold_{i}.bin' for i in range(max(levels))]
+    workdir = tempfile.mkdtemp(prefix='send_bench_', dir=args.workdir)
+    results = []
+    try:
+        save_dir = os.path.join(workdir, 'files')
+        os.makedirs(save_dir)
+        block = os.urandom(1 << 20)
+        for name in names:
+            with open(os.path.join(save_dir, name), 'wb') as f:
+                for _ in range(args.size >> 20):
+                    f.write(block)
+                f.write(block[:args.size & ((1 << 20) - 1)])
+        paths = [os.path.join(save_dir, name) for name in names]
+
+        print(f"{'模式':<12}{'并发':>6}{'MB/s':>10}{'最慢 s':>10}{'错误':>6}")
+        for mode in args.modes.split(','):
+            port = load_test.find_free_port()
+            server = load_test.ServerProcess(workdir, port, [f'--send-mode={mode}'])
+            server.start()
+            try:
+                for clients in levels:
+                    rounds = []
+                    for _ in range(args.rounds):
+                        if not evict(paths, args.drop_caches):
+                            print("警告: 无法清空页缓存，结果是热缓存下的数据", file=sys.stderr)
+                        rounds.append(run_round(port, names, args.size, clients))
+                    rounds.sort(key=lambda r: r['mb_per_sec'] or 0)
+                    stats = rounds[len(rounds) // 2]
+                    print(f"{mode:<12}{clients:>6}{stats['mb_per_sec']:>10}{stats['max_s']:>10}{stats['errors']:>6}")
+                    results.append({"mode": mode, "clients": clients, **stats})
+            finally:
+                server.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"size": args.size, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+HTTP 网关与自定义协议的对比测试
+
+启动一个同时开启 --http-port 的服务器，用相同的并发数、文件数和文件大小，分别通过
+自定义协议 (load_test.BenchClient) 和 HTTP/1.1 保持连接 (http.client) 上传再下载，
+比较吞吐量、ops/s、下载延迟和服务器进程的 CPU 占用。两种协议使用不同的文件名前缀，
+上传都是新建文件；下载重复 --repeat 轮，文件都在页缓存中，反映的是协议和发送路径本身的开销
+(网关用 sendfile 发送，自定义协议按 --send-mode 读入缓冲区再发送)。
+--size 4096 之类的小文件主要比较每个请求的固定开销。
+
+用法:
+    python bench/bench_http.py
+    python bench/bench_http.py --files 64 --size 16777216 --jobs 8 --output http.json
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import load_test
+
+RECV_SIZE = 1 << 20
+
+
+class HttpBenchClient:
+    """ 与 BenchClient 相同接口的 HTTP 客户端，一个保持连接 """
+
+    def __init__(self, host, port, timeout=30):
+        self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        self._buf = bytearray(RECV_SIZE)
+
+    def close(self):
+        self.conn.close()
+
+    def download(self, filename):
+        self.conn.request('GET', f'/files/{filename}')
+        response = self.conn.getresponse()
+        if response.status != 200:
+            response.read()
+            raise RuntimeError(f"下载失败: {response.status} {response.reason}")
+        received = 0
+        view = memoryview(self._buf)
+        while True:
+            n = response.readinto(view)
+            if not n:
+                break
+            received += n
+        return received
+
+    def upload(self, filename, data):
+        self.conn.request('PUT', f'/files/{filename}', body=data)
+        response = self.conn.getresponse()
+        response.read()
+        if response.status not in (200, 201, 204):
+            raise RuntimeError(f"上传失败: {response.status} {response.reason}")
+        return len(data)
+
+
+def run_phase(make_client, jobs, tasks, server):
+    """ jobs 个线程各用一个连接处理任务队列，返回吞吐量、延迟和服务器 CPU 占用 """
+    work = queue.Queue()
+    for task in tasks:
+        work.put(task)
+    latencies, errors, moved = [], [], [0]
+    lock = threading.Lock()
+
+    def worker():
+        client = make_client()
+        try:
+            while True:
+                try:
+                    fn, args = work.get_nowait()
+                except queue.Empty:
+                    return
+                started = time.perf_counter()
+                try:
+                    n = fn(client, *args)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                    moved[0] += n
+        finally:
+            client.close()
+
+    server.samples = []
+    server.start_sampling()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    server.stop_sampling()
+
+    latencies.sort()
+    return {
+        "ops_per_sec": round(len(latencies) / elapsed, 1),
+        "mb_per_sec": round(moved[0] / elapsed / 1048576, 1),
+        "p50_ms": round(load_test.percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p99_ms": round(load_test.percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "server_cpu_percent": server.usage_summary()["cpu_percent"],
+        "errors": len(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP 网关与自定义协议的对比测试")
+    parser.add_argument("--files", type=int, default=32, help="每种协议上传和下载的文件数 (默认: 32)")
+    parser.add_argument("--size", type=int, default=4 << 20, help="单个文件大小，字节 (默认: 4MB)")
+    parser.add_argument("--jobs", type=int, default=4, help="并发连接数 (默认: 4)")
+    parser.add_argument("--repeat", type=int, default=3, help="下载阶段重复的轮数 (默认: 3)")
+    parser.add_argument("--server-args", type=str, default="", help="传给服务器的额外参数，空格分隔")
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='http_bench_')
+    port, http_port = load_test.find_free_port(), load_test.find_free_port()
+    server = load_test.ServerProcess(workdir, port, ['--http-port', str(http_port)] + args.server_args.split())
+    data = os.urandom(args.size)
+    clients = {
+        "native": lambda: load_test.BenchClient('127.0.0.1', port, timeout=60),
+        "http": lambda: HttpBenchClient('127.0.0.1', http_port, timeout=60),
+    }
+    results = {}
+    try:
+        server.start()
+        print(f"{'协议':<8}{'阶段':<6}{'MB/s':>10}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'CPU %':>8}{'错误':>6}")
+        for protocol, make_client in clients.items():
+            names = [f'{protocol}_{i}.bin' for i in range(args.files)]
+
+            def upload(client, name):
+                return client.upload(name, data)
+
+            def download(client, name):
+                return client.download(name)
+
+            phases = {
+                "upload": run_phase(make_client, args.jobs, [(upload, (name,)) for name in names], server),
+                "download": run_phase(make_client, args.jobs,
+                                      [(download, (name,)) for name in names * args.repeat], server),
+            }
+            results[protocol] = phases
+            for phase, r in phases.items():
+                print(f"{protocol:<8}{phase:<6}{r['mb_per_sec']:>10}{r['ops_per_sec']:>10}{r['p50_ms']!s:>10}"
+                      f"{r['p99_ms']!s:>10}{r['server_cpu_percent']!s:>8}{r['errors']:>6}")
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"files": args.files, "size": args.size, "jobs": args.jobs, "repeat": args.repeat,
+                       "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+断线恢复时间测试
+
+用 common.core.ResilientClient 连接一个临时服务器，在不同场景下制造断线，
+测量从断线到请求重新成功所花的时间:
+
+    restart    空闲时重启服务器 (停机 --downtime 秒)，测量下一次 LIST_FILES 的恢复耗时
+    idle       服务器以很短的 --idle-timeout 启动，客户端空闲超时后再发请求
+    download   大文件下载到一半时重启服务器，测量续传后的总耗时和重复传输的字节数
+
+用法:
+    python bench/bench_reconnect.py
+    python bench/bench_reconnect.py --downtime 0,0.5,2 --size 268435456 --output reconnect.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import load_test
+
+sys.path.insert(0, os.path.join(load_test.REPO_ROOT, 'client'))
+from common.core import FileClient, ResilientClient, ReconnectPolicy
+
+DEFAULT_DOWNTIMES = '0,0.5,2'
+
+# 重连过程中的警告日志不输出到控制台
+logging.getLogger('client_logger').addHandler(logging.NullHandler())
+
+
+def restart(server, downtime):
+    server.stop()
+    time.sleep(downtime)
+    server.start()
+
+
+def measure_restart(server, port, downtime):
+    """ 空闲连接遇到服务器重启后，下一次列表请求的耗时 (包含检测断线、退避重连和重放) """
+    with ResilientClient('127.0.0.1', port, policy=ReconnectPolicy(max_attempts=None)) as client:
+        client.list_files()
+        stopper = threading.Thread(target=restart, args=(server, downtime))
+        stopper.start()
+        time.sleep(0.1)         # 确保请求发出时服务器已经停止
+        start = time.monotonic()
+        client.list_files()
+        elapsed = time.monotonic() - start
+        stopper.join()
+        return {
+            "scenario": "restart",
+            "downtime_s": downtime,
+            "request_s": round(elapsed, 3),
+            "recovery_s": round(client.recovery_times[-1], 3) if client.recovery_times else None,
+            "reconnects": client.reconnects,
+        }
+
+
+def measure_idle(port, idle_timeout):
+    """ 连接被服务器按空闲超时关闭后，请求能否透明地重连并重放 """
+    with ResilientClient('127.0.0.1', port) as client:
+        client.list_files()
+        time.sleep(idle_timeout + 0.5)
+        start = time.monotonic()
+        client.list_files()
+        return {
+            "scenario": "idle",
+            "idle_timeout_s": idle_timeout,
+            "request_s": round(time.monotonic() - start, 3),
+            "reconnects": client.reconnects,
+        }
+
+
+def measure_download(server, port, size, workdir, downtime):
+    """ 下载到一半时重启服务器，统计续传后重复传输的字节数 """
+    source = os.path.join(workdir, 'big.bin')
+    with open(source, 'wb') as f:
+        f.write(os.urandom(1 << 20) * (size >> 20))
+    with FileClient('127.0.0.1', port) as client:
+        client.upload(source, 'big.bin')
+
+    triggered = threading.Event()
+    stopper = None
+    transferred = 0
+    last = 0
+
+    def progress(done, total):
+        nonlocal stopper, transferred, last
+        # 续传时 done 从断点开始，只累计增量；重新完整下载时从 0 开始计入重复字节
+        transferred += max(0, done - last)
+        last = done
+        if not triggered.is_set() and done >= total // 2:
+            triggered.set()
+            stopper = threading.Thread(target=restart, args=(server, downtime))
+            stopper.start()
+
+    target = os.path.join(workdir, 'big.out')
+    with ResilientClient('127.0.0.1', port, chunk_size=65536,
+                         policy=ReconnectPolicy(max_attempts=None)) as client:
+        start = time.monotonic()
+        client.download('big.bin', target, progress)
+        elapsed = time.monotonic() - start
+        if stopper is not None:
+            stopper.join()
+        intact = os.path.getsize(target) == size and _same_content(source, target)
+        return {
+            "scenario": "download",
+            "downtime_s": downtime,
+            "size": size,
+            "total_s": round(elapsed, 3),
+            "recovery_s": round(client.recovery_times[-1], 3) if client.recovery_times else None,
+            "bytes_transferred": transferred,
+            "bytes_repeated": transferred - size,
+            "intact": intact,
+        }
+
+
+def _same_content(a, b, block=1 << 20):
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        while True:
+            x, y = fa.read(block), fb.read(block)
+            if x != y:
+                return False
+            if not x:
+                return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="断线恢复时间测试")
+    parser.add_argument("--downtime", type=str, default=DEFAULT_DOWNTIMES,
+                        help=f"服务器停机时长，秒，逗号分隔 (默认: {DEFAULT_DOWNTIMES})")
+    parser.add_argument("--idle-timeout", type=float, default=1.0, help="idle 场景的服务器空闲超时，秒 (默认: 1)")
+    parser.add_argument("--size", type=int, default=128 << 20, help="download 场景的文件大小，字节 (默认: 128MB)")
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='yunpan_reconnect_')
+    port = load_test.find_free_port()
+    results = []
+    try:
+        server = load_test.ServerProcess(workdir, port, [f'--idle-timeout={args.idle_timeout}'])
+        server.start()
+        try:
+            for downtime in [float(d) for d in args.downtime.split(',')]:
+                results.append(measure_restart(server, port, downtime))
+            results.append(measure_idle(port, args.idle_timeout))
+            for downtime in [float(d) for d in args.downtime.split(',')]:
+                results.append(measure_download(server, port, args.size, workdir, downtime))
+        finally:
+            server.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for r in results:
+        print(json.dumps(r, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": {"git_commit": load_test.git_revision()}, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+上传接收路径对比测试
+
+分别以不同的 --recv-mode 启动服务器，在 1、10、100 个并发上传下运行
+load_test 的 upload 负载，对比原始 recv()+write() 路径 (copy) 与
+recv_into / mmap / splice 的吞吐量、延迟和服务器 CPU。
+
+用法:
+    python bench/bench_upload_receive.py
+    python bench/bench_upload_receive.py --size 8388608 --concurrency 1,10 --modes copy,splice --output recv.json
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import load_test
+
+DEFAULT_MODES = 'copy,recv_into,mmap,splice'
+DEFAULT_CONCURRENCY = '1,10,100'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="上传接收路径对比测试")
+    parser.add_argument("--modes", type=str, default=DEFAULT_MODES, help=f"接收方式 (默认: {DEFAULT_MODES})")
+    parser.add_argument("--concurrency", type=str, default=DEFAULT_CONCURRENCY,
+                        help=f"并发上传数 (默认: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--size", type=int, default=4 << 20, help="单个上传文件大小，字节 (默认: 4MB)")
+    parser.add_argument("--duration", type=float, default=5.0, help="每轮时长，秒 (默认: 5)")
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'模式':<12}{'并发':>6}{'ops/s':>10}{'MB/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'CPU%':>8}{'错误':>6}")
+    for clients in [int(c) for c in args.concurrency.split(',')]:
+        for mode in args.modes.split(','):
+            bench_args = load_test.build_parser().parse_args([
+                '--clients', str(clients), '--duration', str(args.duration), '--mix', 'upload=1',
+                '--small-size', str(args.size), '--large-files', '0', '--shared-files', '0',
+                f'--server-arg=--recv-mode={mode}',
+            ])
+            result = load_test.run_benchmark(bench_args)
+            stats = result['workloads']['upload']
+            print(f"{mode:<12}{clients:>6}{stats['ops_per_sec']:>10}{stats['mb_per_sec']:>10}"
+                  f"{stats['p50_ms']:>10}{stats['p99_ms']:>10}{result['server']['cpu_percent']:>8}"
+                  f"{stats['errors']:>6}")
+            results.append({"mode": mode, "clients": clients, "upload": stats, "server": result['server']})
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": result['meta'], "size": args.size, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,465 @@
+"""
+文件服务器负载测试工具
+
+在临时目录中启动 server/server.py，用 N 个无界面客户端并发施压，
+按配置的负载组合 (列表风暴、小文件上传、大文件流式下载、并发更新) 运行，
+统计 ops/s、MB/s、p50/p99 延迟以及服务器进程的 CPU/RSS，并把结果保存为 JSON，
+方便在不同提交之间对比。
+
+用法示例:
+    python bench/load_test.py --clients 16 --duration 10
+    python bench/load_test.py --mix list=1 --clients 64 --output list_storm.json
+    python bench/load_test.py --output new.json --compare old.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(REPO_ROOT, 'server', 'server.py')
+
+BUFFER_SIZE = 65536
+DEFAULT_MIX = 'list=4,upload=3,download=2,update=1'
+WORKLOADS = ('list', 'upload', 'inline', 'download', 'update')
+
+
+class BenchClient:
+    """ 精简的无界面协议客户端，仅用于压测 """
+
+    def __init__(self, host, port, timeout=30):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b''
+        # 默认按旧写法发送不带结束符的命令；发过内联上传后服务器按换行分帧，之后的命令都要带换行符
+        self._eol = b''
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _read_line(self):
+        """ 读取到换行符为止，多读的数据留在缓冲区中 """
+        while b'\n' not in self._buffer:
+            chunk = self.sock.recv(BUFFER_SIZE)
+            if not chunk:
+                raise ConnectionError("读取响应头时连接中断")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode('utf-8')
+
+    def _read_exact(self, size, sink=None):
+        """ 读取 size 字节；sink 为 None 时丢弃数据，只计数 """
+        received = 0
+        if self._buffer:
+            head = self._buffer[:size]
+            self._buffer = self._buffer[len(head):]
+            received += len(head)
+            if sink is not None:
+                sink.append(head)
+        while received < size:
+            chunk = self.sock.recv(min(BUFFER_SIZE, size - received))
+            if not chunk:
+                raise ConnectionError("读取数据时连接中断")
+            received += len(chunk)
+            if sink is not None:
+                sink.append(chunk)
+        return received
+
+    def list_files(self):
+        self.sock.sendall(b"LIST_FILES" + self._eol)
+        status, length = self._read_line().split('|', 1)
+        parts = []
+        self._read_exact(int(length), parts)
+        if status != "OK_LIST":
+            raise RuntimeError(f"列表失败: {status}")
+        files = json.loads(b''.join(parts).decode('utf-8'))
+        return files, int(length)
+
+    def download(self, filename):
+        self.sock.sendall(f"DOWNLOAD_FILE|{filename}".encode('utf-8') + self._eol)
+        header = self._read_line()
+        if not header.startswith("OK_DOWNLOAD|"):
+            raise RuntimeError(f"下载失败: {header}")
+        filesize = int(header.split('|', 1)[1])
+        return self._read_exact(filesize)
+
+    def upload(self, filename, data, command="UPLOAD_FILE"):
+        self.sock.sendall(f"{command}|{filename}|{len(data)}".encode('utf-8') + self._eol)
+        response = self._read_line()
+        if response != "READY_TO_RECEIVE":
+            raise RuntimeError(f"服务器未准备接收: {response}")
+        self.sock.sendall(data)
+        final = self._read_line()
+        if not final.startswith("OK|"):
+            raise RuntimeError(f"上传失败: {final}")
+        return len(data)
+
+    def upload_inline(self, filename, data, command="UPLOAD_INLINE"):
+        """ 内联上传: 命令和内容一次发出，只等待一次响应 """
+        self._eol = b'\n'
+        self.sock.sendall(f"{command}|{filename}|{len(data)}\n".encode('utf-8') + data)
+        final = self._read_line()
+        if not final.startswith("OK|"):
+            raise RuntimeError(f"内联上传失败: {final}")
+        return len(data)
+
+
+class ServerProcess:
+    """ 在临时目录中运行的服务器子进程，并采样其 CPU/RSS """
+
+    def __init__(self, workdir, port, extra_args=None):
+        self.workdir = workdir
+        self.port = port
+        self.save_dir = os.path.join(workdir, 'files')
+        self.extra_args = list(extra_args or [])
+        self.proc = None
+        self.samples = []
+        self._sampling = False
+        self._sampler = None
+
+    def start(self, ready_timeout=15):
+        os.makedirs(self.save_dir, exist_ok=True)
+        cmd = [sys.executable, SERVER_SCRIPT,
+               '--host', '127.0.0.1', '--port', str(self.port),
+               '--dir', self.save_dir] + self.extra_args
+        # 服务器日志写在工作目录下的 serverinfo/log 中，控制台输出直接丢弃
+        self.proc = subprocess.Popen(cmd, cwd=self.workdir,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + ready_timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"服务器进程提前退出，返回码 {self.proc.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError("等待服务器启动超时")
+
+    def start_sampling(self, interval=0.2):
+        self._sampling = True
+        self._sampler = threading.Thread(target=self._sample_loop, args=(interval,), daemon=True)
+        self._sampler.start()
+
+    def stop_sampling(self):
+        self._sampling = False
+        if self._sampler:
+            self._sampler.join()
+
+    def _sample_loop(self, interval):
+        while self._sampling and self.proc.poll() is None:
+            sample = read_process_usage(self.proc.pid)
+            if sample:
+                self.samples.append((time.monotonic(),) + sample)
+            time.sleep(interval)
+
+    def usage_summary(self):
+        """ 汇总采样: 平均 CPU 占用率 (%) 与峰值 RSS (MB) """
+        if len(self.samples) < 2:
+            return {"cpu_percent": None, "rss_peak_mb": None, "rss_last_mb": None}
+        t0, cpu0, _ = self.samples[0]
+        t1, cpu1, rss_last = self.samples[-1]
+        return {
+            "cpu_percent": round(100.0 * (cpu1 - cpu0) / (t1 - t0), 1) if t1 > t0 else None,
+            "rss_peak_mb": round(max(s[2] for s in self.samples) / 1048576, 1),
+            "rss_last_mb": round(rss_last / 1048576, 1),
+        }
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+
+def read_process_usage(pid):
+    """ 返回 (累计CPU秒数, RSS字节)；优先读 /proc，其次尝试 psutil """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # rsplit 之后 fields[0] 是进程状态 (原第3个字段)，utime/stime 为原第14/15个字段
+        ticks = os.sysconf('SC_CLK_TCK')
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        with open(f'/proc/{pid}/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu, rss
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        proc = psutil.Process(pid)
+        times = proc.cpu_times()
+        return times.user + times.system, proc.memory_info().rss
+    except Exception:
+        return None
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(mix_str):
+    """ 解析 'list=4,upload=3' 形式的负载权重 """
+    mix = {}
+    for item in mix_str.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition('=')
+        if name not in WORKLOADS:
+            raise ValueError(f"未知负载类型: {name} (可选: {', '.join(WORKLOADS)})")
+        mix[name] = float(weight) if weight else 1.0
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("负载组合为空")
+    return mix
+
+
+def percentile(sorted_values, pct):
+    """ 最近秩法求百分位数 """
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def seed_files(port, args):
+    """ 通过协议上传大文件下载和并发更新所需的文件，适用于任何存储后端 """
+    client = BenchClient('127.0.0.1', port)
+    try:
+        if args.large_files:
+            large = os.urandom(args.large_size)
+            for i in range(args.large_files):
+                client.upload(f'large_{i}.bin', large)
+        for i in range(args.shared_files):
+            client.upload(f'shared_{i}.bin', os.urandom(args.update_size))
+    finally:
+        client.close()
+
+
+def worker(index, args, mix, timing, results, errors, barrier):
+    """ 单个压测客户端: 按权重随机选择操作，记录 (操作, 延迟, 字节数) """
+    rng = random.Random(args.seed + index)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    small_payload = os.urandom(args.small_size)
+    update_payload = os.urandom(args.update_size)
+    records = []
+    counter = 0
+
+    try:
+        client = BenchClient('127.0.0.1', args.port)
+    except OSError as e:
+        # 让主线程和其他客户端不再等待，整轮压测失败
+        errors.append(('connect', str(e)))
+        barrier.abort()
+        return
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        client.close()
+        return
+    deadline = timing['deadline']
+    try:
+        while time.monotonic() < deadline:
+            if args.ops and counter >= args.ops:
+                break
+            op = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                if op == 'list':
+                    _, nbytes = client.list_files()
+                elif op == 'upload':
+                    nbytes = client.upload(f'small_{index}_{counter}.bin', small_payload)
+                elif op == 'inline':
+                    nbytes = client.upload_inline(f'small_{index}_{counter}.bin', small_payload)
+                elif op == 'download':
+                    nbytes = client.download(f'large_{rng.randrange(args.large_files)}.bin')
+                else:
+                    nbytes = client.upload(f'shared_{rng.randrange(args.shared_files)}.bin',
+                                           update_payload, command="UPDATE_FILE")
+            except (OSError, RuntimeError, ValueError) as e:
+                errors.append((op, str(e)))
+                # 协议状态未知，重建连接
+                client.close()
+                client = BenchClient('127.0.0.1', args.port)
+                continue
+            records.append((op, time.perf_counter() - start, nbytes))
+            counter += 1
+    finally:
+        client.close()
+        results[index] = records
+
+
+def summarize(records, elapsed):
+    latencies = sorted(r[1] for r in records)
+    total_bytes = sum(r[2] for r in records)
+    return {
+        "ops": len(records),
+        "ops_per_sec": round(len(records) / elapsed, 2) if elapsed else None,
+        "mb_per_sec": round(total_bytes / 1048576 / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+    }
+
+
+def run_benchmark(args):
+    """ 启动服务器并运行一轮压测，返回结果字典 """
+    mix = parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix='yunpan_bench_')
+    args.port = find_free_port()
+    server = ServerProcess(workdir, args.port, args.server_arg)
+    try:
+        server.start()
+        seed_files(args.port, args)
+
+        results = [None] * args.clients
+        errors = []
+        timing = {}
+
+        def start_clock():
+            # 所有客户端都连上后才由屏障调用，建连风暴不计入结果
+            timing['started'] = time.monotonic()
+            timing['deadline'] = timing['started'] + args.duration
+
+        barrier = threading.Barrier(args.clients + 1, action=start_clock)
+        threads = [threading.Thread(target=worker, args=(i, args, mix, timing, results, errors, barrier), daemon=True)
+                   for i in range(args.clients)]
+        for t in threads:
+            t.start()
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            for t in threads:
+                t.join()
+            raise RuntimeError(f"压测客户端无法连接服务器: {errors[0][1] if errors else '未知错误'}")
+        server.start_sampling()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - timing['started']
+        server.stop_sampling()
+    finally:
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    all_records = [r for per_client in results if per_client for r in per_client]
+    per_op = {}
+    for op in mix:
+        per_op[op] = summarize([r for r in all_records if r[0] == op], elapsed)
+        per_op[op]["errors"] = sum(1 for e in errors if e[0] == op)
+    total = summarize(all_records, elapsed)
+    total["errors"] = len(errors)
+
+    return {
+        "meta": {
+            "commit": git_revision(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "clients": args.clients, "duration": args.duration, "ops": args.ops, "mix": mix,
+            "small_size": args.small_size, "large_size": args.large_size,
+            "large_files": args.large_files, "update_size": args.update_size,
+            "shared_files": args.shared_files, "seed": args.seed, "server_args": args.server_arg,
+        },
+        "elapsed_sec": round(elapsed, 3),
+        "total": total,
+        "workloads": per_op,
+        "server": server.usage_summary(),
+        "error_samples": [f"{op}: {msg}" for op, msg in errors[:10]],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    def delta(new, old):
+        if baseline is None or new is None or not old:
+            return ''
+        return f" ({(new - old) / old * 100:+.1f}%)"
+
+    print(f"提交: {result['meta']['commit']}  客户端: {result['config']['clients']}  "
+          f"时长: {result['elapsed_sec']}s  负载: {result['config']['mix']}")
+    print(f"{'负载':<10}{'ops':>8}{'ops/s':>20}{'MB/s':>20}{'p50 ms':>20}{'p99 ms':>20}{'错误':>6}")
+    rows = list(result['workloads'].items()) + [('total', result['total'])]
+    for name, stats in rows:
+        old = (baseline['workloads'].get(name) if name != 'total' else baseline['total']) if baseline else {}
+        old = old or {}
+        print(f"{name:<10}{stats['ops']:>8}"
+              f"{str(stats['ops_per_sec']) + delta(stats['ops_per_sec'], old.get('ops_per_sec')):>20}"
+              f"{str(stats['mb_per_sec']) + delta(stats['mb_per_sec'], old.get('mb_per_sec')):>20}"
+              f"{str(stats['p50_ms']) + delta(stats['p50_ms'], old.get('p50_ms')):>20}"
+              f"{str(stats['p99_ms']) + delta(stats['p99_ms'], old.get('p99_ms')):>20}"
+              f"{stats['errors']:>6}")
+    server = result['server']
+    print(f"服务器: CPU {server['cpu_percent']}%  RSS 峰值 {server['rss_peak_mb']} MB")
+    for sample in result['error_samples']:
+        print(f"  错误示例: {sample}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="文件服务器负载测试")
+    parser.add_argument("--clients", type=int, default=8, help="并发客户端数量 (默认: 8)")
+    parser.add_argument("--duration", type=float, default=10.0, help="每轮压测时长，秒 (默认: 10)")
+    parser.add_argument("--ops", type=int, default=0, help="每个客户端最多执行的操作数，0 表示只按时长限制")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX,
+                        help=f"负载组合及权重 (默认: {DEFAULT_MIX})")
+    parser.add_argument("--small-size", type=int, default=4096, help="小文件上传大小，字节 (默认: 4096)")
+    parser.add_argument("--large-size", type=int, default=16 << 20, help="大文件下载大小，字节 (默认: 16MB)")
+    parser.add_argument("--large-files", type=int, default=2, help="预置大文件数量 (默认: 2)")
+    parser.add_argument("--update-size", type=int, default=65536, help="并发更新的文件大小，字节 (默认: 64KB)")
+    parser.add_argument("--shared-files", type=int, default=4, help="被并发更新的共享文件数量 (默认: 4)")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子 (默认: 1)")
+    parser.add_argument("--server-arg", action='append', default=[],
+                        help="透传给 server.py 的额外参数，可多次指定，例如 --server-arg=--foo")
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    parser.add_argument("--compare", type=str, help="与之前保存的结果 JSON 对比")
+    parser.add_argument("--keep", action='store_true', help="保留临时工作目录 (含服务器日志)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = run_benchmark(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0 if result['total']['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
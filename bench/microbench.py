@@ -0,0 +1,512 @@
+"""
+随数据规模增长的热点代码的微基准测试
+
+用例 (参数为文件数):
+    listing.scan          server.get_file_list 扫描平铺目录 (合成目录，首次运行时生成并复用)
+    listing.dumps         列表 JSON 编码
+    listing.loads         列表 JSON 解码
+    index.build           SEARCH/STAT 索引从存储列表建立 (内存中的合成列表)
+    index.search          在索引上执行前缀、通配符+大小、全表子串三种查询 (各返回至多 100 条)
+    index.stat            一次 STAT 查询 100 个文件名
+    protocol.read_request 服务器 RequestReader 解析连续发来的命令 (参数为命令数)
+    transfer.receive      服务器 receive_to_file (recv_into 方式) 接收一次上传并写入 /dev/null (参数为 KB)
+    transfer.send         服务器 send_from_file (readahead 方式) 从 /dev/zero 读取并发送一次下载 (参数为 KB)
+    client.list_files     客户端 FileClient 读取 OK_LIST 响应头和列表数据并解码
+    client.transfers      传输列表一次刷新: 十分之一的条目进行中并更新进度，再 sample() (参数为条目数)
+    ui.update_file_list   FilesWindow.update_file_list 填充表格 (Qt offscreen 平台，缺少 PySide6 时跳过)
+
+每个用例先预热，再重复运行直到累计超过 --min-time 秒 (至少 --min-rounds 轮)，
+记录每轮耗时的最小值、中位数、平均值和标准差；另用 tracemalloc 单独运行一轮测量峰值内存。
+transfer.* 用例的缓冲区来自预热时已经建立的 buffers.BufferPool，峰值内存即稳定状态下每次传输
+新分配的内存，接近 0 说明传输循环没有按数据块分配；被测版本没有缓冲池时按原来的方式分配。
+这两个用例设有峰值内存上限 (TRANSFER_PEAK_LIMIT_KB，小于一个数据块)，超出时标为
+"超出内存上限"，命令以非 0 状态退出。
+
+对比:
+    --compare old.json     与之前保存的结果对比，中位数变慢超过 --threshold 的用例标为回退
+    --against REV          在临时 git worktree 中用同一套用例测试 REV，再与当前代码对比
+
+用法:
+    python bench/microbench.py --sizes 10000,100000 --output micro.json
+    python bench/microbench.py --sizes 1000000 --filter listing
+    python bench/microbench.py --against HEAD~5 --threshold 10
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+import load_test
+
+DEFAULT_SIZES = '10000,100000'
+DEFAULT_UI_MAX = 10000              # 表格行数超过此值的 UI 用例跳过，每行都有两个按钮控件
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'yunpan_microbench')
+TRANSFER_PEAK_LIMIT_KB = 32         # transfer.* 每次传输新分配内存的上限，按数据块 (64KB) 分配时必然超出
+
+CASES = []
+
+
+def benchmark(name, ui=False, peak_limit_kb=None):
+    """
+    注册用例: 被装饰的函数接收 (规模, 上下文)，返回待计时的无参函数，或返回 (函数, 清理函数)；
+    peak_limit_kb 为一轮运行的峰值内存上限，超出时用例失败
+    """
+    def register(fn):
+        CASES.append((name, fn, ui, peak_limit_kb))
+        return fn
+    return register
+
+
+class SkipCase(Exception):
+    """ 当前环境或被测版本无法运行该用例 """
+
+
+# ---------------------------------------------------------------------------
+# 合成数据
+
+def synthetic_listing(count, seed=1):
+    """ 与 get_file_list 结构相同的合成列表，文件大小和修改时间随机 """
+    rng = random.Random(seed)
+    base = 1.7e9
+    return [{
+        "name": f"file_{i:07d}_{rng.getrandbits(32):08x}.dat",
+        "size": rng.randint(0, 1 << 32),
+        "mtime": base + rng.random() * 1e7,
+        "etag": f"{rng.getrandbits(32):x}-{rng.getrandbits(60):x}",
+    } for i in range(count)]
+
+
+def synthetic_directory(workdir, count):
+    """ 生成含 count 个空文件的平铺目录，已存在且数量一致时直接复用 """
+    path = os.path.join(workdir, f'flat_{count}')
+    marker = os.path.join(workdir, f'flat_{count}.done')
+    if os.path.exists(marker):
+        return path
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    for i in range(count):
+        os.close(os.open(os.path.join(path, f'file_{i:07d}.dat'), os.O_CREAT | os.O_WRONLY, 0o644))
+    open(marker, 'w').close()
+    return path
+
+
+class BufferSocket:
+    """ 从内存中的字节串读数据的套接字替身，只实现 recv/recv_into """
+
+    def __init__(self, data, chunk=65536):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunk = chunk
+
+    def recv(self, size):
+        n = min(size, self.chunk, len(self.data) - self.pos)
+        piece = bytes(self.data[self.pos:self.pos + n])
+        self.pos += n
+        return piece
+
+    def recv_into(self, buf, size=0):
+        n = min(size or len(buf), self.chunk, len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def sendall(self, data):
+        pass
+
+
+class NullSocket:
+    """ 丢弃发送的数据、接收时假装收到 total 字节 (缓冲区内容不变) 的套接字替身 """
+
+    def __init__(self, total=0):
+        self.remaining = total
+
+    def recv_into(self, buf, size=0):
+        n = min(size or len(buf), self.remaining)
+        self.remaining -= n
+        return n
+
+    def sendall(self, data):
+        pass
+
+
+def transfer_pool():
+    """ 被测版本有 buffers.BufferPool 时返回它，否则返回 None """
+    if not os.path.exists('/dev/zero'):
+        raise SkipCase("需要 /dev/zero 和 /dev/null")
+    try:
+        from buffers import BufferPool
+    except ImportError:
+        return None
+    return BufferPool()
+
+
+# ---------------------------------------------------------------------------
+# 用例
+
+@benchmark('listing.scan')
+def bench_listing_scan(count, ctx):
+    from server import get_file_list
+    from storage import FlatDirectoryStorage
+    storage = FlatDirectoryStorage(synthetic_directory(ctx.workdir, count))
+    return lambda: get_file_list(storage)
+
+
+@benchmark('listing.dumps')
+def bench_listing_dumps(count, ctx):
+    files = synthetic_listing(count)
+    return lambda: json.dumps(files).encode('utf-8')
+
+
+@benchmark('listing.loads')
+def bench_listing_loads(count, ctx):
+    data = json.dumps(synthetic_listing(count)).encode('utf-8')
+    return lambda: json.loads(data.decode('utf-8'))
+
+
+class ListingStorage:
+    """ 只实现 list() 的存储替身，返回合成列表对应的 FileInfo """
+
+    def __init__(self, count):
+        from storage import FileInfo
+        self.infos = [FileInfo(f["name"], f["size"], int(f["mtime"] * 1e9)) for f in synthetic_listing(count)]
+
+    def list(self):
+        return self.infos
+
+    def describe(self):
+        return "synthetic"
+
+
+def built_index(count):
+    try:
+        from index import FileIndex
+    except ImportError:
+        raise SkipCase("被测版本没有 index.FileIndex")
+    index = FileIndex(ListingStorage(count), rescan_interval=0)
+    index.rebuild()
+    return index
+
+
+@benchmark('index.build')
+def bench_index_build(count, ctx):
+    index = built_index(count)
+    return index.rebuild
+
+
+@benchmark('index.search')
+def bench_index_search(count, ctx):
+    index = built_index(count)
+
+    def run():
+        index.search(prefix='file_00012', limit=100)
+        index.search(glob='*_0000*.dat', min_size=1 << 31, limit=100)
+        index.search(contains='ffff', limit=100)
+    return run
+
+
+@benchmark('index.stat')
+def bench_index_stat(count, ctx):
+    index = built_index(count)
+    rng = random.Random(2)
+    names = [info.name for info in rng.sample(index.storage.infos, min(100, count))]
+    return lambda: index.stat_many(names)
+
+
+@benchmark('protocol.read_request')
+def bench_read_request(count, ctx):
+    try:
+        from protocol import RequestReader
+    except ImportError:
+        raise SkipCase("被测版本没有 protocol.RequestReader")
+    data = b''.join(f"DOWNLOAD_FILE|file_{i:07d}.dat\n".encode('utf-8') for i in range(count))
+
+    def run():
+        reader = RequestReader(BufferSocket(data))
+        for _ in range(count):
+            reader.read_request()
+    return run
+
+
+@benchmark('transfer.receive', peak_limit_kb=TRANSFER_PEAK_LIMIT_KB)
+def bench_transfer_receive(kb, ctx):
+    from transfer import receive_to_file
+    pool = transfer_pool()
+    kwargs = {"buffer": pool.connection().chunk} if pool else {}
+    sink = open(os.devnull, 'wb')
+
+    def run():
+        receive_to_file(NullSocket(kb << 10), sink, kb << 10, 'recv_into', **kwargs)
+    return run, sink.close
+
+
+@benchmark('transfer.send', peak_limit_kb=TRANSFER_PEAK_LIMIT_KB)
+def bench_transfer_send(kb, ctx):
+    from readahead import send_from_file
+    pool = transfer_pool()
+    kwargs = {"pool": pool} if pool else {}
+    source = open('/dev/zero', 'rb', buffering=0)
+
+    def run():
+        send_from_file(NullSocket(), source, 0, kb << 10, 'readahead', **kwargs)
+    return run, source.close
+
+
+@benchmark('client.list_files')
+def bench_client_list_files(count, ctx):
+    from common.core import FileClient
+    body = json.dumps(synthetic_listing(count)).encode('utf-8')
+    response = f"OK_LIST|{len(body)}\n".encode('utf-8') + body
+
+    def run():
+        client = FileClient()
+        client.sock = BufferSocket(response)
+        client.list_files()
+    return run
+
+
+@benchmark('client.transfers')
+def bench_client_transfers(count, ctx):
+    try:
+        from common.transfers import TransferList
+    except ImportError:
+        raise SkipCase("被测版本没有 common.transfers")
+    transfers = TransferList()
+    ids = [transfers.add('download', f'file_{i:07d}.dat', 1 << 30) for i in range(count)]
+    active = ids[::10]
+    for transfer_id in active:
+        transfers.start(transfer_id)
+    transfers.sample()
+    done = [0]
+
+    def run():
+        done[0] += 65536
+        for transfer_id in active:
+            transfers.progress(transfer_id, done[0], 1 << 30)
+        transfers.sample()
+    return run
+
+
+@benchmark('ui.update_file_list', ui=True)
+def bench_update_file_list(count, ctx):
+    if count > ctx.ui_max:
+        raise SkipCase(f"超过 --ui-max ({ctx.ui_max})")
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PySide6.QtWidgets import QApplication
+        from common.network import NetworkThread
+        from view.files_window import FilesWindow
+    except ImportError as e:
+        raise SkipCase(f"缺少图形界面依赖: {e}")
+    app = QApplication.instance() or QApplication([])
+    # 指向一个没有服务器监听的端口，窗口只用于填充表格
+    window = FilesWindow('127.0.0.1', load_test.find_free_port(), NetworkThread())
+    files = synthetic_listing(count)
+
+    def run():
+        window.update_file_list(files)
+        app.processEvents()
+
+    def cleanup():
+        window.notifier.stop()
+        window.close()
+    return run, cleanup
+
+
+# ---------------------------------------------------------------------------
+# 运行与对比
+
+class Context:
+    def __init__(self, workdir, ui_max):
+        self.workdir = workdir
+        self.ui_max = ui_max
+
+
+def measure(fn, min_time, min_rounds, max_rounds):
+    fn()        # 预热
+    gc.collect()
+    rounds = []
+    total = 0.0
+    while len(rounds) < min_rounds or (total < min_time and len(rounds) < max_rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        rounds.append(elapsed)
+        total += elapsed
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "rounds": len(rounds),
+        "min_ms": round(min(rounds) * 1000, 4),
+        "median_ms": round(statistics.median(rounds) * 1000, 4),
+        "mean_ms": round(statistics.mean(rounds) * 1000, 4),
+        "stddev_ms": round(statistics.stdev(rounds) * 1000, 4) if len(rounds) > 1 else 0.0,
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_suite(args):
+    # 被测代码 (server 与 client 目录) 来自 --repo-root，可以是另一个版本的 worktree
+    sys.path.insert(0, os.path.join(args.repo_root, 'client'))
+    sys.path.insert(0, os.path.join(args.repo_root, 'server'))
+    os.makedirs(args.workdir, exist_ok=True)
+    # server.py 导入时会在当前目录创建日志目录，切到工作目录中
+    os.chdir(args.workdir)
+    ctx = Context(args.workdir, args.ui_max)
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    results = []
+    for name, factory, _, peak_limit_kb in CASES:
+        if args.filter and args.filter not in name:
+            continue
+        for size in sizes:
+            entry = {"case": name, "size": size}
+            cleanup = None
+            try:
+                fn = factory(size, ctx)
+                if isinstance(fn, tuple):
+                    fn, cleanup = fn
+                entry.update(measure(fn, args.min_time, args.min_rounds, args.max_rounds))
+                if peak_limit_kb is not None and entry["peak_kb"] > peak_limit_kb:
+                    entry["over_limit_kb"] = peak_limit_kb
+            except SkipCase as e:
+                entry["skipped"] = str(e)
+            except Exception as e:
+                entry["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                if cleanup is not None:
+                    cleanup()
+            results.append(entry)
+            print_entry(entry)
+    return results
+
+
+def print_entry(entry):
+    label = f"{entry['case']}[{entry['size']}]"
+    if "median_ms" in entry:
+        print(f"{label:<34} 中位数 {entry['median_ms']:>11.3f} ms  最小 {entry['min_ms']:>11.3f} ms  "
+              f"±{entry['stddev_ms']:>9.3f}  峰值内存 {entry['peak_kb']:>10.1f} KB  ({entry['rounds']} 轮)"
+              + (f"  <- 超出内存上限 {entry['over_limit_kb']} KB" if "over_limit_kb" in entry else ""),
+              flush=True)
+    else:
+        print(f"{label:<34} {'跳过' if 'skipped' in entry else '出错'}: {entry.get('skipped') or entry.get('error')}",
+              flush=True)
+
+
+def compare(current, baseline, threshold):
+    """ 打印两组结果的对比，返回回退的用例列表 """
+    old = {(e["case"], e["size"]): e for e in baseline if "median_ms" in e}
+    regressions = []
+    print(f"\n{'用例':<34}{'旧 ms':>12}{'新 ms':>12}{'变化':>9}{'内存变化':>10}")
+    for e in current:
+        key = (e["case"], e["size"])
+        if "median_ms" not in e or key not in old:
+            continue
+        before = old[key]
+        change = (e["median_ms"] - before["median_ms"]) / before["median_ms"] * 100 if before["median_ms"] else 0.0
+        mem = (e["peak_kb"] - before["peak_kb"]) / before["peak_kb"] * 100 if before["peak_kb"] else 0.0
+        flag = "  <- 回退" if change > threshold else ""
+        print(f"{e['case'] + '[' + str(e['size']) + ']':<34}{before['median_ms']:>12.3f}{e['median_ms']:>12.3f}"
+              f"{change:>+8.1f}%{mem:>+9.1f}%{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def run_against(args, argv):
+    """ 在临时 worktree 中测试 args.against 指定的版本，返回其结果 """
+    worktree = tempfile.mkdtemp(prefix='yunpan_microbench_rev_')
+    output = os.path.join(worktree, 'baseline.json')
+    subprocess.check_call(['git', 'worktree', 'add', '--detach', worktree, args.against],
+                          cwd=load_test.REPO_ROOT, stdout=subprocess.DEVNULL)
+    try:
+        # 只去掉 --against/--compare/--output 及其取值，其余参数原样传给子进程
+        passthrough = []
+        skip = False
+        for arg in argv:
+            if skip:
+                skip = False
+                continue
+            key = arg.split('=', 1)[0]
+            if key in ('--against', '--compare', '--output'):
+                skip = '=' not in arg
+                continue
+            passthrough.append(arg)
+        # 旧版本超出内存上限时子进程返回 1，结果照常保存
+        command = [sys.executable, os.path.abspath(__file__), *passthrough, '--repo-root', worktree, '--output', output]
+        returncode = subprocess.call(command)
+        if returncode not in (0, 1):
+            raise subprocess.CalledProcessError(returncode, command)
+        with open(output, encoding='utf-8') as f:
+            return json.load(f)["results"]
+    finally:
+        subprocess.call(['git', 'worktree', 'remove', '--force', worktree], cwd=load_test.REPO_ROOT)
+        shutil.rmtree(worktree, ignore_errors=True)
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    parser = argparse.ArgumentParser(description="随数据规模增长的热点代码的微基准测试")
+    parser.add_argument("--sizes", type=str, default=DEFAULT_SIZES, help=f"规模，逗号分隔 (默认: {DEFAULT_SIZES})")
+    parser.add_argument("--filter", type=str, help="只运行名称包含该字符串的用例")
+    parser.add_argument("--min-time", type=float, default=1.0, help="每个用例至少累计运行的秒数 (默认: 1)")
+    parser.add_argument("--min-rounds", type=int, default=3, help="每个用例至少运行的轮数 (默认: 3)")
+    parser.add_argument("--max-rounds", type=int, default=1000, help="每个用例最多运行的轮数 (默认: 1000)")
+    parser.add_argument("--ui-max", type=int, default=DEFAULT_UI_MAX,
+                        help=f"UI 用例的最大行数 (默认: {DEFAULT_UI_MAX})")
+    parser.add_argument("--workdir", type=str, default=DEFAULT_WORKDIR,
+                        help="合成目录的存放位置，生成后重复使用 (默认: 系统临时目录)")
+    parser.add_argument("--repo-root", type=str, default=load_test.REPO_ROOT, help=argparse.SUPPRESS)
+    parser.add_argument("--output", type=str, help="结果 JSON 保存路径")
+    parser.add_argument("--compare", type=str, help="与之前保存的结果 JSON 对比")
+    parser.add_argument("--against", type=str, help="与指定 git 版本的结果对比")
+    parser.add_argument("--threshold", type=float, default=10.0, help="中位数变慢超过该百分比视为回退 (默认: 10)")
+    args = parser.parse_args(argv)
+    args.repo_root = os.path.abspath(args.repo_root)
+    args.workdir = os.path.abspath(args.workdir)
+
+    baseline = None
+    if args.against:
+        baseline = run_against(args, argv)
+    elif args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+
+    results = run_suite(args)
+    if args.output:
+        meta = {"git_commit": load_test.git_revision(), "python": platform.python_version(),
+                "platform": platform.platform(), "repo_root": args.repo_root}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+    status = 0
+    over_limit = [e for e in results if "over_limit_kb" in e]
+    if over_limit:
+        print(f"\n{len(over_limit)} 个用例的峰值内存超出上限")
+        status = 1
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 个用例变慢超过 {args.threshold}%")
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+请求追踪的汇总与回放
+
+读取服务器 (--trace-file) 或图形客户端 (--trace-file) 写出的 JSONL 追踪记录:
+
+    summary   按 (端, 命令) 汇总请求数、错误数、p50/p99 耗时和吞吐，列出各阶段耗时占比
+              以及最慢的若干个请求，判断时间花在磁盘、网络还是等待对端
+    replay    把服务器追踪中记录的请求组合 (命令、文件名、大小、时间间隔、所属连接)
+              回放到一个测试服务器上，复现线上负载。默认在临时目录中启动 server/server.py，
+              也可以用 --host/--port 指向已有服务器；下载所需的文件会先按记录的大小上传
+
+用法:
+    python bench/trace_replay.py summary server_trace.jsonl client_trace.jsonl --top 10
+    python bench/trace_replay.py replay server_trace.jsonl --speed 2 --output replay.json
+    python bench/trace_replay.py replay server_trace.jsonl --server-args="--recv-mode=copy"
+"""
+import argparse
+import json
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import load_test
+
+# 追踪中的命令 -> 回放时的操作
+REPLAY_OPS = {
+    "LIST_FILES": "list",
+    "DOWNLOAD_FILE": "download",
+    "DOWNLOAD_IF_CHANGED": "download",
+    "DOWNLOAD_RANGE": "download",
+    "UPLOAD_FILE": "upload",
+    "UPDATE_FILE": "update",
+    "UPLOAD_INLINE": "inline",
+    "UPDATE_INLINE": "update_inline",
+}
+
+
+def load_traces(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def summarize(records, top=10):
+    groups = {}
+    for r in records:
+        groups.setdefault((r.get("side", "server"), r["cmd"]), []).append(r)
+
+    commands = []
+    for (side, cmd), items in sorted(groups.items()):
+        totals = sorted(r["total_ms"] for r in items)
+        elapsed_ms = sum(totals)
+        nbytes = sum(r.get("bytes", 0) for r in items)
+        spans = {}
+        for r in items:
+            for name, ms in r["spans"].items():
+                spans[name] = spans.get(name, 0.0) + ms
+        commands.append({
+            "side": side,
+            "cmd": cmd,
+            "count": len(items),
+            "errors": sum(1 for r in items if r.get("status") != "ok"),
+            "p50_ms": load_test.percentile(totals, 50),
+            "p99_ms": load_test.percentile(totals, 99),
+            "mb_per_s": round(nbytes / 1048576 / (elapsed_ms / 1000), 2) if elapsed_ms else None,
+            # 各阶段占该命令总耗时的比例；未计入任何阶段的部分为协议处理和日志等开销
+            "span_share": {name: round(ms / elapsed_ms, 3) if elapsed_ms else None
+                           for name, ms in sorted(spans.items(), key=lambda kv: -kv[1])},
+        })
+
+    slowest = sorted(records, key=lambda r: -r["total_ms"])[:top]
+    return {
+        "requests": len(records),
+        "commands": commands,
+        "slowest": [{
+            "side": r.get("side", "server"), "cmd": r["cmd"], "name": r.get("name"),
+            "total_ms": r["total_ms"], "bytes": r.get("bytes", 0),
+            "dominant": max(r["spans"].items(), key=lambda kv: kv[1])[0] if r["spans"] else None,
+        } for r in slowest],
+    }
+
+
+def print_summary(summary):
+    print(f"共 {summary['requests']} 个请求")
+    print(f"{'端':<7}{'命令':<22}{'次数':>7}{'错误':>6}{'p50 ms':>10}{'p99 ms':>10}{'MB/s':>9}  主要阶段")
+    for c in summary["commands"]:
+        shares = ", ".join(f"{k} {v:.0%}" for k, v in list(c["span_share"].items())[:3] if v is not None)
+        mbps = f"{c['mb_per_s']:.1f}" if c["mb_per_s"] is not None else "-"
+        print(f"{c['side']:<7}{c['cmd']:<22}{c['count']:>7}{c['errors']:>6}"
+              f"{c['p50_ms']:>10.2f}{c['p99_ms']:>10.2f}{mbps:>9}  {shares}")
+    if summary["slowest"]:
+        print("最慢的请求:")
+        for r in summary["slowest"]:
+            print(f"  {r['total_ms']:>10.2f} ms  {r['side']:<7}{r['cmd']:<20}{r['name'] or '':<30} "
+                  f"{r['bytes']:>12} 字节  主要阶段: {r['dominant']}")
+
+
+def build_plan(records):
+    """ 从服务器追踪生成回放计划: 按原连接分组，保留请求顺序和相对时间 """
+    server_records = [r for r in records if r.get("side", "server") == "server"]
+    if not server_records:
+        return [], {}, 0
+    t0 = server_records[0]["ts"]
+    connections = {}
+    sizes = {}          # 需要预先存在的文件 -> 大小
+    skipped = 0
+    for r in server_records:
+        op = REPLAY_OPS.get(r["cmd"])
+        if op is None or r.get("status") != "ok":
+            skipped += 1
+            continue
+        name = r.get("name")
+        nbytes = r.get("bytes", 0)
+        if op == "download":
+            sizes[name] = max(sizes.get(name, 0), nbytes)
+        connections.setdefault(r["conn"], []).append((r["ts"] - t0, op, name, nbytes))
+    return list(connections.values()), sizes, skipped
+
+
+def replay_connection(host, port, requests, start, speed, payload, results, errors, lock):
+    """ 在一条连接上按原来的顺序和时间间隔重放请求 """
+    client = load_test.BenchClient(host, port)
+    try:
+        for offset, op, name, nbytes in requests:
+            due = start + offset / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lag = max(0.0, time.monotonic() - due)
+            began = time.perf_counter()
+            try:
+                if op == "list":
+                    _, nbytes = client.list_files()
+                elif op == "download":
+                    nbytes = client.download(name)
+                elif op in ("inline", "update_inline"):
+                    client.upload_inline(name, payload[:nbytes],
+                                         "UPDATE_INLINE" if op == "update_inline" else "UPLOAD_INLINE")
+                else:
+                    client.upload(name, payload[:nbytes], "UPDATE_FILE" if op == "update" else "UPLOAD_FILE")
+            except (OSError, RuntimeError) as e:
+                with lock:
+                    errors.append((op, str(e)))
+                return
+            with lock:
+                results.append((op, time.perf_counter() - began, nbytes, lag))
+    finally:
+        client.close()
+
+
+def run_replay(args):
+    records = load_traces(args.traces)
+    connections, sizes, skipped = build_plan(records)
+    if not connections:
+        raise SystemExit("追踪中没有可回放的服务器请求")
+    largest = max([nbytes for reqs in connections for _, _, _, nbytes in reqs] + list(sizes.values()) + [1])
+    payload = memoryview(os.urandom(largest))
+
+    workdir = None
+    server = None
+    host, port = args.host, args.port
+    if port is None:
+        workdir = tempfile.mkdtemp(prefix='yunpan_replay_')
+        host, port = '127.0.0.1', load_test.find_free_port()
+        server = load_test.ServerProcess(workdir, port, shlex.split(args.server_args or ''))
+        server.start()
+    try:
+        seeder = load_test.BenchClient(host, port)
+        try:
+            for name, size in sizes.items():
+                seeder.upload(name, payload[:size])
+        finally:
+            seeder.close()
+
+        results, errors, lock = [], [], threading.Lock()
+        if server is not None:
+            server.start_sampling()
+        start = time.monotonic()
+        workers = min(len(connections), args.max_connections)
+        with ThreadPoolExecutor(workers) as pool:
+            for requests in connections:
+                pool.submit(replay_connection, host, port, requests, start, args.speed,
+                            payload, results, errors, lock)
+        elapsed = time.monotonic() - start
+        if server is not None:
+            server.stop_sampling()
+    finally:
+        if server is not None:
+            server.stop()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    original = max(reqs[-1][0] for reqs in connections)
+    per_op = {}
+    for op in sorted({r[0] for r in results}):
+        latencies = sorted(r[1] * 1000 for r in results if r[0] == op)
+        per_op[op] = {
+            "count": len(latencies),
+            "p50_ms": round(load_test.percentile(latencies, 50), 3),
+            "p99_ms": round(load_test.percentile(latencies, 99), 3),
+            "bytes": sum(r[2] for r in results if r[0] == op),
+        }
+    return {
+        "requests": len(results),
+        "connections": len(connections),
+        "skipped": skipped,
+        "errors": len(errors),
+        "error_samples": [f"{op}: {msg}" for op, msg in errors[:10]],
+        "original_span_s": round(original, 3),
+        "replay_s": round(elapsed, 3),
+        "speed": args.speed,
+        # 调度滞后: 请求实际发出时间晚于计划时间的程度，过大说明回放端或服务器跟不上
+        "lag_p99_ms": round(load_test.percentile(sorted(r[3] * 1000 for r in results), 99) or 0, 3),
+        "operations": per_op,
+        "server": server.usage_summary() if server is not None else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="请求追踪的汇总与回放")
+    sub = parser.add_subparsers(dest="action", required=True)
+
+    p_summary = sub.add_parser("summary", help="汇总追踪记录")
+    p_summary.add_argument("traces", nargs='+', help="JSONL 追踪文件")
+    p_summary.add_argument("--top", type=int, default=10, help="列出最慢的请求数 (默认: 10)")
+    p_summary.add_argument("--output", type=str, help="汇总结果 JSON 保存路径")
+
+    p_replay = sub.add_parser("replay", help="把服务器追踪中的请求组合回放到测试服务器")
+    p_replay.add_argument("traces", nargs='+', help="服务器写出的 JSONL 追踪文件")
+    p_replay.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，2 表示时间间隔减半 (默认: 1)")
+    p_replay.add_argument("--max-connections", type=int, default=64, help="同时回放的连接数上限 (默认: 64)")
+    p_replay.add_argument("--host", type=str, default='127.0.0.1', help="已有服务器的地址 (需同时指定 --port)")
+    p_replay.add_argument("--port", type=int, default=None, help="已有服务器的端口，不指定时启动临时服务器")
+    p_replay.add_argument("--server-args", type=str, default='', help="传给临时服务器的额外参数")
+    p_replay.add_argument("--output", type=str, help="回放结果 JSON 保存路径")
+    args = parser.parse_args(argv)
+
+    if args.action == "summary":
+        result = summarize(load_traces(args.traces), args.top)
+        print_summary(result)
+    else:
+        result = run_replay(args)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"meta": {"git_commit": load_test.git_revision()}, "result": result},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
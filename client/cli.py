@@ -0,0 +1,381 @@
+"""
+云盘命令行工具
+
+基于 common.core 的无界面客户端，不加载任何 Qt 模块，适合批处理和 CI 使用。
+多个文件的传输会通过多条连接并行进行 (-j 指定并发数)。
+
+用法:
+    python cli.py [--host H] [--port P] [-j N] ls [--json]
+    python cli.py get NAME [NAME ...] [-o DIR] [--sparse]
+    python cli.py get NAME --version V [-o DIR]
+    python cli.py versions NAME [--json]
+    python cli.py find [--prefix P] [--contains S] [--glob G] [--min-size N] [--max-size N]
+                       [--after T] [--before T] [--limit N] [--json]
+    python cli.py stat NAME [NAME ...] [--json]
+    python cli.py put FILE [FILE ...] [--update] [--streams N] [--part-size MB] [--pipeline]
+    python cli.py sync LOCAL_DIR
+    python cli.py stats
+    python cli.py cluster status | join HOST:PORT | leave HOST:PORT
+
+服务器以集群模式运行时，get / put 按一致性哈希直接连到每个文件的所有者节点。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from common.core import (
+    ClientPool, FileClient, ServerError, upload_multipart,
+    DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, DEFAULT_TIMEOUT, DEFAULT_PART_SIZE
+)
+from common.cache import ContentCache, DEFAULT_CACHE_SIZE
+from common.cluster import ClusterPool
+from common.sync import sync_directory, MANIFEST_NAME
+
+logger = logging.getLogger('client_logger')
+
+
+def format_size(size):
+    """ 将字节大小转换为更友好的显示格式 """
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            return f"{size:.2f} {unit}" if unit != 'B' else f"{size:.0f} {unit}"
+        size /= 1024.0
+    return f"{size:.2f} PB"
+
+
+def open_pool(args):
+    """ 服务器以集群模式运行时返回按文件名路由到所有者的 ClusterPool，否则连接 --host/--port """
+    with FileClient(args.host, args.port, args.timeout) as client:
+        cluster_info = client.hello().get("cluster")
+    if cluster_info:
+        return ClusterPool(cluster_info, size=args.jobs, timeout=args.timeout)
+    return ClientPool(args.host, args.port, size=args.jobs, timeout=args.timeout)
+
+
+def run_transfers(args, fn, items, describe, key=None):
+    """ 并行执行传输任务并打印每项结果与总吞吐量，返回失败数量；key(item) 为集群路由用的文件名 """
+    failures = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    with open_pool(args) as pool:
+        for item, nbytes, error in pool.map(fn, items, key):
+            if error is not None:
+                failures += 1
+                print(f"失败  {describe(item)}: {error}", file=sys.stderr)
+            else:
+                total_bytes += nbytes
+                print(f"完成  {describe(item)} ({format_size(nbytes)})")
+    elapsed = time.perf_counter() - started
+    if elapsed > 0 and items:
+        print(f"共 {len(items) - failures}/{len(items)} 个文件，{format_size(total_bytes)}，"
+              f"用时 {elapsed:.2f}s，平均 {format_size(total_bytes / elapsed)}/s")
+    return failures
+
+
+def cmd_ls(args):
+    with FileClient(args.host, args.port, args.timeout) as client:
+        files = client.list_files()
+    if args.json:
+        print(json.dumps(files, ensure_ascii=False, indent=2))
+        return 0
+    for info in sorted(files, key=lambda x: x['name']):
+        print(f"{info['size']:>14}  {info['name']}")
+    print(f"共 {len(files)} 个文件")
+    return 0
+
+
+def cmd_stats(args):
+    with FileClient(args.host, args.port, args.timeout) as client:
+        print(json.dumps(client.stats(), ensure_ascii=False, indent=2))
+    return 0
+
+
+def cmd_versions(args):
+    with FileClient(args.host, args.port, args.timeout) as client:
+        versions = client.list_versions(args.name)
+    if args.json:
+        print(json.dumps(versions, ensure_ascii=False, indent=2))
+        return 0
+    for info in versions:
+        mtime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['mtime']))
+        print(f"{info['version']:<28}  {mtime}  {info['size']:>14}")
+    print(f"共 {len(versions)} 个历史版本")
+    return 0
+
+
+def parse_time(text):
+    """ 把 'YYYY-MM-DD' 或 'YYYY-MM-DD HH:MM:SS' (本地时间) 转换为 Unix 秒 """
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"无法识别的时间: '{text}' (应为 YYYY-MM-DD 或 'YYYY-MM-DD HH:MM:SS')")
+
+
+def print_entries(files):
+    for info in files:
+        mtime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['mtime']))
+        print(f"{info['size']:>14}  {mtime}  {info['name']}")
+
+
+def cmd_find(args):
+    with FileClient(args.host, args.port, args.timeout) as client:
+        files, truncated = client.search(prefix=args.prefix, contains=args.contains, glob=args.glob,
+                                         min_size=args.min_size, max_size=args.max_size,
+                                         mtime_after=args.after, mtime_before=args.before, limit=args.limit)
+    if args.json:
+        print(json.dumps({"files": files, "truncated": truncated}, ensure_ascii=False, indent=2))
+        return 0
+    print_entries(files)
+    print(f"共 {len(files)} 个文件{'，还有更多结果未显示 (可增大 --limit)' if truncated else ''}")
+    return 0
+
+
+def cmd_stat(args):
+    with FileClient(args.host, args.port, args.timeout) as client:
+        entries = client.stat(args.names)
+    if args.json:
+        print(json.dumps(dict(zip(args.names, entries)), ensure_ascii=False, indent=2))
+    else:
+        print_entries([info for info in entries if info is not None])
+    missing = [name for name, info in zip(args.names, entries) if info is None]
+    for name in missing:
+        print(f"不存在  {name}", file=sys.stderr)
+    return 1 if missing else 0
+
+
+def cmd_get(args):
+    os.makedirs(args.output, exist_ok=True)
+    if args.version:
+        if len(args.names) != 1:
+            print("错误: --version 只能用于单个文件", file=sys.stderr)
+            return 1
+        name = args.names[0]
+        save_path = os.path.join(args.output, os.path.basename(name))
+        with FileClient(args.host, args.port, args.timeout) as client:
+            size = client.download_version(name, args.version, save_path)
+        print(f"完成  {name}@{args.version} ({format_size(size)})")
+        return 0
+
+    cache = None
+    if args.cache_dir:
+        cache = ContentCache(args.cache_dir, args.cache_size << 20, namespace=f"{args.host}:{args.port}")
+
+    def download(client, name):
+        save_path = os.path.join(args.output, os.path.basename(name))
+        if args.sparse:
+            return client.download_sparse(name, save_path)
+        return client.download(name, save_path, cache=cache)
+
+    try:
+        return 1 if run_transfers(args, download, args.names, lambda name: name) else 0
+    finally:
+        if cache is not None:
+            cache.flush()
+            print(f"缓存命中 {cache.hits} 次，未命中 {cache.misses} 次")
+
+
+def cmd_put(args):
+    missing = [path for path in args.files if not os.path.isfile(path)]
+    for path in missing:
+        print(f"失败  本地文件 '{path}' 不存在", file=sys.stderr)
+    paths = [path for path in args.files if path not in missing]
+
+    if args.pipeline:
+        return 1 if put_pipelined(args, paths) or missing else 0
+
+    part_size = args.part_size << 20
+
+    def upload(client, path):
+        size = os.path.getsize(path)
+        if args.streams > 1 and size > part_size:
+            # 大文件切成分片，另开 streams 条连接并行上传
+            upload_multipart(args.host, args.port, path, os.path.basename(path), args.streams,
+                             part_size, timeout=args.timeout)
+        else:
+            client.upload(path, os.path.basename(path), update=args.update)
+        return size
+
+    failures = run_transfers(args, upload, paths, lambda path: path, key=os.path.basename)
+    return 1 if failures or missing else 0
+
+
+def put_pipelined(args, paths):
+    """ 在一条连接上连续发出所有小文件的内联上传，不逐个等待确认，返回失败数量 """
+    failures = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    items = [(path, os.path.basename(path)) for path in paths]
+    sizes = {os.path.basename(path): os.path.getsize(path) for path in paths}
+    with FileClient(args.host, args.port, args.timeout) as client:
+        for name, _, error in client.upload_pipelined(items, update=args.update):
+            if error is not None:
+                failures += 1
+                print(f"失败  {name}: {error}", file=sys.stderr)
+            else:
+                total_bytes += sizes[name]
+                print(f"完成  {name} ({format_size(sizes[name])})")
+    elapsed = time.perf_counter() - started
+    if elapsed > 0 and items:
+        print(f"共 {len(items) - failures}/{len(items)} 个文件，{format_size(total_bytes)}，用时 {elapsed:.2f}s")
+    return failures
+
+
+def cmd_cluster(args):
+    with FileClient(args.host, args.port, args.timeout) as client:
+        info = client.hello().get("cluster")
+        if not info:
+            print("错误: 服务器没有以集群模式运行", file=sys.stderr)
+            return 1
+        nodes = list(info["nodes"])
+        if args.action == "status":
+            print(f"副本数 {info['replicas']}，共 {len(nodes)} 个节点")
+            for node in nodes:
+                host, _, port = node.rpartition(':')
+                try:
+                    with FileClient(host, int(port), args.timeout) as peer:
+                        stats = peer.stats().get("cluster") or {}
+                    print(f"{node:<24} 文件 {stats.get('local_files')}  待同步 {stats.get('queued')}  "
+                          f"已复制 {stats.get('replicated')}  已交出 {stats.get('handed_off')}  "
+                          f"转发 {stats.get('proxied')}  失败 {stats.get('failures')}")
+                except (OSError, ServerError) as e:
+                    print(f"{node:<24} 无法连接: {e}")
+            return 0
+        if not args.node:
+            print(f"错误: {args.action} 需要指定节点地址 HOST:PORT", file=sys.stderr)
+            return 1
+        if args.action == "join":
+            if args.node in nodes:
+                print(f"{args.node} 已在集群中")
+                return 0
+            nodes.append(args.node)
+        else:
+            if args.node not in nodes:
+                print(f"错误: {args.node} 不在集群中", file=sys.stderr)
+                return 1
+            nodes.remove(args.node)
+        print(client.set_cluster_nodes(nodes))
+    return 0
+
+
+def cmd_sync(args):
+    """ 基于清单把本地目录增量同步到服务器 """
+    if not os.path.isdir(args.local_dir):
+        print(f"本地目录 '{args.local_dir}' 不存在", file=sys.stderr)
+        return 1
+
+    def on_file_done(name, nbytes, error):
+        if error is not None:
+            print(f"失败  {name}: {error}", file=sys.stderr)
+        else:
+            print(f"完成  {name} ({format_size(nbytes)})")
+
+    result = sync_directory(args.local_dir, args.host, args.port, jobs=args.jobs,
+                            use_hash=args.hash, manifest_path=args.manifest,
+                            dry_run=args.dry_run, timeout=args.timeout, on_file_done=on_file_done)
+    if args.dry_run:
+        for name in result.uploaded:
+            print(f"待上传  {name}")
+    print(f"扫描 {result.scanned} 个文件，跳过 {result.skipped} 个，"
+          f"上传 {len(result.uploaded)} 个 ({format_size(result.bytes_uploaded)})，"
+          f"失败 {len(result.failed)} 个，用时 {result.elapsed:.2f}s")
+    return 1 if result.failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="云盘命令行工具")
+    parser.add_argument("--host", type=str, default=DEFAULT_SERVER_HOST,
+                        help=f"服务器地址 (默认: {DEFAULT_SERVER_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT,
+                        help=f"服务器端口 (默认: {DEFAULT_SERVER_PORT})")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="并行传输的连接数 (默认: 4)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"网络超时，秒 (默认: {DEFAULT_TIMEOUT})")
+    parser.add_argument("-v", "--verbose", action='store_true', help="输出调试日志")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ls_parser = sub.add_parser("ls", help="列出服务器上的文件")
+    ls_parser.add_argument("--json", action='store_true', help="以 JSON 格式输出")
+    ls_parser.set_defaults(func=cmd_ls)
+
+    get_parser = sub.add_parser("get", help="下载文件")
+    get_parser.add_argument("names", nargs='+', help="服务器上的文件名")
+    get_parser.add_argument("-o", "--output", type=str, default=".", help="保存目录 (默认: 当前目录)")
+    get_parser.add_argument("--cache-dir", type=str,
+                            help="启用本地内容缓存的目录，未变化的文件只需一次往返确认")
+    get_parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE >> 20,
+                            help=f"缓存上限，MB (默认: {DEFAULT_CACHE_SIZE >> 20})")
+    get_parser.add_argument("--version", type=str, help="下载指定的历史版本 (版本号见 versions 命令)")
+    get_parser.add_argument("--sparse", action='store_true',
+                            help="稀疏下载: 只传输有数据的区段，空洞在本地保持为空洞 (不使用内容缓存)")
+    get_parser.set_defaults(func=cmd_get)
+
+    versions_parser = sub.add_parser("versions", help="列出文件的历史版本")
+    versions_parser.add_argument("name", help="服务器上的文件名")
+    versions_parser.add_argument("--json", action='store_true', help="以 JSON 格式输出")
+    versions_parser.set_defaults(func=cmd_versions)
+
+    find_parser = sub.add_parser("find", help="在服务器端按条件查找文件")
+    find_parser.add_argument("--prefix", type=str, help="文件名前缀")
+    find_parser.add_argument("--contains", type=str, help="文件名包含的子串")
+    find_parser.add_argument("--glob", type=str, help="文件名通配符，例如 '*.log'")
+    find_parser.add_argument("--min-size", type=int, help="最小字节数")
+    find_parser.add_argument("--max-size", type=int, help="最大字节数")
+    find_parser.add_argument("--after", type=parse_time, help="修改时间不早于，YYYY-MM-DD[ HH:MM:SS]")
+    find_parser.add_argument("--before", type=parse_time, help="修改时间不晚于，YYYY-MM-DD[ HH:MM:SS]")
+    find_parser.add_argument("--limit", type=int, help="最多返回的文件数 (默认: 服务器决定，通常为 1000)")
+    find_parser.add_argument("--json", action='store_true', help="以 JSON 格式输出")
+    find_parser.set_defaults(func=cmd_find)
+
+    stat_parser = sub.add_parser("stat", help="一次查询多个文件的大小和修改时间")
+    stat_parser.add_argument("names", nargs='+', help="服务器上的文件名")
+    stat_parser.add_argument("--json", action='store_true', help="以 JSON 格式输出")
+    stat_parser.set_defaults(func=cmd_stat)
+
+    put_parser = sub.add_parser("put", help="上传文件")
+    put_parser.add_argument("files", nargs='+', help="本地文件路径")
+    put_parser.add_argument("--update", action='store_true', help="以更新方式覆盖服务器上的同名文件")
+    put_parser.add_argument("--streams", type=int, default=1,
+                            help="单个大文件分片并行上传的连接数，1 表示不分片 (默认: 1)")
+    put_parser.add_argument("--pipeline", action='store_true',
+                            help="在一条连接上连续发送多个小文件，不逐个等待确认")
+    put_parser.add_argument("--part-size", type=int, default=DEFAULT_PART_SIZE >> 20,
+                            help=f"分片大小，MB (默认: {DEFAULT_PART_SIZE >> 20})")
+    put_parser.set_defaults(func=cmd_put)
+
+    stats_parser = sub.add_parser("stats", help="查看服务器运行时统计")
+    stats_parser.set_defaults(func=cmd_stats)
+
+    cluster_parser = sub.add_parser("cluster", help="查看或修改集群成员")
+    cluster_parser.add_argument("action", choices=("status", "join", "leave"),
+                                help="status 查看各节点状态，join / leave 加入或移除节点 (随后自动重新平衡)")
+    cluster_parser.add_argument("node", nargs='?', help="加入或移除的节点地址 HOST:PORT")
+    cluster_parser.set_defaults(func=cmd_cluster)
+
+    sync_parser = sub.add_parser("sync", help="把本地目录同步到服务器")
+    sync_parser.add_argument("local_dir", help="本地目录")
+    sync_parser.add_argument("--hash", action='store_true',
+                             help="记录内容哈希，mtime 变化但内容未变的文件不会重新上传")
+    sync_parser.add_argument("--manifest", type=str, help=f"清单文件路径 (默认: 目录下的 {MANIFEST_NAME})")
+    sync_parser.add_argument("--dry-run", action='store_true', help="只列出需要上传的文件，不实际传输")
+    sync_parser.set_defaults(func=cmd_sync)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format='%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    try:
+        return args.func(args)
+    except (OSError, ServerError) as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
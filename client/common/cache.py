@@ -0,0 +1,138 @@
+"""
+客户端本地内容缓存
+
+以服务器给出的校验值 (ETag) 为键，把下载过的文件保存在本地缓存目录中。
+再次下载同一文件时，客户端带上缓存的 ETag 发起条件请求，服务器确认未变化后
+只回复一行 NOT_MODIFIED，文件直接从缓存复制到目标位置。
+
+缓存总大小有上限，超出时按最近最少使用 (LRU) 淘汰。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+DEFAULT_CACHE_DIR = 'clientinfo/cache'
+DEFAULT_CACHE_SIZE = 1 << 30            # 默认缓存上限 1GB
+INDEX_NAME = 'index.json'
+
+logger = logging.getLogger('client_logger')
+
+
+class ContentCache:
+    """ 按 LRU 淘汰、总大小受限的磁盘缓存，可被多个线程共享 """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE, namespace=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.namespace = namespace      # 一般为 "host:port"，避免不同服务器的同名文件冲突
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self._lock = threading.Lock()
+        self._dirty = False
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._entries = self._load_index()
+        self.total_bytes = sum(e["size"] for e in self._entries.values())
+        self.hits = 0                   # copy_to() 从缓存复制成功的次数
+        self.misses = 0                 # lookup() 时没有缓存条目的次数
+
+    def _key(self, filename):
+        return f"{self.namespace}/{filename}"
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 丢弃 blob 已经不存在的条目
+        return {k: e for k, e in entries.items()
+                if os.path.exists(os.path.join(self.blob_dir, e["blob"]))}
+
+    def flush(self):
+        """ 把索引写回磁盘 (先写临时文件再原子替换) """
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+
+    def lookup(self, filename):
+        """ 返回缓存中该文件的 ETag，没有缓存时返回 None """
+        with self._lock:
+            entry = self._entries.get(self._key(filename))
+            if entry is None:
+                self.misses += 1
+                return None
+            return entry["etag"]
+
+    def copy_to(self, filename, etag, dest_path):
+        """ 把缓存内容复制到 dest_path，成功返回文件大小，缓存缺失时返回 None """
+        with self._lock:
+            key = self._key(filename)
+            entry = self._entries.get(key)
+            if entry is None or entry["etag"] != etag:
+                return None
+            blob_path = os.path.join(self.blob_dir, entry["blob"])
+            entry["atime"] = time.time()
+            self._dirty = True
+        try:
+            shutil.copyfile(blob_path, dest_path)
+        except FileNotFoundError:
+            # blob 被外部删除，移除失效条目
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._remove(key)
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry["size"]
+
+    def store(self, filename, etag, src_path):
+        """ 把刚下载好的文件放入缓存；超过缓存上限的大文件不缓存 """
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return False
+        key = self._key(filename)
+        blob = hashlib.sha1(f"{key}\0{etag}".encode('utf-8')).hexdigest()
+        blob_path = os.path.join(self.blob_dir, blob)
+        tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, blob_path)
+
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self._remove(key, keep_blob=old["blob"] == blob)
+            self._entries[key] = {"etag": etag, "size": size, "blob": blob, "atime": time.time()}
+            self.total_bytes += size
+            self._dirty = True
+            self._evict()
+        self.flush()
+        return True
+
+    def _remove(self, key, keep_blob=False):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry["size"]
+        self._dirty = True
+        if not keep_blob:
+            try:
+                os.remove(os.path.join(self.blob_dir, entry["blob"]))
+            except OSError:
+                pass
+
+    def _evict(self):
+        """ 按最近使用时间从旧到新淘汰，直到总大小不超过上限 """
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["atime"]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            logger.debug(f"缓存淘汰: {key} ({entry['size']}字节)")
+            self._remove(key)
@@ -0,0 +1,112 @@
+"""
+集群模式的客户端路由
+
+服务器以 --cluster 启动时，HELLO 的 "cluster" 字段给出节点列表和副本数。这里用与服务器
+(server/cluster.py) 相同的一致性哈希算出每个文件的所有者，请求直接发给主节点，
+主节点无法连接时依次尝试其余副本，不必经过其他节点转发。
+"""
+import bisect
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.core import ClientPool, ServerError, _NETWORK_ERRORS, DEFAULT_TIMEOUT, CHUNK_SIZE
+
+DEFAULT_VNODES = 128
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """ 一致性哈希环，与服务器的 cluster.HashRing 算法相同 """
+
+    def __init__(self, nodes, vnodes=DEFAULT_VNODES):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [key for key, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owners(self, name, count):
+        """ 文件的所有者，主节点在前 """
+        count = min(count, len(self.nodes))
+        result = []
+        if not count:
+            return result
+        i = bisect.bisect(self._keys, _hash(name)) % len(self._keys)
+        while len(result) < count:
+            node = self._owners[i]
+            if node not in result:
+                result.append(node)
+            i = (i + 1) % len(self._keys)
+        return result
+
+
+class ClusterPool:
+    """
+    按文件名把任务交给所有者节点的连接池，接口与 ClientPool 相同，
+    map/run 另外需要从任务中取出文件名的 key
+    """
+
+    def __init__(self, cluster_info, size=4, timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE):
+        self.ring = HashRing(cluster_info["nodes"], cluster_info.get("vnodes", DEFAULT_VNODES))
+        self.replicas = cluster_info.get("replicas", 1)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._pools = {}            # 节点 -> ClientPool
+        self._lock = threading.Lock()
+
+    @property
+    def nodes(self):
+        return self.ring.nodes
+
+    def owners(self, name):
+        return self.ring.owners(name, self.replicas)
+
+    def _pool(self, node):
+        with self._lock:
+            pool = self._pools.get(node)
+            if pool is None:
+                host, _, port = node.rpartition(':')
+                pool = self._pools[node] = ClientPool(host, int(port), self.size, self.timeout, self.chunk_size)
+            return pool
+
+    def run(self, fn, *args, key, **kwargs):
+        """ 在 key 的主节点上执行 fn(client, *args)，连接失败时依次换到其余副本 """
+        last_error = None
+        for node in self.owners(key):
+            try:
+                return self._pool(node).run(fn, *args, **kwargs)
+            except _NETWORK_ERRORS as e:
+                last_error = e
+        if last_error is None:
+            raise ServerError("集群节点列表为空")
+        raise last_error
+
+    def map(self, fn, items, key=None):
+        """ 并行执行 fn(client, item)，key(item) 给出用于路由的文件名，默认就是 item 本身 """
+        key = key or (lambda item: item)
+
+        def task(item):
+            try:
+                return item, self.run(fn, item, key=key(item)), None
+            except (OSError, ServerError, ValueError) as e:
+                return item, None, e
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            yield from executor.map(task, items)
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,1108 @@
+"""
+与界面无关的协议客户端核心
+
+只依赖标准库，不加载任何 Qt 模块，可以被图形界面 (NetworkThread)、
+命令行工具 (cli.py) 和压测脚本共同使用。提供同步 (FileClient) 和
+asyncio (AsyncFileClient) 两套接口，以及用多条连接并行传输的 ClientPool。
+ResilientClient 在 FileClient 之上增加心跳、断线重连 (指数退避) 和
+幂等请求的自动重放，下载中断后用 DOWNLOAD_RANGE 从断点续传。
+
+协议约定 (每个响应头均以换行符结尾):
+    LIST_FILES                      -> OK_LIST|json_len\\n<json>
+    DOWNLOAD_FILE|filename          -> OK_DOWNLOAD|filesize\\n<data> 或 ERROR|msg\\n
+    DOWNLOAD_IF_CHANGED|etag|filename
+                                    -> NOT_MODIFIED|etag\\n 或 OK_DOWNLOAD|filesize|etag\\n<data>
+    UPLOAD_FILE|filename|filesize   -> READY_TO_RECEIVE\\n，发送数据后 -> OK|msg\\n 或 ERROR|msg\\n
+    UPDATE_FILE|filename|filesize   -> 同 UPLOAD_FILE
+    DOWNLOAD_RANGE|offset|etag|filename
+                                    -> OK_RANGE|offset|filesize|etag\\n<offset 之后的数据>，
+                                       etag 不一致时 -> OK_DOWNLOAD|filesize|etag\\n<data>
+    STATS                           -> OK_STATS|json_len\\n<json>
+    PING                            -> PONG\\n
+    SUBSCRIBE                       -> OK_SUBSCRIBED\\n，之后持续推送 EVENT|json_len\\n<json>
+    UPLOAD_BEGIN / UPLOAD_PART / UPLOAD_COMMIT / UPLOAD_ABORT
+                                    分片并行上传，见 upload_multipart() 和 server/multipart.py
+    HELLO                           -> OK_HELLO|json_len\\n{"inline_max", "features"}，
+                                       集群模式下另有 "cluster": {"nodes", "replicas", ...}
+    UPLOAD_INLINE|filename|filesize\\n<data>
+                                    -> OK|msg\\n 或 ERROR|msg\\n，不超过 inline_max 的文件
+                                       命令和内容一次发出，不等待 READY_TO_RECEIVE
+    UPDATE_INLINE|filename|filesize\\n<data>
+                                    -> 同 UPLOAD_INLINE
+
+FileClient 发送的命令都以换行符结尾，多个请求可以连续发出 (流水线)，
+服务器按顺序逐个响应；不带换行符的旧写法服务器同样接受。
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.tracing import NULL_TRACE
+from common.sparse import data_extents, is_sparse, encode_map, parse_map, DIGEST_SIZE
+
+CHUNK_SIZE = 65536                  # 单次收发的数据块大小
+DEFAULT_SERVER_HOST = '127.0.0.1'
+DEFAULT_SERVER_PORT = 65432
+DEFAULT_TIMEOUT = 5                 # 连接及读写超时 (秒)
+DEFAULT_PART_SIZE = 8 << 20         # 分片上传的默认分片大小
+DEFAULT_UPLOAD_STREAMS = 4          # 分片上传的默认并发连接数
+MULTIPART_THRESHOLD = 64 << 20      # 图形界面对不小于此大小的文件使用分片上传
+PIPELINE_WINDOW = 64                # 流水线内联上传时最多有多少个未确认的请求
+PART_RETRIES = 2                    # 单个分片校验失败或连接中断后的重传次数
+HEARTBEAT_INTERVAL = 30             # 空闲多久后发送一次 PING (秒)，需小于服务器的 --idle-timeout
+
+logger = logging.getLogger('client_logger')
+
+
+class ServerError(Exception):
+    """ 服务器返回 ERROR 或无法识别的响应 """
+
+
+class RetryableError(ServerError):
+    """ 服务器回复 ERROR|RETRY: 请求没有被处理 (例如服务器正在重启)，重新连接后可以安全重试 """
+
+
+def _split_status(line):
+    """ 把 'STATUS|payload' 拆开，ERROR 响应直接抛出 ServerError """
+    status, _, payload = line.partition('|')
+    if status == "ERROR":
+        reason, sep, message = payload.partition('|')
+        if sep and reason == "RETRY":
+            raise RetryableError(message)
+        raise ServerError(payload)
+    return status, payload
+
+
+def _download_request(filename, cache, known_etag, want_etag=False):
+    """ 不需要 ETag 时用 DOWNLOAD_FILE，有缓存或需要续传时用 DOWNLOAD_IF_CHANGED 以便拿到 ETag """
+    if cache is None and not want_etag:
+        return f"DOWNLOAD_FILE|{filename}".encode('utf-8')
+    return f"DOWNLOAD_IF_CHANGED|{known_etag or ''}|{filename}".encode('utf-8')
+
+
+def _enable_keepalive(sock, idle=60, interval=15, count=4):
+    """ 开启 TCP keepalive，平台不支持的选项直接跳过；与服务器的 utils.enable_keepalive 相同 """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        option = getattr(socket, name, None)
+        if option is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, option, value)
+            except OSError:
+                pass
+
+
+def _store_in_cache(cache, filename, etag, path):
+    if cache is None or not etag:
+        return
+    try:
+        cache.store(filename, etag, path)
+    except OSError as e:
+        logger.warning(f"写入缓存失败 '{filename}': {e}")
+
+
+def _report(progress, done, total):
+    if progress is not None:
+        progress(done, total)
+
+
+class DownloadState:
+    """ 一次下载的进度: 已写入本地文件的字节数和服务器文件版本，用于断线后续传 """
+
+    def __init__(self):
+        self.offset = 0
+        self.total = None
+        self.etag = None
+
+    @property
+    def resumable(self):
+        return self.offset > 0 and bool(self.etag)
+
+
+class FileClient:
+    """ 同步协议客户端，一个实例对应一条 TCP 连接，不是线程安全的 """
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT,
+                 timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.sock = None
+        self._buffer = bytearray()
+        self.capabilities = None    # HELLO 协商得到的服务器功能，首次需要时获取
+        self.trace = NULL_TRACE     # 当前请求的追踪记录 (见 common.tracing)，由调用方设置
+
+    @property
+    def is_connected(self):
+        return self.sock is not None
+
+    def connect(self):
+        """ 连接到服务器，已连接时先关闭旧连接 """
+        self.close()
+        with self.trace.span('connect'):
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        _enable_keepalive(self.sock)
+        logger.info(f"已连接到 {self.host}:{self.port}")
+        return self
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self._buffer.clear()
+
+    def peer_closed(self):
+        """ 对端是否已关闭空闲的连接 (例如服务器重启前关闭了空闲连接)；只检查，不阻塞 """
+        if self.sock is None:
+            return True
+        if self._buffer:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            return bool(readable) and self.sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+
+    def __enter__(self):
+        if not self.is_connected:
+            self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _send(self, command, body=b''):
+        """ 发送以换行符结尾的命令；body 紧跟在命令之后，与命令一起一次写出 """
+        if self.sock is None:
+            raise ConnectionError("未连接到服务器")
+        with self.trace.span('net_send'):
+            self.sock.sendall(command + b'\n' + body if body else command + b'\n')
+
+    def _read_line(self):
+        """ 读取一行响应头，多读到的数据保留在缓冲区中 """
+        while True:
+            index = self._buffer.find(b'\n')
+            if index >= 0:
+                line = bytes(self._buffer[:index])
+                del self._buffer[:index + 1]
+                return line.decode('utf-8')
+            with self.trace.span('server_wait'):
+                chunk = self.sock.recv(self.chunk_size)
+            if not chunk:
+                raise ConnectionError("接收响应头时连接中断")
+            self._buffer += chunk
+
+    def _read_exact(self, size):
+        """ 读取指定大小的数据体 """
+        data = bytearray()
+        for piece in self._iter_body(size):
+            data += piece
+        return bytes(data)
+
+    def _iter_body(self, size):
+        """ 按块产出 size 字节的数据体，先消费缓冲区中的剩余数据 """
+        remaining = size
+        if self._buffer:
+            head = bytes(self._buffer[:remaining])
+            del self._buffer[:len(head)]
+            remaining -= len(head)
+            yield head
+        buf = bytearray(self.chunk_size)
+        view = memoryview(buf)
+        while remaining > 0:
+            with self.trace.span('net_recv'):
+                n = self.sock.recv_into(view, min(remaining, self.chunk_size))
+            if n == 0:
+                raise ConnectionError("接收数据时连接中断")
+            remaining -= n
+            yield view[:n]
+
+    def list_files(self):
+        """ 获取服务器文件列表: [{"name", "size", "mtime", "etag"}, ...] """
+        self._send(b"LIST_FILES")
+        status, length = _split_status(self._read_line())
+        if status != "OK_LIST":
+            raise ServerError(f"获取文件列表失败: {status}")
+        return json.loads(self._read_exact(int(length)).decode('utf-8'))
+
+    def list_versions(self, filename):
+        """ 获取文件的历史版本: [{"version", "size", "mtime"}, ...]，从新到旧 """
+        self._send(f"LIST_VERSIONS|{filename}".encode('utf-8'))
+        status, length = _split_status(self._read_line())
+        if status != "OK_VERSIONS":
+            raise ServerError(f"获取历史版本失败: {status}")
+        return json.loads(self._read_exact(int(length)).decode('utf-8'))
+
+    def search(self, prefix=None, contains=None, glob=None, min_size=None, max_size=None,
+               mtime_after=None, mtime_before=None, limit=None):
+        """
+        在服务器端按条件查找文件，不必拉取完整列表；返回 (条目列表, 是否还有更多结果)，
+        条目格式与 list_files 相同，按名称排序
+        """
+        query = {key: value for key, value in (
+            ("prefix", prefix), ("contains", contains), ("glob", glob),
+            ("min_size", min_size), ("max_size", max_size),
+            ("mtime_after", mtime_after), ("mtime_before", mtime_before), ("limit", limit),
+        ) if value is not None}
+        self._send(f"SEARCH|{json.dumps(query, ensure_ascii=False)}".encode('utf-8'))
+        status, length = _split_status(self._read_line())
+        if status != "OK_SEARCH":
+            raise ServerError(f"搜索失败: {status}")
+        result = json.loads(self._read_exact(int(length)).decode('utf-8'))
+        return result["files"], result["truncated"]
+
+    def stat(self, filenames):
+        """ 一次往返查询多个文件的元数据，按顺序返回条目，不存在的文件为 None """
+        body = json.dumps(list(filenames), ensure_ascii=False).encode('utf-8')
+        self._send(f"STAT|{len(body)}".encode('utf-8'), body)
+        status, length = _split_status(self._read_line())
+        if status != "OK_STAT":
+            raise ServerError(f"查询文件信息失败: {status}")
+        return json.loads(self._read_exact(int(length)).decode('utf-8'))
+
+    def set_cluster_nodes(self, nodes):
+        """ 集群模式: 设置新的节点列表，服务器转发给新旧列表中的所有节点，返回服务器的说明 """
+        self._send(f"CLUSTER_NODES|{json.dumps(list(nodes))}".encode('utf-8'))
+        status, message = _split_status(self._read_line())
+        if status != "OK":
+            raise ServerError(f"更新集群节点失败: {status}")
+        return message
+
+    def stats(self):
+        """ 获取服务器运行时统计 (例如热点文件缓存的命中率) """
+        self._send(b"STATS")
+        status, length = _split_status(self._read_line())
+        if status != "OK_STATS":
+            raise ServerError(f"获取统计信息失败: {status}")
+        return json.loads(self._read_exact(int(length)).decode('utf-8'))
+
+    def ping(self):
+        """ 发送心跳，返回往返时间 (秒) """
+        start = time.monotonic()
+        self._send(b"PING")
+        response = self._read_line()
+        if response != "PONG":
+            _split_status(response)
+            raise ServerError(f"心跳响应异常: {response}")
+        return time.monotonic() - start
+
+    def subscribe(self):
+        """ 把这条连接切换为变更通知通道，之后只能调用 read_event() 和 send_ping() """
+        self._send(b"SUBSCRIBE")
+        status, _ = _split_status(self._read_line())
+        if status != "OK_SUBSCRIBED":
+            raise ServerError(f"订阅失败: {status}")
+
+    def send_ping(self):
+        """ 在通知通道上发送心跳，不等待响应 (PONG 由 read_event 读取) """
+        self._send(b"PING")
+
+    def read_event(self):
+        """
+        读取下一条推送事件: {"type": "add"/"update"/"remove", "name", "size", "mtime", "etag"}
+        或 {"type": "resync"}；收到心跳响应时返回 None，超时未收到数据时抛出 socket.timeout
+        """
+        line = self._read_line()
+        if line == "PONG":
+            return None
+        status, length = _split_status(line)
+        if status != "EVENT":
+            raise ServerError(f"无法识别的推送: {status}")
+        return json.loads(self._read_exact(int(length)).decode('utf-8'))
+
+    def download(self, filename, save_path, progress=None, cache=None, state=None):
+        """
+        下载文件到 save_path，返回文件大小；progress(已接收, 总大小)
+
+        传入 cache (ContentCache) 时带上缓存的 ETag 发起条件请求，
+        服务器确认文件未变化后直接从本地缓存复制，只花一次小的往返。
+        传入 state (DownloadState) 时随时记录已写入的字节数和 ETag，
+        state 中已有进度时用 DOWNLOAD_RANGE 从断点续传。
+        """
+        if state is not None and state.resumable:
+            self._send(f"DOWNLOAD_RANGE|{state.offset}|{state.etag}|{filename}".encode('utf-8'))
+            status, payload = _split_status(self._read_line())
+            if status == "OK_RANGE":
+                offset_str, filesize_str, etag = payload.split('|', 2)
+                return self._receive_body(filename, save_path, int(offset_str), int(filesize_str),
+                                          etag, progress, cache, state)
+        else:
+            known_etag = cache.lookup(filename) if cache is not None else None
+            self._send(_download_request(filename, cache, known_etag, state is not None))
+            status, payload = _split_status(self._read_line())
+
+            if status == "NOT_MODIFIED":
+                with self.trace.span('cache'):
+                    size = cache.copy_to(filename, payload, save_path)
+                if size is not None:
+                    _report(progress, size, size)
+                    return size
+                # 缓存内容已丢失，重新发起完整下载
+                self._send(_download_request(filename, cache, None))
+                status, payload = _split_status(self._read_line())
+
+        if status != "OK_DOWNLOAD":
+            raise ServerError(f"下载失败: {status}")
+        filesize_str, _, etag = payload.partition('|')
+        return self._receive_body(filename, save_path, 0, int(filesize_str), etag, progress, cache, state)
+
+    def download_version(self, filename, version, save_path, progress=None):
+        """ 下载文件的历史版本 (版本号来自 list_versions) 到 save_path，返回文件大小 """
+        self._send(f"DOWNLOAD_VERSION|{version}|{filename}".encode('utf-8'))
+        status, payload = _split_status(self._read_line())
+        if status != "OK_DOWNLOAD":
+            raise ServerError(f"下载历史版本失败: {status}")
+        filesize_str, _, etag = payload.partition('|')
+        # 历史版本不写入内容缓存，缓存只对应服务器上的当前版本
+        return self._receive_body(filename, save_path, 0, int(filesize_str), etag, progress, None, None)
+
+    def download_sparse(self, filename, save_path, progress=None):
+        """
+        稀疏下载: 服务器只发送有数据的区段，本地按偏移写入，空洞保持为空洞；
+        服务器上的文件没有空洞时与普通下载相同。progress(已接收数据, 数据总量)
+        """
+        self._send(f"DOWNLOAD_SPARSE|{filename}".encode('utf-8'))
+        status, payload = _split_status(self._read_line())
+        if status == "OK_DOWNLOAD":
+            filesize_str, _, etag = payload.partition('|')
+            return self._receive_body(filename, save_path, 0, int(filesize_str), etag, progress, None, None)
+        if status != "OK_SPARSE":
+            raise ServerError(f"下载失败: {status}")
+        filesize_str, _, map_len = payload.split('|', 2)
+        filesize = int(filesize_str)
+        map_data = self._read_exact(int(map_len))
+        try:
+            extents = parse_map(map_data, filesize)
+        except (ValueError, TypeError) as e:
+            self.close()        # 无法确定后续数据的长度，这条连接不能再用
+            raise ServerError(f"无效的区段表: {e}")
+
+        digest = hashlib.sha256(map_data)
+        total = sum(length for _, length in extents)
+        received = 0
+        with open(save_path, 'wb') as f:
+            _report(progress, 0, total)
+            for offset, length in extents:
+                f.seek(offset)
+                for piece in self._iter_body(length):
+                    digest.update(piece)
+                    with self.trace.span('disk_write'):
+                        f.write(piece)
+                    received += len(piece)
+                    _report(progress, received, total)
+            # 末尾的空洞不会被写入，截断到完整大小
+            f.truncate(filesize)
+        self.trace.set(bytes=received)
+        if self._read_exact(DIGEST_SIZE).decode('ascii', 'replace') != digest.hexdigest():
+            raise ServerError(f"稀疏下载 '{filename}' 校验失败")
+        return filesize
+
+    def _receive_body(self, filename, save_path, offset, filesize, etag, progress, cache, state):
+        """ 把 offset 之后的数据写入 save_path (offset 为 0 时重写整个文件) """
+        if state is not None:
+            state.offset, state.total, state.etag = offset, filesize, etag
+        self.trace.set(bytes=filesize - offset)
+        received = offset
+        with open(save_path, 'r+b' if offset else 'wb') as f:
+            if offset:
+                f.seek(offset)
+                f.truncate()
+            _report(progress, received, filesize)
+            for piece in self._iter_body(filesize - offset):
+                with self.trace.span('disk_write'):
+                    f.write(piece)
+                received += len(piece)
+                if state is not None:
+                    state.offset = received
+                _report(progress, received, filesize)
+        _store_in_cache(cache, filename, etag, save_path)
+        return filesize
+
+    def hello(self):
+        """ 获取服务器支持的可选功能: {"inline_max", "features"}；旧服务器返回空字典 """
+        self._send(b"HELLO")
+        try:
+            status, length = _split_status(self._read_line())
+        except ServerError:
+            self.capabilities = {}      # 不认识 HELLO 的旧服务器
+            return self.capabilities
+        except socket.timeout:
+            # 最早的服务器回复 "ERROR|未知命令" 时不带换行；整条回复已经收到，丢弃后连接仍可继续使用
+            if not self._buffer.startswith(b"ERROR|"):
+                raise
+            self._buffer.clear()
+            self.capabilities = {}
+            return self.capabilities
+        if status != "OK_HELLO":
+            raise ServerError(f"功能协商失败: {status}")
+        self.capabilities = json.loads(self._read_exact(int(length)).decode('utf-8'))
+        return self.capabilities
+
+    def inline_limit(self):
+        """ 可以内联上传的最大文件大小，服务器不支持时为 -1 """
+        if self.capabilities is None:
+            self.hello()
+        limit = self.capabilities.get("inline_max", 0)
+        return limit if limit > 0 else -1
+
+    def _send_inline(self, local_path, server_filename, update):
+        """ 把命令和整个文件内容一次写出，返回文件大小 """
+        with self.trace.span('disk_read'), open(local_path, 'rb') as f:
+            data = f.read()
+        command = "UPDATE_INLINE" if update else "UPLOAD_INLINE"
+        self._send(f"{command}|{server_filename}|{len(data)}".encode('utf-8'), data)
+        return len(data)
+
+    def _read_upload_result(self):
+        status, message = _split_status(self._read_line())
+        if status != "OK":
+            raise ServerError(f"上传失败: {status}")
+        return message
+
+    def upload(self, local_path, server_filename, progress=None, update=False):
+        """
+        上传 (或 update=True 时更新) 本地文件，返回服务器的确认消息
+
+        不超过服务器内联上限的小文件把命令和内容一起发出，只需一次往返；
+        有空洞的文件只发送数据区段 (服务器支持时)；
+        其余文件先等待 READY_TO_RECEIVE 再发送数据。
+        """
+        filesize = os.path.getsize(local_path)
+        self.trace.set(bytes=filesize)
+        if filesize <= self.inline_limit():
+            _report(progress, 0, filesize)
+            size = self._send_inline(local_path, server_filename, update)
+            message = self._read_upload_result()
+            _report(progress, size, size)
+            return message
+
+        command = "UPDATE_FILE" if update else "UPLOAD_FILE"
+        with open(local_path, 'rb') as f:
+            if "sparse" in self.capabilities.get("features", []):
+                extents = data_extents(f, filesize)
+                if is_sparse(extents, filesize):
+                    return self._upload_sparse(f, server_filename, filesize, extents, progress, update)
+            self._send(f"{command}|{server_filename}|{filesize}".encode('utf-8'))
+            response = self._read_line()
+            if response != "READY_TO_RECEIVE":
+                _split_status(response)
+                raise ServerError(f"服务器未能准备接收: {response}")
+
+            sent = 0
+            buf = bytearray(self.chunk_size)
+            view = memoryview(buf)
+            _report(progress, sent, filesize)
+            while sent < filesize:
+                with self.trace.span('disk_read'):
+                    n = f.readinto(buf)
+                if not n:
+                    break  # 文件在发送过程中变短
+                with self.trace.span('net_send'):
+                    self.sock.sendall(view[:n])
+                sent += n
+                _report(progress, sent, filesize)
+
+        return self._read_upload_result()
+
+    def _upload_sparse(self, f, server_filename, filesize, extents, progress, update):
+        """ 发送区段表、各数据区段和校验值 (格式见服务器的 sparse.py)；progress(已发送数据, 数据总量) """
+        map_data = encode_map(extents)
+        command = "UPDATE_SPARSE" if update else "UPLOAD_SPARSE"
+        self._send(f"{command}|{server_filename}|{filesize}|{len(map_data)}".encode('utf-8'))
+        response = self._read_line()
+        if response != "READY_TO_RECEIVE":
+            _split_status(response)
+            raise ServerError(f"服务器未能准备接收: {response}")
+
+        digest = hashlib.sha256(map_data)
+        total = sum(length for _, length in extents)
+        sent = 0
+        buf = bytearray(self.chunk_size)
+        view = memoryview(buf)
+        with self.trace.span('net_send'):
+            self.sock.sendall(map_data)
+        _report(progress, sent, total)
+        for offset, length in extents:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                with self.trace.span('disk_read'):
+                    n = f.readinto(view[:min(self.chunk_size, remaining)])
+                if not n:
+                    # 区段表已经发出，少发的数据无法补齐，只能断开
+                    self.close()
+                    raise OSError("本地文件在上传过程中变短")
+                digest.update(view[:n])
+                with self.trace.span('net_send'):
+                    self.sock.sendall(view[:n])
+                remaining -= n
+                sent += n
+                _report(progress, sent, total)
+        self.sock.sendall(digest.hexdigest().encode('ascii'))
+        self.trace.set(bytes=sent)
+        return self._read_upload_result()
+
+    def upload_pipelined(self, items, update=False, window=PIPELINE_WINDOW):
+        """
+        连续上传多个小文件，不等待逐个确认；items 为 (本地路径, 服务器文件名)
+
+        按顺序产出 (服务器文件名, 确认消息, ServerError 或 None)。最多 window 个请求
+        在途，超过内联上限的文件先等待在途请求全部确认，再按普通方式上传。
+        """
+        limit = self.inline_limit()
+        outstanding = collections.deque()
+
+        def collect():
+            name = outstanding.popleft()
+            try:
+                return name, self._read_upload_result(), None
+            except ServerError as e:
+                return name, None, e
+
+        for local_path, server_filename in items:
+            if os.path.getsize(local_path) > limit:
+                while outstanding:
+                    yield collect()
+                try:
+                    yield server_filename, self.upload(local_path, server_filename, update=update), None
+                except ServerError as e:
+                    yield server_filename, None, e
+                continue
+            self._send_inline(local_path, server_filename, update)
+            outstanding.append(server_filename)
+            if len(outstanding) >= window:
+                yield collect()
+        while outstanding:
+            yield collect()
+
+    def update(self, local_path, server_filename, progress=None):
+        """ 更新服务器上的已有文件 """
+        return self.upload(local_path, server_filename, progress, update=True)
+
+    def upload_begin(self, server_filename, filesize, part_size):
+        """ 开始分片上传，返回 (upload_id, 分片数) """
+        self._send(f"UPLOAD_BEGIN|{server_filename}|{filesize}|{part_size}".encode('utf-8'))
+        status, payload = _split_status(self._read_line())
+        if status != "OK_BEGIN":
+            raise ServerError(f"无法开始分片上传: {status}")
+        upload_id, _, part_count = payload.partition('|')
+        return upload_id, int(part_count)
+
+    def upload_part(self, upload_id, index, data, progress=None):
+        """ 上传一个分片，data 为分片内容；progress(本分片已发送字节数) """
+        digest = hashlib.sha256(data).hexdigest()
+        self._send(f"UPLOAD_PART|{upload_id}|{index}|{digest}".encode('utf-8'))
+        response = self._read_line()
+        if response != "READY_TO_RECEIVE":
+            _split_status(response)
+            raise ServerError(f"服务器未能准备接收分片: {response}")
+        view = memoryview(data)
+        for start in range(0, len(view), self.chunk_size):
+            piece = view[start:start + self.chunk_size]
+            self.sock.sendall(piece)
+            if progress is not None:
+                progress(len(piece))
+        status, _ = _split_status(self._read_line())
+        if status != "OK_PART":
+            raise ServerError(f"分片上传失败: {status}")
+
+    def upload_commit(self, upload_id):
+        """ 所有分片完成后提交，返回服务器的确认消息 """
+        self._send(f"UPLOAD_COMMIT|{upload_id}".encode('utf-8'))
+        status, message = _split_status(self._read_line())
+        if status != "OK":
+            raise ServerError(f"提交分片上传失败: {status}")
+        return message
+
+    def upload_abort(self, upload_id):
+        self._send(f"UPLOAD_ABORT|{upload_id}".encode('utf-8'))
+        _split_status(self._read_line())
+
+
+def upload_multipart(host, port, local_path, server_filename, streams=DEFAULT_UPLOAD_STREAMS,
+                     part_size=DEFAULT_PART_SIZE, progress=None, timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE):
+    """
+    把一个大文件切成 part_size 大小的分片，通过 streams 条连接并行上传，返回服务器的确认消息
+
+    服务器把各分片按偏移写入同一个临时文件，全部校验通过后才提交。单个分片校验失败或
+    连接中断时在新连接上重传，超过 PART_RETRIES 次则取消整个上传。
+    progress(已发送, 总大小) 可能在多个线程中被调用。
+    """
+    filesize = os.path.getsize(local_path)
+    with FileClient(host, port, timeout, chunk_size) as control:
+        upload_id, part_count = control.upload_begin(server_filename, filesize, part_size)
+
+    parts = queue.Queue()
+    for index in range(part_count):
+        parts.put(index)
+    lock = threading.Lock()
+    sent = 0
+    errors = []
+
+    def advance(n):
+        nonlocal sent
+        with lock:
+            sent += n
+            done = sent
+        _report(progress, done, filesize)
+
+    def stream():
+        client = FileClient(host, port, timeout, chunk_size)
+        try:
+            with open(local_path, 'rb') as f:
+                while not errors:
+                    try:
+                        index = parts.get_nowait()
+                    except queue.Empty:
+                        return
+                    f.seek(index * part_size)
+                    data = f.read(part_size)
+                    for attempt in range(PART_RETRIES + 1):
+                        part_sent = 0
+
+                        def part_progress(n):
+                            nonlocal part_sent
+                            part_sent += n
+                            advance(n)
+                        try:
+                            if not client.is_connected:
+                                client.connect()
+                            client.upload_part(upload_id, index, data, part_progress)
+                            break
+                        except (ServerError, *_NETWORK_ERRORS) as e:
+                            advance(-part_sent)     # 重传的字节不重复计入进度
+                            client.close()
+                            if attempt == PART_RETRIES:
+                                raise
+                            logger.warning(f"分片 {index} 上传失败，准备重传: {e}")
+        except Exception as e:
+            errors.append(e)
+        finally:
+            client.close()
+
+    _report(progress, 0, filesize)
+    workers = [threading.Thread(target=stream, daemon=True) for _ in range(max(1, min(streams, part_count)))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    with FileClient(host, port, timeout, chunk_size) as control:
+        if errors:
+            try:
+                control.upload_abort(upload_id)
+            except (OSError, ServerError):
+                pass
+            raise errors[0]
+        return control.upload_commit(upload_id)
+
+
+class AsyncFileClient:
+    """ asyncio 版协议客户端，接口与 FileClient 一致，方法均为协程 """
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT,
+                 timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.reader = None
+        self.writer = None
+
+    @property
+    def is_connected(self):
+        return self.writer is not None
+
+    async def connect(self):
+        await self.close()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=self.chunk_size * 4), self.timeout)
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def __aenter__(self):
+        if not self.is_connected:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _send(self, command, body=b''):
+        """ 发送以换行符结尾的命令，与 FileClient._send 相同 """
+        await self._write(command + b'\n' + body if body else command + b'\n')
+
+    async def _write(self, data):
+        if self.writer is None:
+            raise ConnectionError("未连接到服务器")
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _read_line(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line.endswith(b'\n'):
+            raise ConnectionError("接收响应头时连接中断")
+        return line[:-1].decode('utf-8')
+
+    async def _iter_body(self, size):
+        remaining = size
+        while remaining > 0:
+            chunk = await asyncio.wait_for(self.reader.read(min(remaining, self.chunk_size)), self.timeout)
+            if not chunk:
+                raise ConnectionError("接收数据时连接中断")
+            remaining -= len(chunk)
+            yield chunk
+
+    async def list_files(self):
+        await self._send(b"LIST_FILES")
+        status, length = _split_status(await self._read_line())
+        if status != "OK_LIST":
+            raise ServerError(f"获取文件列表失败: {status}")
+        body = await asyncio.wait_for(self.reader.readexactly(int(length)), self.timeout)
+        return json.loads(body.decode('utf-8'))
+
+    async def download(self, filename, save_path, progress=None, cache=None):
+        known_etag = cache.lookup(filename) if cache is not None else None
+        await self._send(_download_request(filename, cache, known_etag))
+        status, payload = _split_status(await self._read_line())
+
+        if status == "NOT_MODIFIED":
+            size = cache.copy_to(filename, payload, save_path)
+            if size is not None:
+                _report(progress, size, size)
+                return size
+            await self._send(_download_request(filename, cache, None))
+            status, payload = _split_status(await self._read_line())
+
+        if status != "OK_DOWNLOAD":
+            raise ServerError(f"下载失败: {status}")
+        filesize_str, _, etag = payload.partition('|')
+        filesize = int(filesize_str)
+        received = 0
+        with open(save_path, 'wb') as f:
+            _report(progress, received, filesize)
+            async for chunk in self._iter_body(filesize):
+                f.write(chunk)
+                received += len(chunk)
+                _report(progress, received, filesize)
+        _store_in_cache(cache, filename, etag, save_path)
+        return filesize
+
+    async def upload(self, local_path, server_filename, progress=None, update=False):
+        command = "UPDATE_FILE" if update else "UPLOAD_FILE"
+        filesize = os.path.getsize(local_path)
+        with open(local_path, 'rb') as f:
+            await self._send(f"{command}|{server_filename}|{filesize}".encode('utf-8'))
+            response = await self._read_line()
+            if response != "READY_TO_RECEIVE":
+                _split_status(response)
+                raise ServerError(f"服务器未能准备接收: {response}")
+
+            sent = 0
+            _report(progress, sent, filesize)
+            while sent < filesize:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                await self._write(chunk)
+                sent += len(chunk)
+                _report(progress, sent, filesize)
+
+        status, message = _split_status(await self._read_line())
+        if status != "OK":
+            raise ServerError(f"上传失败: {status}")
+        return message
+
+    async def update(self, local_path, server_filename, progress=None):
+        return await self.upload(local_path, server_filename, progress, update=True)
+
+
+class ClientPool:
+    """ 维护多条 FileClient 连接，用线程池并行执行传输任务 """
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, size=4,
+                 timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE):
+        self.host = host
+        self.port = port
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return FileClient(self.host, self.port, self.timeout, self.chunk_size)
+        return self._idle.get()
+
+    def _release(self, client):
+        self._idle.put(client)
+
+    def run(self, fn, *args, **kwargs):
+        """ 借用一条连接执行 fn(client, *args)；连接出错时丢弃，下次自动重连 """
+        client = self._acquire()
+        try:
+            if not client.is_connected or client.peer_closed():
+                client.connect()
+            try:
+                return fn(client, *args, **kwargs)
+            except RetryableError:
+                # 服务器没有处理这个请求，换一条新连接重试一次
+                client.connect()
+                return fn(client, *args, **kwargs)
+        except OSError:
+            client.close()
+            raise
+        finally:
+            self._release(client)
+
+    def map(self, fn, items, key=None):
+        """
+        并行执行 fn(client, item)，按输入顺序产出 (item, 结果, 异常)，
+        单个任务失败不会中断其余任务；key 只供集群模式 (common.cluster.ClusterPool) 路由，这里不使用
+        """
+        def task(item):
+            try:
+                return item, self.run(fn, item), None
+            except (OSError, ServerError, ValueError) as e:
+                return item, None, e
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            yield from executor.map(task, items)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# 视为连接中断、可以重连后重试的错误；本地文件的 OSError 不在其中
+_NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout)
+
+
+class ReconnectPolicy:
+    """ 重连的指数退避策略: 第一次立即重连，之后等待 initial_delay * multiplier**n (不超过 max_delay) 并叠加随机抖动 """
+
+    def __init__(self, initial_delay=0.2, max_delay=5.0, multiplier=2.0, max_attempts=8, jitter=0.5):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.max_attempts = max_attempts      # None 表示无限重试
+        self.jitter = jitter
+
+    def delays(self):
+        """ 依次产出每次重连前的等待时间 (秒) """
+        attempt = 0
+        while self.max_attempts is None or attempt < self.max_attempts:
+            if attempt == 0:
+                yield 0.0
+            else:
+                delay = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+                # 抖动避免大量客户端在服务器恢复后同一时刻重连
+                yield delay * (1 - self.jitter * random.random())
+            attempt += 1
+
+
+class ResilientClient:
+    """
+    自动重连的同步客户端，接口与 FileClient 相同
+
+    连接中断 (超时、被重置、对端关闭) 后按 ReconnectPolicy 退避重连。列表、统计和
+    心跳这类幂等请求在新连接上自动重放，下载从已写入的位置续传；上传不自动重放，
+    错误抛给调用方，下一个请求会先重新建立连接。
+    on_event(event, info) 在 'disconnected'、'reconnected' (info 为恢复耗时) 和
+    'failed' 时回调，便于界面提示。
+    """
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, timeout=DEFAULT_TIMEOUT,
+                 chunk_size=CHUNK_SIZE, policy=None, heartbeat_interval=HEARTBEAT_INTERVAL,
+                 replay_limit=3, on_event=None):
+        self.client = FileClient(host, port, timeout, chunk_size)
+        self.policy = policy or ReconnectPolicy()
+        self.heartbeat_interval = heartbeat_interval
+        self.replay_limit = replay_limit
+        self.on_event = on_event
+        self.last_activity = time.monotonic()
+        self.reconnects = 0
+        self.recovery_times = []        # 每次从断线到重新连上的耗时 (秒)
+
+    @property
+    def host(self):
+        return self.client.host
+
+    @property
+    def port(self):
+        return self.client.port
+
+    @property
+    def is_connected(self):
+        return self.client.is_connected
+
+    @property
+    def trace(self):
+        return self.client.trace
+
+    @trace.setter
+    def trace(self, trace):
+        # 重连沿用同一个 FileClient，追踪记录在重连和重放期间保持不变
+        self.client.trace = trace
+
+    def connect(self):
+        """ 首次连接不做重试，连接失败直接抛出，由调用方提示用户 """
+        self.client.connect()
+        self.last_activity = time.monotonic()
+        return self
+
+    def close(self):
+        self.client.close()
+
+    def __enter__(self):
+        if not self.is_connected:
+            self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _emit(self, event, info=None):
+        if self.on_event is not None:
+            self.on_event(event, info)
+
+    def reconnect(self):
+        """ 按退避策略重连，返回恢复耗时 (秒)；重试次数用尽时抛出 ConnectionError """
+        self.client.close()
+        start = time.monotonic()
+        last_error = None
+        for delay in self.policy.delays():
+            if delay:
+                time.sleep(delay)
+            try:
+                self.client.connect()
+            except OSError as e:
+                last_error = e
+                logger.warning(f"重连 {self.host}:{self.port} 失败: {e}")
+                continue
+            elapsed = time.monotonic() - start
+            self.reconnects += 1
+            self.recovery_times.append(elapsed)
+            self.last_activity = time.monotonic()
+            logger.info(f"已重新连接到 {self.host}:{self.port}，耗时 {elapsed:.3f} 秒")
+            self._emit('reconnected', elapsed)
+            return elapsed
+        # 推迟下一次心跳触发的重连，避免服务器长时间不可用时反复重试
+        self.last_activity = time.monotonic()
+        self._emit('failed', last_error)
+        raise ConnectionError(f"无法重新连接到 {self.host}:{self.port}: {last_error}")
+
+    def _call(self, replay, fn, *args):
+        """
+        执行一次请求；连接中断时 replay 为真则重连后在新连接上重放。
+        服务器回复 RETRY 时请求没有被处理，上传也可以重连后重试
+        """
+        # 服务器已关闭的空闲连接在发请求之前发现，不必等请求失败
+        if not self.client.is_connected or self.client.peer_closed():
+            self.reconnect()
+        replays = 0
+        while True:
+            try:
+                result = fn(*args)
+                self.last_activity = time.monotonic()
+                return result
+            except RetryableError as e:
+                self.client.close()
+                logger.info(f"{self.host}:{self.port} 要求重试请求: {e}")
+                if replays >= self.replay_limit:
+                    raise
+                replays += 1
+                self.reconnect()
+            except _NETWORK_ERRORS as e:
+                self.client.close()
+                logger.warning(f"与 {self.host}:{self.port} 的连接中断: {e}")
+                self._emit('disconnected', e)
+                if not replay or replays >= self.replay_limit:
+                    raise
+                replays += 1
+                self.reconnect()
+
+    def keepalive(self):
+        """ 空闲超过心跳间隔时发送 PING，顺带发现死连接并重连；返回是否发送了心跳 """
+        if time.monotonic() - self.last_activity < self.heartbeat_interval:
+            return False
+        self._call(True, self.client.ping)
+        return True
+
+    def ping(self):
+        return self._call(True, self.client.ping)
+
+    def list_files(self):
+        return self._call(True, self.client.list_files)
+
+    def stats(self):
+        return self._call(True, self.client.stats)
+
+    def list_versions(self, filename):
+        return self._call(True, self.client.list_versions, filename)
+
+    def search(self, **query):
+        return self._call(True, lambda: self.client.search(**query))
+
+    def stat(self, filenames):
+        return self._call(True, self.client.stat, list(filenames))
+
+    def download_sparse(self, filename, save_path, progress=None):
+        return self._call(True, self.client.download_sparse, filename, save_path, progress)
+
+    def download_version(self, filename, version, save_path, progress=None):
+        return self._call(True, self.client.download_version, filename, version, save_path, progress)
+
+    def download(self, filename, save_path, progress=None, cache=None):
+        """ 下载文件；连接中断后重连并从已写入的位置续传，文件已变化时重新完整下载 """
+        state = DownloadState()
+        return self._call(True, self.client.download, filename, save_path, progress, cache, state)
+
+    def upload(self, local_path, server_filename, progress=None, update=False):
+        return self._call(False, self.client.upload, local_path, server_filename, progress, update)
+
+    def update(self, local_path, server_filename, progress=None):
+        return self.upload(local_path, server_filename, progress, update=True)
@@ -4,16 +4,28 @@ import json
 import os
 import logging
 from PySide6.QtCore import Qt, Signal, QThread
+from common.core import (
+    FileClient, ResilientClient, ReconnectPolicy, ServerError, upload_multipart,
+    DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT, HEARTBEAT_INTERVAL,
+    MULTIPART_THRESHOLD, DEFAULT_UPLOAD_STREAMS, DEFAULT_PART_SIZE
+)
+from common.cache import ContentCache, DEFAULT_CACHE_DIR
+from common.transfers import TransferList
+from common.tracing import get_tracer, NULL_TRACE
 
-BUFFER_SIZE = 4096
-DEFAULT_SERVER_HOST = '127.0.0.1'
-DEFAULT_SERVER_PORT = 65432
 LOG_DIR = 'clientinfo/log'
 
 logger = logging.getLogger('client_logger')
 
 class NetworkThread(QThread):
-    """ 在单独的线程中处理网络请求，避免GUI冻结 """
+    """
+    在单独的线程中处理网络请求，避免GUI冻结；协议细节由 common.core 实现
+
+    连接由 ResilientClient 维护: 空闲时定期发送心跳，连接中断后自动重连，
+    列表请求和下载在重连后自动重放/续传，用户无需回到登录界面。
+    每个上传、下载都登记在 transfers (TransferList) 中，界面的传输列表按固定间隔读取进度；
+    被暂停的排队任务留在队列中，直到继续后才会处理。
+    """
 
     connection_status = Signal(bool, str)       # 连接成功/失败，附加消息
     file_list_received = Signal(list)           # 文件列表数据
@@ -31,11 +43,14 @@ class NetworkThread(QThread):
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.client_socket = None
-        self.is_connected = False
-        self.request_queue = []  # (command, data)
+        self.client = ResilientClient(on_event=self._on_client_event)
+        self.cache = None        # 下载内容缓存，连接成功后按服务器地址创建
+        self.is_connected = False   # 会话是否建立；会话期间的断线由 ResilientClient 自动恢复
+        self.request_queue = []  # (command, data)，传输请求的 data 最后一项为 transfers 中的 id
+        self.transfers = TransferList()
         self.mutex = threading.Lock()
         self.running = True
+        self.tracer = get_tracer()  # 以 --trace-file 启动时记录每个请求的分阶段耗时
 
     def connect_to_server(self, host, port):
         """ 连接到服务器 """
@@ -60,7 +75,8 @@ class NetworkThread(QThread):
     def download_server_file(self, filename, save_path):
         """ 下载服务器上的文件 """
         if self.is_connected:
-            self.request_queue.append(("download_file", (filename, save_path)))
+            transfer_id = self.transfers.add("download", filename)
+            self.request_queue.append(("download_file", (filename, save_path, transfer_id)))
         else:
             self.general_message.emit("error", "未连接到服务器，请先连接。")
             logger.error("未连接到服务器，无法下载文件")
@@ -68,7 +84,8 @@ class NetworkThread(QThread):
     def upload_client_file(self, local_path, server_filename):
         """ 上传本地文件到服务器 """
         if self.is_connected:
-            self.request_queue.append(("upload_file", (local_path, server_filename)))
+            transfer_id = self.transfers.add("upload", server_filename, self._local_size(local_path))
+            self.request_queue.append(("upload_file", (local_path, server_filename, transfer_id)))
         else:
             self.general_message.emit("error", "未连接到服务器，请先连接。")
             logger.error("未连接到服务器，无法上传文件")
@@ -76,251 +93,299 @@ class NetworkThread(QThread):
     def update_file(self, local_path, server_filename):
         """ 更新服务器上的文件 """
         if self.is_connected:
-            self.request_queue.append(("update_file", (local_path, server_filename)))
+            transfer_id = self.transfers.add("update", server_filename, self._local_size(local_path))
+            self.request_queue.append(("update_file", (local_path, server_filename, transfer_id)))
         else:
             self.general_message.emit("error", "未连接到服务器，请先连接。")
             logger.error("未连接到服务器，无法更新文件")
 
-    def _receive_exact(self, size):
-        """ 确保接收到指定大小的数据 """
-        data = b''
-        while len(data) < size:
-            chunk = self.client_socket.recv(min(size - len(data), BUFFER_SIZE))
-            if not chunk:
-                raise socket.error("连接在接收数据时中断")
-            data += chunk
-        return data
-
-    def _read_header_and_data(self):
-        """ 读取由换行符分隔的头部和之后的数据体 """
-        buffer = b''
-        while True:
-            # 这里可以一次多读一点，然后在buffer里找换行符
-            char = self.client_socket.recv(1)
-            if not char:
-                raise socket.error("接收头部时连接中断")
-            if char == b'\n':
-                break
-            buffer += char
-        
-        header_str = buffer.decode('utf-8')
-        status, data_len_str = header_str.split('|',1)
-        data_len = int(data_len_str)
-        body_data = self._receive_exact(data_len)
-
-        return status, body_data
+    @staticmethod
+    def _local_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _next_request(self):
+        """ 取出队列中第一个没有被暂停的请求，全部暂停时返回 None """
+        with self.mutex:
+            for i, (command, data) in enumerate(self.request_queue):
+                if command in self.TRANSFER_COMMANDS and self.transfers.is_paused(data[-1]):
+                    continue
+                return self.request_queue.pop(i)
+        return None
+
+    def _progress_emitter(self, signal, filename, transfer_id):
+        """ 生成进度回调: 每块都更新传输列表，信号只在百分比变化时发射，避免每个数据块都刷新界面 """
+        last = [-1]
+        transfers = self.transfers
+        def report(done, total):
+            transfers.progress(transfer_id, done, total)
+            percentage = int(100 * done / total) if total > 0 else 100
+            if percentage != last[0]:
+                last[0] = percentage
+                signal.emit(filename, percentage)
+        return report
+
+    def _on_client_event(self, event, info):
+        """ ResilientClient 的连接事件，转成界面提示 """
+        if event == 'disconnected':
+            self.general_message.emit("info", "与服务器的连接中断，正在重新连接...")
+        elif event == 'reconnected':
+            self.general_message.emit("info", f"已重新连接到服务器 (耗时 {info:.1f} 秒)。")
+        elif event == 'failed':
+            self.general_message.emit("error", "无法重新连接到服务器，将在下次请求或心跳时重试。")
+
+    TRANSFER_COMMANDS = ("download_file", "upload_file", "update_file")
+
+    @staticmethod
+    def _trace_name(command, data):
+        """ 追踪记录中的文件名 """
+        if command == "download_file":
+            return data[0]
+        if command in ("upload_file", "update_file"):
+            return data[1]
+        return None
+
+    def _send_heartbeat(self):
+        """ 空闲时按间隔发送心跳，及早发现被 NAT 回收或对端已失效的连接 """
+        if not self.is_connected:
+            return
+        try:
+            self.client.keepalive()
+        except (socket.error, ServerError) as e:
+            logger.warning(f"心跳失败: {e}")
 
     def run(self):
         """线程主循环，处理请求队列中的任务。"""
         while self.running:
-            if not self.request_queue:
+            request = self._next_request() if self.request_queue else None
+            if request is None:
+                self._send_heartbeat()
                 self.msleep(100)
                 continue
-
-            self.mutex.acquire()
-            command, data = self.request_queue.pop(0)
-            self.mutex.release()
-
+            command, data = request
+            transfer_id = data[-1] if command in self.TRANSFER_COMMANDS else None
+            if transfer_id is not None:
+                self.transfers.start(transfer_id)
+
+            # 追踪记录挂到 FileClient 上，各阶段耗时由协议核心累计
+            trace = self.tracer.begin(command, self._trace_name(command, data))
+            self.client.trace = trace
             try:
                 if command == "connect":
                     host, port = data
-                    if self.client_socket:
-                        try: self.client_socket.close() 
-                        except: pass
-                    self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self.client_socket.settimeout(5)            # 连接超时5秒
-                    self.client_socket.connect((host, port))
+                    self.client.close()
+                    self.client = ResilientClient(host, port, timeout=5,    # 连接超时5秒
+                                                  on_event=self._on_client_event)
+                    self.client.trace = trace
+                    self.client.connect()
                     self.is_connected = True
+                    try:
+                        self.cache = ContentCache(DEFAULT_CACHE_DIR, namespace=f"{host}:{port}")
+                    except OSError as e:
+                        logger.warning(f"无法初始化下载缓存，将不使用缓存: {e}")
+                        self.cache = None
                     self.connection_status.emit(True, f"成功连接到 {host}:{port}")
 
                 elif command == "disconnect":
-                    if self.client_socket:
-                        self.client_socket.close()
+                    self.client.close()
                     self.is_connected = False
-                    self.client_socket = None
                     self.connection_status.emit(False, "已断开连接。")
                 
                 elif command == "list_files":
-                    self.client_socket.sendall(b"LIST_FILES")
-
-                    # 服务器会先发头部 (OK_LIST|json_len) 
-                    # 再发 \n 
-                    # 再发json数据
-
-                    status, body_data = self._read_header_and_data()
-                    if status == "OK_LIST":
-                        files = json.loads(body_data.decode('utf-8'))
-                        self.file_list_received.emit(files)
-                    else:
-                        self.general_message.emit("error", f"获取文件列表失败: {body_data.decode('utf-8', errors='ignore')}")
+                    try:
+                        files = self.client.list_files()
+                    except ServerError as e:
+                        trace.set(status="error")
+                        self.general_message.emit("error", f"获取文件列表失败: {e}")
+                        continue
+                    self.file_list_received.emit(files)
 
                 elif command == "download_file":
-                    filename, save_path = data
-                    request = f"DOWNLOAD_FILE|{filename}".encode('utf-8')
-                    self.client_socket.sendall(request)
-
-                    # 服务器: 
-                    # OK_DOWNLOAD|filesize\n<filedata> 
-                    # ERROR|msg
-
-                    header_buffer = b''
-                    while b'\n' not in header_buffer:
-                        chunk = self.client_socket.recv(BUFFER_SIZE)
-                        if not chunk: raise socket.error("下载时连接中断")
-                        header_buffer += chunk
-                    
-                    header_part, file_data_first_chunk = header_buffer.split(b'\n', 1)
-                    header_str = header_part.decode('utf-8')
-
-                    if header_str.startswith("ERROR|"):
-                        self.download_finished.emit(filename, False, header_str.split('|',1)[1])
+                    filename, save_path, _ = data
+                    try:
+                        self.client.download(filename, save_path,
+                                             self._progress_emitter(self.download_progress, filename, transfer_id),
+                                             cache=self.cache)
+                    except ServerError as e:
+                        trace.set(status="error")
+                        self.transfers.finish(transfer_id, False, str(e))
+                        self.download_finished.emit(filename, False, str(e))
                         continue
-                    
-                    status, filesize_str = header_str.split('|',1)
-                    if status == "OK_DOWNLOAD":
-                        filesize = int(filesize_str)
-                        received_bytes = len(file_data_first_chunk)
-                        
-                        with open(save_path, 'wb') as f:
-                            f.write(file_data_first_chunk)
-                            self.download_progress.emit(filename, int(100 * received_bytes / filesize) if filesize > 0 else 100)
-                            while received_bytes < filesize:
-                                chunk = self.client_socket.recv(BUFFER_SIZE)
-                                if not chunk: 
-                                    self.download_finished.emit(filename, False, "下载中途连接中断")
-                                    raise socket.error("下载中断") # 跳出循环
-                                f.write(chunk)
-                                received_bytes += len(chunk)
-                                self.download_progress.emit(filename, int(100 * received_bytes / filesize))
-                        self.download_finished.emit(filename, True, f"文件 '{filename}' 下载完成。")
-                    else:
-                        self.download_finished.emit(filename, False, f"下载失败: {header_str}")
+                    except socket.error:
+                        self.transfers.finish(transfer_id, False, "下载中途连接中断")
+                        self.download_finished.emit(filename, False, "下载中途连接中断")
+                        raise
+                    message = f"文件 '{filename}' 下载完成。"
+                    self.transfers.finish(transfer_id, True, message)
+                    self.download_finished.emit(filename, True, message)
+
+                elif command in ("upload_file", "update_file"):
+                    local_path, server_filename, _ = data
+                    is_update = command == "update_file"
+                    action = "更新" if is_update else "上传"
+                    finished = self.update_finished if is_update else self.upload_finished
+                    progress = self.update_progress if is_update else self.upload_progress
 
-                elif command == "upload_file":
-                    local_path, server_filename = data
                     if not os.path.exists(local_path):
-                        self.upload_finished.emit(server_filename, False, f"本地文件 '{local_path}' 不存在。")
-                        logger.error(f"本地文件 '{local_path}' 不存在，上传失败")
+                        self.transfers.finish(transfer_id, False, f"本地文件 '{local_path}' 不存在。")
+                        finished.emit(server_filename, False, f"本地文件 '{local_path}' 不存在。")
+                        logger.error(f"本地文件 '{local_path}' 不存在，{action}失败")
                         continue
-                    
-                    filesize = os.path.getsize(local_path)
-                    # 命令: UPLOAD_FILE|filename|filesize
-                    request = f"UPLOAD_FILE|{server_filename}|{filesize}".encode('utf-8')
-                    self.client_socket.sendall(request)
-                    logger.info(f"发送上传文件请求: '{server_filename}' ({filesize}字节)")
-
-                    # 服务器响应: READY_TO_RECEIVE\n
-                    response_buffer = b''
-                    while b'\n' not in response_buffer:
-                        chunk = self.client_socket.recv(BUFFER_SIZE)
-                        if not chunk: 
-                            logger.error("等待服务器上传许可时连接中断")
-                            raise socket.error("等待服务器上传许可时连接中断")
-                        response_buffer += chunk
-                    
-                    server_response = response_buffer.split(b'\n',1)[0].decode('utf-8')
-
-                    if server_response == "READY_TO_RECEIVE":
-                        sent_bytes = 0
-                        with open(local_path, 'rb') as f:
-                            while sent_bytes < filesize:
-                                chunk = f.read(BUFFER_SIZE)
-                                if not chunk: break # 文件读取完毕
-                                self.client_socket.sendall(chunk)
-                                sent_bytes += len(chunk)
-                                self.upload_progress.emit(server_filename, int(100 * sent_bytes / filesize))
-                        
-                        # 等待服务器的最终确认: OK|msg 或 ERROR|msg
-                        final_response_str = self.client_socket.recv(BUFFER_SIZE).decode('utf-8').strip()
-                        if final_response_str.startswith("OK|"):
-                            logger.info(f"文件 '{server_filename}' 上传成功")
-                            self.upload_finished.emit(server_filename, True, final_response_str.split('|',1)[1])
-                        else:
-                            logger.error(f"文件 '{server_filename}' 上传失败: {final_response_str}")
-                            self.upload_finished.emit(server_filename, False, final_response_str)
-                    else:
-                        logger.error(f"服务器未能准备接收: {server_response}")
-                        self.upload_finished.emit(server_filename, False, f"服务器未能准备接收: {server_response}")
 
-                elif command == "update_file":
-                    local_path, server_filename = data
-                    if not os.path.exists(local_path):
-                        self.update_finished.emit(server_filename, False, f"本地文件 '{local_path}' 不存在。")
-                        logger.error(f"本地文件 '{local_path}' 不存在，更新失败")
-                        continue
-                    
                     filesize = os.path.getsize(local_path)
-                    # 命令: UPDATE_FILE|filename|filesize
-                    request = f"UPDATE_FILE|{server_filename}|{filesize}".encode('utf-8')
-                    self.client_socket.sendall(request)
-                    logger.info(f"发送更新文件请求: '{server_filename}' ({filesize}字节)")
-
-                    # 服务器响应: READY_TO_RECEIVE\n
-                    response_buffer = b''
-                    while b'\n' not in response_buffer:
-                        chunk = self.client_socket.recv(BUFFER_SIZE)
-                        if not chunk: 
-                            logger.error("等待服务器更新许可时连接中断")
-                            raise socket.error("等待服务器更新许可时连接中断")
-                        response_buffer += chunk
-                    
-                    server_response = response_buffer.split(b'\n',1)[0].decode('utf-8')
-
-                    if server_response == "READY_TO_RECEIVE":
-                        sent_bytes = 0
-                        with open(local_path, 'rb') as f:
-                            while sent_bytes < filesize:
-                                chunk = f.read(BUFFER_SIZE)
-                                if not chunk: break # 文件读取完毕
-                                self.client_socket.sendall(chunk)
-                                sent_bytes += len(chunk)
-                                self.update_progress.emit(server_filename, int(100 * sent_bytes / filesize))
-                        
-                        # 等待服务器的最终确认: OK|msg 或 ERROR|msg
-                        final_response_str = self.client_socket.recv(BUFFER_SIZE).decode('utf-8').strip()
-                        if final_response_str.startswith("OK|"):
-                            logger.info(f"文件 '{server_filename}' 更新成功")
-                            self.update_finished.emit(server_filename, True, final_response_str.split('|',1)[1])
+                    logger.info(f"发送{action}文件请求: '{server_filename}' ({filesize}字节)")
+                    try:
+                        if filesize >= MULTIPART_THRESHOLD:
+                            # 大文件分片后通过多条连接并行上传，单条连接跑不满高延迟链路的带宽
+                            message = upload_multipart(self.client.host, self.client.port, local_path,
+                                                       server_filename, DEFAULT_UPLOAD_STREAMS, DEFAULT_PART_SIZE,
+                                                       self._progress_emitter(progress, server_filename, transfer_id))
                         else:
-                            logger.error(f"文件 '{server_filename}' 更新失败: {final_response_str}")
-                            self.update_finished.emit(server_filename, False, final_response_str)
-                    else:
-                        logger.error(f"服务器未能准备接收更新: {server_response}")
-                        self.update_finished.emit(server_filename, False, f"服务器未能准备接收更新: {server_response}")
+                            message = self.client.upload(local_path, server_filename,
+                                                         self._progress_emitter(progress, server_filename, transfer_id),
+                                                         update=is_update)
+                    except ServerError as e:
+                        trace.set(status="error")
+                        logger.error(f"文件 '{server_filename}' {action}失败: {e}")
+                        self.transfers.finish(transfer_id, False, str(e))
+                        finished.emit(server_filename, False, str(e))
+                        continue
+                    except socket.error:
+                        # 上传不会自动重放，由用户决定是否重新上传
+                        self.transfers.finish(transfer_id, False, f"{action}中途连接中断，请重试。")
+                        finished.emit(server_filename, False, f"{action}中途连接中断，请重试。")
+                        raise
+                    logger.info(f"文件 '{server_filename}' {action}成功")
+                    self.transfers.finish(transfer_id, True, message)
+                    finished.emit(server_filename, True, message)
 
             except socket.timeout:
+                trace.set(status="aborted")
                 self.general_message.emit("error", "服务器连接超时。")
                 if command == "connect": 
+                    self.is_connected = False
                     self.connection_status.emit(False, "连接超时")
-
-                self.is_connected = False # 记得更新连接状态
+                self.client.close()     # 会话保持，下一个请求或心跳时自动重连
 
             except socket.error as e:
+                trace.set(status="aborted")
                 self.general_message.emit("error", f"网络通信错误: {e}")
-                self.is_connected = False # 记得更新连接状态
+                self.client.close()
 
                 if command == "connect": 
+                    self.is_connected = False
                     self.connection_status.emit(False, f"连接错误: {e}")
 
             except json.JSONDecodeError as e:
+                trace.set(status="error")
                 self.general_message.emit("error", f"解析服务器响应失败: {e}")
 
             except Exception as e:
+                trace.set(status="error")
                 self.general_message.emit("error", f"处理请求时发生未知错误: {e}")
-                # 对于未知错误，也标记为未连接，以防socket状态不一致
-                self.is_connected = False 
-
-                if self.client_socket:
-                    try: self.client_socket.close() 
-                    except: pass
-
-                self.client_socket = None
+                # 对于未知错误，关闭连接以防socket状态不一致，下一个请求时重新建立
+                self.client.close()
+            finally:
+                self.client.trace = NULL_TRACE
+                trace.finish()
+                if transfer_id is not None and self.transfers.is_active(transfer_id):
+                    # 意外错误时传输没有走到上面的结束分支
+                    self.transfers.finish(transfer_id, False, "处理请求时出错")
 
     def stop(self):
         self.running = False
         self.request_queue.clear()
-        if self.client_socket:
-            try: self.client_socket.close() 
-            except: pass
+        self.client.close()
         self.quit()
-        self.wait() 
\ No newline at end of file
+        self.wait() 
+
+
+class NotificationThread(QThread):
+    """
+    在独立连接上订阅服务器的文件变更通知 (SUBSCRIBE)
+
+    收到 add/update/remove 事件时发射 file_event，界面据此增量更新文件表格。
+    连接中断后按退避策略重连并重新订阅；断线期间可能漏掉事件，因此重新订阅成功
+    或服务器报告队列溢出时发射 resync_required，界面应重新获取一次完整列表。
+    """
+
+    file_event = Signal(dict)                   # {"type", "name", "size", "mtime", "etag"}
+    resync_required = Signal()
+    subscription_status = Signal(bool)          # 是否正在接收通知
+
+    def __init__(self, host, port, parent=None):
+        super().__init__(parent)
+        self.host = host
+        self.port = port
+        self.running = True
+        self.is_subscribed = False
+        # 读超时即心跳间隔: 超时后发送 PING，再次超时仍无任何数据则认为连接已失效
+        self.client = FileClient(host, port, timeout=HEARTBEAT_INTERVAL)
+        self.policy = ReconnectPolicy(max_attempts=None)
+
+    def _set_subscribed(self, subscribed):
+        if subscribed != self.is_subscribed:
+            self.is_subscribed = subscribed
+            self.subscription_status.emit(subscribed)
+
+    def _subscribe(self):
+        """ 建立连接并订阅，失败时按退避策略重试，直到成功或线程停止 """
+        for delay in self.policy.delays():
+            if delay:
+                self.msleep(int(delay * 1000))
+            if not self.running:
+                return False
+            try:
+                self.client.connect()
+                self.client.subscribe()
+                return True
+            except (socket.error, ServerError) as e:
+                logger.warning(f"订阅文件变更通知失败: {e}")
+                self.client.close()
+        return False
+
+    def run(self):
+        first = True
+        while self.running:
+            if not self._subscribe():
+                break
+            self._set_subscribed(True)
+            if not first:
+                self.resync_required.emit()
+            first = False
+
+            awaiting_pong = False
+            try:
+                while self.running:
+                    try:
+                        event = self.client.read_event()
+                    except socket.timeout:
+                        if awaiting_pong:
+                            raise ConnectionError("通知通道心跳超时")
+                        self.client.send_ping()
+                        awaiting_pong = True
+                        continue
+                    awaiting_pong = False
+                    if event is None:
+                        continue
+                    if event.get("type") == "resync":
+                        self.resync_required.emit()
+                    else:
+                        self.file_event.emit(event)
+            except (socket.error, ServerError, json.JSONDecodeError) as e:
+                if self.running:
+                    logger.warning(f"文件变更通知连接中断: {e}")
+            self.client.close()
+            self._set_subscribed(False)
+
+    def stop(self):
+        self.running = False
+        sock = self.client.sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)     # 唤醒阻塞中的读取，套接字由线程自己关闭
+            except OSError:
+                pass
+        self.wait()
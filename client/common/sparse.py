@@ -0,0 +1,61 @@
+"""
+稀疏文件的区段探测
+
+与服务器的 sparse.py 使用同样的格式: 区段表是 JSON [[offset, length], ...]，
+只列出有数据的区段，其余部分是空洞。上传时探测本地文件，下载时按区段表写入
+并在最后截断到完整大小，空洞在本地也不占用磁盘空间。
+"""
+import errno
+import json
+import os
+
+DIGEST_SIZE = 64                    # 区段数据之后的十六进制 SHA-256
+
+
+def data_extents(f, size):
+    """ 返回文件中有数据的区段 [(offset, length), ...]；平台或文件系统不支持时把整个文件当作一个区段 """
+    dense = [(0, size)] if size else []
+    if not hasattr(os, 'SEEK_DATA'):
+        return dense
+    fd = f.fileno()
+    extents = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:      # offset 之后只剩空洞
+                    break
+                raise
+            if start >= size:
+                break
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            extents.append((start, end - start))
+            offset = end
+    except OSError:
+        return dense
+    finally:
+        f.seek(0)       # lseek 移动了底层文件指针，调用方接着从头读取
+    return extents
+
+
+def is_sparse(extents, size):
+    return extents != ([(0, size)] if size else [])
+
+
+def encode_map(extents):
+    return json.dumps(extents, separators=(',', ':')).encode('utf-8')
+
+
+def parse_map(map_data, size):
+    """ 解析服务器发来的区段表，区段必须按偏移升序、互不重叠且不超出文件大小 """
+    end = 0
+    extents = []
+    for offset, length in json.loads(map_data.decode('utf-8')):
+        offset, length = int(offset), int(length)
+        if offset < end or length <= 0 or offset + length > size:
+            raise ValueError(f"无效的区段: ({offset}, {length})")
+        extents.append((offset, length))
+        end = offset + length
+    return extents
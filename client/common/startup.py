@@ -0,0 +1,75 @@
+"""
+客户端启动耗时统计
+
+main.py 用 --profile-startup 启动时，把启动过程分成若干阶段 (导入 PySide6、导入登录窗口、
+创建 QApplication、创建并显示登录窗口……)，记录每个阶段的耗时和新加载的模块数，
+登录窗口第一次进入事件循环后输出报告。报告以一行 JSON 写到标准输出，前缀为
+STARTUP_REPORT，供 bench/bench_client_startup.py 解析。
+
+更细的按包导入耗时可以用 python -X importtime 获得，基准脚本会自动汇总。
+"""
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+REPORT_PREFIX = 'STARTUP_REPORT '
+
+logger = logging.getLogger('client_logger')
+
+
+def _top_level(name: str) -> str:
+    return name.split('.', 1)[0]
+
+
+class StartupProfiler:
+    """ 记录启动阶段耗时；未启用时 phase() 只是空的上下文管理器 """
+
+    def __init__(self, enabled: bool = False, start: float = None):
+        self.enabled = enabled
+        self.start = time.perf_counter() if start is None else start
+        self.phases = []        # (阶段名, 耗时秒, 新加载模块数)
+        self.marks = {}         # 里程碑 -> 距启动的秒数
+        self._packages = {}     # 顶层包 -> 本次启动中加载的模块数
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        before = set(sys.modules)
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - began
+            loaded = set(sys.modules) - before
+            for module in loaded:
+                package = _top_level(module)
+                self._packages[package] = self._packages.get(package, 0) + 1
+            self.phases.append((name, elapsed, len(loaded)))
+
+    def mark(self, name: str):
+        """ 记录一个里程碑 (例如登录窗口首次显示) """
+        if self.enabled:
+            self.marks[name] = time.perf_counter() - self.start
+
+    def report(self) -> dict:
+        return {
+            "phases": [{"name": n, "ms": round(s * 1000, 2), "modules": m} for n, s, m in self.phases],
+            "marks_ms": {k: round(v * 1000, 2) for k, v in self.marks.items()},
+            "modules_total": len(sys.modules),
+            "modules_by_package": dict(sorted(self._packages.items(), key=lambda kv: -kv[1])),
+        }
+
+    def emit(self):
+        """ 把报告写入日志，并以一行 JSON 输出到标准输出 """
+        if not self.enabled:
+            return
+        data = self.report()
+        for p in data["phases"]:
+            logger.info(f"启动阶段 {p['name']}: {p['ms']:.1f} ms，加载 {p['modules']} 个模块")
+        for name, ms in data["marks_ms"].items():
+            logger.info(f"启动里程碑 {name}: {ms:.1f} ms")
+        print(REPORT_PREFIX + json.dumps(data, ensure_ascii=False), flush=True)
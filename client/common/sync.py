@@ -0,0 +1,202 @@
+"""
+基于清单 (manifest) 的目录同步
+
+把本地目录中新增或修改过的文件并行上传到服务器。每次同步后会在本地目录中
+缓存一份清单，记录每个文件的本地状态 (大小、mtime，可选内容哈希) 以及上传后
+服务器端的状态 (大小、mtime)。再次同步时只需一次目录扫描和一次 LIST_FILES，
+两边状态都没有变化的文件直接跳过，因此未改动的大目录也能在几秒内完成同步。
+
+服务器按文件名平铺存储，因此只同步目录顶层的普通文件；本地删除的文件不会
+删除服务器上的副本，只会从清单中移除。
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+from common.core import ClientPool, FileClient, DEFAULT_TIMEOUT
+
+MANIFEST_NAME = '.yunpan_manifest.json'
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger('client_logger')
+
+
+class SyncResult:
+    """ 一次同步的统计结果 """
+
+    def __init__(self):
+        self.scanned = 0
+        self.skipped = 0
+        self.hashed = 0
+        self.uploaded = []          # 成功上传的文件名
+        self.failed = []            # (文件名, 错误信息)
+        self.bytes_uploaded = 0
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return (f"SyncResult(scanned={self.scanned}, skipped={self.skipped}, hashed={self.hashed}, "
+                f"uploaded={len(self.uploaded)}, failed={len(self.failed)}, "
+                f"bytes={self.bytes_uploaded}, elapsed={self.elapsed:.2f}s)")
+
+
+def file_hash(path):
+    """ 计算文件内容的 sha256 """
+    digest = hashlib.sha256()
+    buf = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def load_manifest(path, server):
+    """ 读取缓存的清单；文件不存在、损坏或属于其他服务器时返回空清单 """
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("server") != server:
+        logger.info(f"清单 '{path}' 与当前服务器不匹配，将重新建立")
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(path, server, files):
+    """ 先写临时文件再原子替换，避免中断时留下损坏的清单 """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": MANIFEST_VERSION, "server": server, "files": files},
+                  f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def scan_local(directory, manifest_name=MANIFEST_NAME):
+    """ 扫描目录顶层的普通文件: {文件名: (路径, 大小, mtime_ns)} """
+    local = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith(manifest_name) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            local[entry.name] = (entry.path, stat.st_size, stat.st_mtime_ns)
+    return local
+
+
+def plan_sync(local, remote, cached, use_hash=False, result=None):
+    """
+    比较本地扫描结果、服务器列表和缓存清单，返回 (待上传列表, 新清单)
+
+    待上传列表的元素为 (文件名, 路径, 服务器上是否已存在)。新清单只包含
+    判定为无需上传的文件，待上传的文件在上传成功后再补充进去。
+    """
+    pending = []
+    manifest = {}
+    for name, (path, size, mtime_ns) in local.items():
+        remote_info = remote.get(name)
+        entry = cached.get(name)
+        if remote_info is None:
+            pending.append((name, path, False))
+            continue
+
+        remote_unchanged = (entry is not None and entry.get("remote_size") == remote_info["size"]
+                            and entry.get("remote_mtime") == remote_info.get("mtime"))
+        if remote_unchanged and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            manifest[name] = entry
+            continue
+
+        if remote_unchanged and use_hash and entry.get("hash") and entry["size"] == size:
+            # 只有 mtime 变化 (例如 touch 或重新检出)，用内容哈希确认是否真的改动
+            digest = file_hash(path)
+            if result is not None:
+                result.hashed += 1
+            if digest == entry["hash"]:
+                manifest[name] = dict(entry, mtime_ns=mtime_ns)
+                continue
+
+        if entry is None and remote_info["size"] == size and remote_info.get("mtime", 0) * 1e9 >= mtime_ns:
+            # 首次同步没有缓存: 大小一致且服务器副本比本地修改时间更新，视为已同步
+            manifest[name] = {"size": size, "mtime_ns": mtime_ns,
+                              "remote_size": remote_info["size"], "remote_mtime": remote_info.get("mtime")}
+            continue
+
+        pending.append((name, path, True))
+    return pending, manifest
+
+
+def sync_directory(local_dir, host, port, jobs=4, use_hash=False, manifest_path=None,
+                   dry_run=False, timeout=DEFAULT_TIMEOUT, on_file_done=None):
+    """
+    把 local_dir 同步到服务器，返回 SyncResult
+
+    on_file_done(文件名, 字节数, 异常或 None) 会在每个文件上传结束后调用。
+    """
+    result = SyncResult()
+    started = time.perf_counter()
+    server = f"{host}:{port}"
+    manifest_path = manifest_path or os.path.join(local_dir, MANIFEST_NAME)
+    cached = load_manifest(manifest_path, server)
+
+    local = scan_local(local_dir, os.path.basename(manifest_path))
+    result.scanned = len(local)
+    with FileClient(host, port, timeout) as client:
+        remote = {info['name']: info for info in client.list_files()}
+
+    pending, manifest = plan_sync(local, remote, cached, use_hash, result)
+    result.skipped = len(local) - len(pending)
+    logger.info(f"同步 '{local_dir}': 扫描 {len(local)} 个文件，需要上传 {len(pending)} 个")
+
+    if dry_run:
+        result.uploaded = [name for name, _, _ in pending]
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    if pending:
+        def upload(client, item):
+            name, path, exists = item
+            client.upload(path, name, update=exists)
+            return os.path.getsize(path)
+
+        with ClientPool(host, port, size=jobs, timeout=timeout) as pool:
+            for (name, path, _), nbytes, error in pool.map(upload, pending):
+                if error is not None:
+                    result.failed.append((name, str(error)))
+                else:
+                    result.uploaded.append(name)
+                    result.bytes_uploaded += nbytes
+                if on_file_done is not None:
+                    on_file_done(name, nbytes or 0, error)
+
+            # 上传后再取一次列表，记录服务器端状态，作为下次增量同步的依据
+            remote = {info['name']: info for info in pool.run(lambda c: c.list_files())}
+
+        for name in result.uploaded:
+            path, size, mtime_ns = local[name]
+            remote_info = remote.get(name)
+            if remote_info is None:
+                continue
+            entry = {"size": size, "mtime_ns": mtime_ns,
+                     "remote_size": remote_info["size"], "remote_mtime": remote_info.get("mtime")}
+            if use_hash:
+                entry["hash"] = file_hash(path)
+            manifest[name] = entry
+
+    if use_hash:
+        # 为首次同步或尚未记录哈希的文件补算哈希，方便下次识别仅 mtime 变化的文件
+        for name, entry in manifest.items():
+            if "hash" not in entry:
+                entry["hash"] = file_hash(local[name][0])
+                result.hashed += 1
+
+    if manifest != cached:
+        save_manifest(manifest_path, server, manifest)
+    result.elapsed = time.perf_counter() - started
+    logger.info(f"同步完成: {result}")
+    return result
@@ -0,0 +1,133 @@
+"""
+客户端请求追踪
+
+与服务器的 --trace-file 对应: 图形客户端以 --trace-file 启动后，NetworkThread 处理的每个请求
+写一行 JSON，字段与服务器端相同 ("side" 为 "client")，两边按时间对齐即可看出慢在哪一侧:
+
+    connect                 建立连接 (含重连)
+    server_wait             请求发出后等待响应头，包含服务器处理和网络往返
+    net_send / net_recv     发送文件数据 / 接收数据体
+    disk_read / disk_write  读取本地文件 / 写入下载文件
+    cache                   从本地内容缓存复制
+
+FileClient.trace 默认为 NULL_TRACE，不追踪时各处的计时都是空操作。
+"""
+import json
+import threading
+import time
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class RequestTrace:
+    """ 一个请求的追踪记录 """
+
+    def __init__(self, tracer, command, name=None):
+        self.tracer = tracer
+        self.record = {"ts": time.time(), "side": "client", "cmd": command, "name": name,
+                       "bytes": 0, "status": "ok"}
+        self.spans = {}
+        self._start = time.perf_counter()
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def finish(self):
+        record = self.record
+        record["total_ms"] = round((time.perf_counter() - self._start) * 1000, 3)
+        record["spans"] = {k: round(v * 1000, 3) for k, v in self.spans.items()}
+        self.tracer.write(record)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _NullTrace:
+    _span = _NullSpan()
+
+    def span(self, name):
+        return self._span
+
+    def add(self, name, seconds):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Tracer:
+    """ 追加写入 JSONL 文件；客户端请求量小，直接在调用线程中写入 """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def begin(self, command, name=None):
+        return RequestTrace(self, command, name)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class _NullTracer:
+    def begin(self, command, name=None):
+        return NULL_TRACE
+
+    def close(self):
+        pass
+
+
+_tracer = _NullTracer()
+
+
+def configure(path):
+    """ 启用追踪 (path 为 None 时关闭)，之后创建的 NetworkThread 使用它 """
+    global _tracer
+    _tracer.close()
+    _tracer = Tracer(path) if path else _NullTracer()
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
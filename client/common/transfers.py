@@ -0,0 +1,248 @@
+"""
+传输任务列表
+
+图形界面的 NetworkThread 按顺序处理请求队列，原来的界面只有一个进度条，排队和进行中的
+传输会互相覆盖进度。TransferList 记录每个传输 (排队、进行中、暂停、完成、失败) 的
+已传输字节数，与界面无关，也不依赖 Qt:
+
+    网络线程   add() 登记，start()/progress()/finish() 更新；progress() 只累加数字，
+              每个数据块调用一次也没有负担
+    界面线程   按固定间隔调用 sample()，取得自上次以来新增和变化的条目，
+              同时计算每个条目的速度、剩余时间以及总吞吐量
+
+速度用指数加权平均平滑，刷新频率由界面的定时器决定，与数据块的多少无关。
+完成的条目超过 max_finished 时最早的会被移除，列表不会无限增长。
+"""
+import itertools
+import threading
+import time
+
+QUEUED, ACTIVE, PAUSED, DONE, FAILED = 'queued', 'active', 'paused', 'done', 'failed'
+STATE_NAMES = {QUEUED: '排队中', ACTIVE: '进行中', PAUSED: '已暂停', DONE: '已完成', FAILED: '失败'}
+FINISHED_STATES = (DONE, FAILED)
+
+RATE_SMOOTHING = 0.3                # 速度的指数加权系数，越大越跟随瞬时值
+DEFAULT_MAX_FINISHED = 500
+
+
+class Transfer:
+    """ 一个传输条目；字段由 TransferList 在持有锁时修改，界面只读 """
+
+    __slots__ = ('id', 'kind', 'name', 'state', 'done', 'total', 'message',
+                 'rate', 'eta', 'started', 'finished', '_sampled_done', '_sampled_at')
+
+    def __init__(self, transfer_id, kind, name, total):
+        self.id = transfer_id
+        self.kind = kind            # 'download' / 'upload' / 'update'
+        self.name = name
+        self.state = QUEUED
+        self.done = 0
+        self.total = total
+        self.message = ''
+        self.rate = 0.0             # 字节/秒
+        self.eta = None             # 剩余秒数，未知时为 None
+        self.started = None
+        self.finished = None
+        self._sampled_done = 0
+        self._sampled_at = None
+
+    @property
+    def fraction(self):
+        if self.state == DONE:
+            return 1.0
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+
+class TransferSummary:
+    """ sample() 时所有条目的汇总 """
+
+    __slots__ = ('queued', 'active', 'paused', 'done', 'failed', 'rate')
+
+    def __init__(self):
+        self.queued = self.active = self.paused = self.done = self.failed = 0
+        self.rate = 0.0
+
+
+class TransferList:
+    """ 线程安全的传输列表，网络线程写入，界面线程按固定间隔 sample() """
+
+    def __init__(self, max_finished: int = DEFAULT_MAX_FINISHED):
+        self.max_finished = max_finished
+        self._items = []                # 按登记顺序
+        self._by_id = {}
+        self._added = []                # 上次 sample() 之后新登记的条目
+        self._dirty = set()             # 上次 sample() 之后状态或进度变化的条目 id
+        self._removed = False           # 上次 sample() 之后是否有条目被移除
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._transferred = 0           # 全部条目累计传输的字节数
+        self._sampled_transferred = 0
+        self._sampled_at = None
+        self._rate = 0.0
+
+    # ------------------------------------------------------------------
+    # 网络线程
+
+    def add(self, kind: str, name: str, total: int = 0) -> int:
+        """ 登记一个排队中的传输，返回其 id """
+        with self._lock:
+            item = Transfer(next(self._ids), kind, name, total)
+            self._items.append(item)
+            self._by_id[item.id] = item
+            self._added.append(item)
+            return item.id
+
+    def start(self, transfer_id: int, total: int = None):
+        with self._lock:
+            item = self._by_id.get(transfer_id)
+            if item is None:
+                return
+            item.state = ACTIVE
+            item.started = time.monotonic()
+            if total is not None:
+                item.total = total
+            self._dirty.add(transfer_id)
+
+    def progress(self, transfer_id: int, done: int, total: int):
+        """ 已传输 done / total 字节；断线续传时 done 可能回退，只累计增加的部分 """
+        with self._lock:
+            item = self._by_id.get(transfer_id)
+            if item is None:
+                return
+            if done > item.done:
+                self._transferred += done - item.done
+            item.done = done
+            item.total = total
+            self._dirty.add(transfer_id)
+
+    def finish(self, transfer_id: int, success: bool, message: str = ''):
+        """ 结束一个传输；已经结束的条目不再改变 """
+        with self._lock:
+            item = self._by_id.get(transfer_id)
+            if item is None or item.state in FINISHED_STATES:
+                return
+            item.state = DONE if success else FAILED
+            item.message = message
+            item.finished = time.monotonic()
+            item.rate = 0.0
+            item.eta = None
+            self._dirty.add(transfer_id)
+
+    def pending(self) -> int:
+        """ 尚未结束 (排队、进行中或暂停) 的传输数 """
+        with self._lock:
+            return sum(1 for item in self._items if item.state not in FINISHED_STATES)
+
+    def is_paused(self, transfer_id: int) -> bool:
+        item = self._by_id.get(transfer_id)
+        return item is not None and item.state == PAUSED
+
+    def is_active(self, transfer_id: int) -> bool:
+        item = self._by_id.get(transfer_id)
+        return item is not None and item.state == ACTIVE
+
+    # ------------------------------------------------------------------
+    # 界面线程
+
+    def pause(self, transfer_id: int) -> bool:
+        """ 暂停一个尚未开始的传输，网络线程会跳过它；进行中的传输不能暂停 """
+        return self._set_waiting(transfer_id, QUEUED, PAUSED)
+
+    def resume(self, transfer_id: int) -> bool:
+        return self._set_waiting(transfer_id, PAUSED, QUEUED)
+
+    def _set_waiting(self, transfer_id, expected, state):
+        with self._lock:
+            item = self._by_id.get(transfer_id)
+            if item is None or item.state != expected:
+                return False
+            item.state = state
+            self._dirty.add(transfer_id)
+            return True
+
+    def clear_finished(self) -> int:
+        """ 移除已完成和失败的条目，返回移除的数量 """
+        with self._lock:
+            return self._drop_finished(len(self._items))
+
+    def _drop_finished(self, count):
+        """ 移除最早的 count 个已结束条目，调用方持有锁 """
+        kept = []
+        removed = 0
+        for item in self._items:
+            if removed < count and item.state in FINISHED_STATES:
+                del self._by_id[item.id]
+                self._dirty.discard(item.id)
+                removed += 1
+            else:
+                kept.append(item)
+        if removed:
+            self._items = kept
+            self._added = [item for item in self._added if item.id in self._by_id]
+            self._removed = True
+        return removed
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._items)
+
+    def sample(self, now: float = None):
+        """
+        更新速度和剩余时间，返回 (新增条目, 变化条目的 id 集合, 是否有条目被移除, TransferSummary)
+
+        有条目被移除时界面应按 items() 重建，新增和变化的条目此时已包含在内。
+        """
+        now = time.monotonic() if now is None else now
+        summary = TransferSummary()
+        with self._lock:
+            finished = sum(1 for item in self._items if item.state in FINISHED_STATES)
+            if finished > self.max_finished:
+                self._drop_finished(finished - self.max_finished)
+            added, self._added = self._added, []
+            dirty, self._dirty = self._dirty, set()
+            removed, self._removed = self._removed, False
+
+            for item in self._items:
+                if item.state == ACTIVE:
+                    self._sample_item(item, now)
+                    dirty.add(item.id)
+                setattr(summary, item.state, getattr(summary, item.state) + 1)
+
+            if self._sampled_at is not None and now > self._sampled_at:
+                instant = (self._transferred - self._sampled_transferred) / (now - self._sampled_at)
+                self._rate += RATE_SMOOTHING * (instant - self._rate)
+            if not summary.active:
+                self._rate = 0.0
+            self._sampled_transferred = self._transferred
+            self._sampled_at = now
+            summary.rate = self._rate
+        return added, dirty, removed, summary
+
+    @staticmethod
+    def _sample_item(item, now):
+        if item._sampled_at is not None and now > item._sampled_at:
+            instant = max(0, item.done - item._sampled_done) / (now - item._sampled_at)
+            item.rate += RATE_SMOOTHING * (instant - item.rate)
+        elif item.started is not None and now > item.started:
+            item.rate = item.done / (now - item.started)
+        item._sampled_done = item.done
+        item._sampled_at = now
+        remaining = item.total - item.done
+        item.eta = remaining / item.rate if item.rate > 0 and remaining >= 0 else None
+
+
+def format_rate(rate: float) -> str:
+    for unit in ('B/s', 'KB/s', 'MB/s', 'GB/s'):
+        if rate < 1024.0:
+            return f"{rate:.0f} {unit}" if unit == 'B/s' else f"{rate:.1f} {unit}"
+        rate /= 1024.0
+    return f"{rate:.1f} TB/s"
+
+
+def format_eta(seconds) -> str:
+    if seconds is None:
+        return '--'
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
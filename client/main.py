@@ -1,64 +1,122 @@
+import time
+_START = time.perf_counter()
+
 import sys
 import os
+import argparse
 import logging
-from PySide6.QtWidgets import QApplication
-from PySide6.QtCore import Qt
 from common.utils import setup_logger
-from view.login_window import LoginWindow
-from view.files_window import FilesWindow
+from common.startup import StartupProfiler
+from common import tracing
 
 # 设置日志
 logger = setup_logger()
 
+# 登录窗口显示后，空闲多久开始预加载文件窗口模块 (毫秒)
+PREWARM_DELAY_MS = 200
+
 class Client:
-    def __init__(self):
+    """
+    登录窗口只依赖最少的模块；文件窗口及其依赖在登录窗口显示后的空闲时间预加载，
+    第一次连接成功时才创建，之后断开重连都复用同一个窗口，不再重新构建
+    """
+    def __init__(self, profiler=None, exit_after_startup=False):
         self.login_window = None
         self.files_window = None
-    
+        self.profiler = profiler or StartupProfiler()
+        self.exit_after_startup = exit_after_startup
+
     def start(self):
         """ 启动客户端应用程序 """
         logger.info("客户端程序启动")
-        
+
+        with self.profiler.phase("import login_window"):
+            from view.login_window import LoginWindow
+
         # 创建登录窗口
-        self.login_window = LoginWindow()
-        self.login_window.connect_success.connect(self._on_connect_success)
-        self.login_window.show()
-    
+        with self.profiler.phase("create LoginWindow"):
+            self.login_window = LoginWindow()
+            self.login_window.connect_success.connect(self._on_connect_success)
+        with self.profiler.phase("show LoginWindow"):
+            self.login_window.show()
+
+        from PySide6.QtCore import QTimer
+        QTimer.singleShot(0, self._on_first_idle)
+
+    def _on_first_idle(self):
+        """ 事件循环开始处理事件，登录窗口已可交互 """
+        self.profiler.mark("login_window_ready")
+        from PySide6.QtCore import QTimer
+        QTimer.singleShot(PREWARM_DELAY_MS, self._prewarm)
+
+    def _prewarm(self):
+        """ 预先导入文件窗口模块，连接成功时不再等待导入 """
+        with self.profiler.phase("prewarm files_window"):
+            import view.files_window  # noqa: F401
+        self.profiler.mark("prewarm_done")
+        self.profiler.emit()
+        if self.exit_after_startup:
+            from PySide6.QtWidgets import QApplication
+            QApplication.quit()
+
     def _on_connect_success(self, host, port, network_thread):
         """ 连接成功，打开文件窗口 """
-        # 创建文件窗口
-        self.files_window = FilesWindow(host, port, network_thread)
-        self.files_window.disconnect_requested.connect(self._on_disconnect)
+        if self.files_window is None:
+            from view.files_window import FilesWindow
+            self.files_window = FilesWindow(host, port, network_thread)
+            self.files_window.disconnect_requested.connect(self._on_disconnect)
+        else:
+            # 复用之前的窗口，只切换连接信息并重新加载列表
+            self.files_window.attach(host, port)
         self.files_window.show()
-    
+
     def _on_disconnect(self):
         """ 断开连接，返回登录窗口 """
+        # 文件窗口只是隐藏，下次连接时复用
 
-        # 销毁文件窗口
-        if self.files_window:
-            self.files_window = None
-        
         # 重新显示登录窗口
         if self.login_window:
             self.login_window.show()
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="云盘客户端")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="统计启动各阶段耗时和加载的模块数，输出到日志和标准输出")
+    parser.add_argument("--exit-after-startup", action="store_true",
+                        help="启动完成 (含预加载) 后立即退出，用于启动耗时基准测试")
+    parser.add_argument("--trace-file", type=str, default=None,
+                        help="把每个网络请求的分阶段耗时以 JSONL 格式追加到该文件")
+    # 其余参数 (如 Qt 自身的 -platform) 留给 QApplication
+    return parser.parse_known_args(argv)
+
 def main():
+    args, qt_argv = parse_args(sys.argv[1:])
+    profiler = StartupProfiler(args.profile_startup, start=_START)
+    if args.trace_file:
+        tracing.configure(args.trace_file)
+
     os.environ["QT_ENABLE_HIGHDPI_SCALING"] = "0"
     os.environ["QT_SCALE_FACTOR"] = "1.25"
-    
-    app = QApplication(sys.argv)
-    app.setAttribute(Qt.ApplicationAttribute.AA_DontCreateNativeWidgetSiblings)
-    app.setQuitOnLastWindowClosed(True)
-    
+
+    with profiler.phase("import PySide6"):
+        from PySide6.QtWidgets import QApplication
+        from PySide6.QtCore import Qt
+
+    with profiler.phase("create QApplication"):
+        app = QApplication([sys.argv[0]] + qt_argv)
+        app.setAttribute(Qt.ApplicationAttribute.AA_DontCreateNativeWidgetSiblings)
+        app.setQuitOnLastWindowClosed(True)
+
     # 创建并启动客户端
-    client = Client()
+    client = Client(profiler, args.exit_after_startup)
     client.start()
-    
+
     exit_code = app.exec()
-    
+
     logger.info(f"客户端程序退出，状态码: {exit_code}")
+    tracing.get_tracer().close()
     logging.shutdown()
     return exit_code
 
 if __name__ == '__main__':
-    sys.exit(main()) 
\ No newline at end of file
+    sys.exit(main())
@@ -9,12 +9,13 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtGui import QIcon, QColor, QFont
 from qfluentwidgets import (
-    PushButton, SubtitleLabel, TableWidget, ProgressBar, 
+    PushButton, SubtitleLabel, TableWidget, 
     InfoBar, InfoBarPosition, CardWidget, StrongBodyLabel, 
     TransparentToolButton, MSFluentTitleBar, ToolButton,
-    FluentIcon as FIF, setTheme, Theme
+    FluentIcon as FIF
 )
-# from common.network import NetworkThread
+from common.network import NotificationThread
+from view.transfer_panel import TransferPanel
 
 if sys.platform == 'win32' and sys.getwindowsversion().build >= 22000: # Windows 11
     from qframelesswindow import AcrylicWindow as Window
@@ -78,12 +79,35 @@ class FilesWindow(Window):
         # 初始化信号
         self.initSignals()
         
-        # 记录当前任务
-        self.current_task = None
+        # 文件名 -> 表格中的文件名单元格，用于按变更通知增量更新
+        self._name_items = {}
+
+        # 订阅服务器的文件变更通知，其他用户的上传/更新也能实时显示
+        self._start_notifier()
         
         # 连接成功后自动刷新文件列表
         QTimer.singleShot(100, self.refresh_files_requested)
 
+    def _start_notifier(self):
+        self.notifier = NotificationThread(self.host, self.port, self)
+        self.notifier.file_event.connect(self.apply_file_event)
+        self.notifier.resync_required.connect(self.refresh_files_requested)
+        self.notifier.start()
+
+    def attach(self, host, port):
+        """
+        断开后重新连接时复用本窗口，不重新构建界面；
+        网络线程属于登录窗口，前后是同一个对象，信号无需重新连接
+        """
+        if self.notifier.isRunning():
+            self.notifier.stop()
+        self.host = host
+        self.port = port
+        self.setWindowTitle(f"云盘客户端 - 已连接到 {self.host}")
+        self.update_file_list([])
+        self._start_notifier()
+        QTimer.singleShot(100, self.refresh_files_requested)
+
     def initWindow(self):
         """初始化窗口属性"""
         # 设置窗口尺寸
@@ -95,8 +119,7 @@ class FilesWindow(Window):
         self.setWindowIcon(QIcon('resources/logo.png'))
         self.setWindowTitle(f"云盘客户端 - 已连接到 {self.host}")
         
-        # 设置窗口主题
-        setTheme(Theme.AUTO)
+        # 主题是全局设置，登录窗口已经设置过，这里不再重复触发全局样式刷新
         
         # 居中显示
         desktop = QApplication.primaryScreen().availableGeometry()
@@ -169,20 +192,8 @@ class FilesWindow(Window):
         tableLayout.addLayout(tableHeaderLayout)
         tableLayout.addWidget(self.fileTable)
 
-        # 状态/进度区域
-        self.statusCard = CardWidget(self)
-        self.statusCard.setVisible(False)  # 默认隐藏
-        statusLayout = QVBoxLayout(self.statusCard)
-        statusLayout.setContentsMargins(20, 15, 20, 15)
-        
-        self.taskNameLabel = StrongBodyLabel("当前任务: 无", self)
-        self.progressBar = ProgressBar(self)
-        self.progressBar.setMinimum(0)
-        self.progressBar.setMaximum(100)
-        self.progressBar.setValue(0)
-        
-        statusLayout.addWidget(self.taskNameLabel)
-        statusLayout.addWidget(self.progressBar)
+        # 传输列表，第一个传输登记后显示
+        self.transferPanel = TransferPanel(self.network_thread.transfers, self)
 
         # 空状态提示
         self.emptyStateFrame = QFrame(self)
@@ -207,7 +218,7 @@ class FilesWindow(Window):
         self.mainLayout.addWidget(self.titleCard)
         self.mainLayout.addWidget(self.toolCard)
         self.mainLayout.addWidget(self.tableCard, 1)  # 表格区域占据剩余空间
-        self.mainLayout.addWidget(self.statusCard)
+        self.mainLayout.addWidget(self.transferPanel)
         
         # 设置样式
         self.setStyleSheet("""
@@ -230,16 +241,15 @@ class FilesWindow(Window):
         
         # 连接网络线程的信号
         self.network_thread.file_list_received.connect(self.update_file_list)
-        self.network_thread.download_progress.connect(lambda fn, p: self.set_progress(f"下载 '{fn}'", p))
+        # 进度由传输列表按固定间隔读取，这里只处理完成事件
         self.network_thread.download_finished.connect(self._on_download_finished)
-        self.network_thread.upload_progress.connect(lambda fn, p: self.set_progress(f"上传 '{fn}'", p))
         self.network_thread.upload_finished.connect(self._on_upload_finished)
-        self.network_thread.update_progress.connect(lambda fn, p: self.set_progress(f"更新 '{fn}'", p))
         self.network_thread.update_finished.connect(self._on_update_finished)
         self.network_thread.general_message.connect(self._show_general_message)
 
     def _on_disconnect_clicked(self):
         """处理断开连接按钮点击"""
+        self.notifier.stop()
         self.disconnect_requested.emit()
         self.close()  # 关闭文件窗口
 
@@ -249,11 +259,13 @@ class FilesWindow(Window):
 
     def _on_upload_clicked(self):
         """处理上传按钮点击事件"""
-        local_path, _ = QFileDialog.getOpenFileName(self, "选择要上传的文件")
-        if local_path:
+        local_paths, _ = QFileDialog.getOpenFileNames(self, "选择要上传的文件")
+        for local_path in local_paths:
             server_filename = os.path.basename(local_path)
             self.network_thread.upload_client_file(local_path, server_filename)
             logger.info(f"用户请求上传文件: '{server_filename}'")
+        if local_paths:
+            self.transferPanel.watch()
 
     def _request_download(self, server_filename):
         """请求下载指定文件"""
@@ -263,6 +275,7 @@ class FilesWindow(Window):
         if save_path:
             self.network_thread.download_server_file(server_filename, save_path)
             logger.info(f"用户请求下载文件: '{server_filename}'")
+            self.transferPanel.watch()
 
     def _request_update(self, server_filename):
         """请求更新指定文件"""
@@ -272,33 +285,54 @@ class FilesWindow(Window):
         if local_path:
             self.network_thread.update_file(local_path, server_filename)
             logger.info(f"用户请求更新文件: '{server_filename}'")
+            self.transferPanel.watch()
 
     def update_file_list(self, files: list):
         """更新文件表格显示"""
         # 清空表格
         self.fileTable.setRowCount(0)
+        self._name_items.clear()
         
-        # 显示空状态或更新表格
-        if not files:
-            self.emptyStateFrame.setVisible(True)
-            self.tableHeaderLabel.setText("文件列表 (空)")
-        else:
-            self.emptyStateFrame.setVisible(False)
-            self.tableHeaderLabel.setText(f"文件列表 ({len(files)}个文件)")
-            
-            # 添加所有文件到表格
-            for file_info in files:
-                self._add_file_to_table(file_info['name'], file_info['size'])
+        # 添加所有文件到表格
+        for file_info in files:
+            self._add_file_to_table(file_info['name'], file_info['size'])
+        self._update_table_header()
         
         logger.info(f"已更新服务器文件列表 (共{len(files)}个文件)")
 
+    def apply_file_event(self, event: dict):
+        """ 按服务器推送的变更通知增量更新表格，不重新请求完整列表 """
+        kind, filename = event.get("type"), event.get("name")
+        item = self._name_items.get(filename)
+        if kind == "remove":
+            if item is not None:
+                self.fileTable.removeRow(self.fileTable.row(item))
+                del self._name_items[filename]
+        elif kind in ("add", "update"):
+            if item is None:
+                self._add_file_to_table(filename, event["size"])
+            else:
+                self.fileTable.setItem(self.fileTable.row(item), 1, FileSizeItem(event["size"]))
+        else:
+            return
+        self._update_table_header()
+        logger.debug(f"文件变更通知: {kind} '{filename}'")
+
+    def _update_table_header(self):
+        """ 根据当前行数更新表格标题和空状态提示 """
+        count = self.fileTable.rowCount()
+        self.emptyStateFrame.setVisible(count == 0)
+        self.tableHeaderLabel.setText(f"文件列表 ({count}个文件)" if count else "文件列表 (空)")
+
     def _add_file_to_table(self, filename, size):
         """向表格添加一个文件项"""
         row = self.fileTable.rowCount()
         self.fileTable.insertRow(row)
         
         # 文件名列
-        self.fileTable.setItem(row, 0, FileTableItem(filename))
+        name_item = FileTableItem(filename)
+        self.fileTable.setItem(row, 0, name_item)
+        self._name_items[filename] = name_item
         
         # 文件大小列
         self.fileTable.setItem(row, 1, FileSizeItem(size))
@@ -329,60 +363,48 @@ class FilesWindow(Window):
         updateLayout.addWidget(updateButton)
         self.fileTable.setCellWidget(row, 3, updateWidget)
 
-    def set_progress(self, task_name, percentage):
-        """设置任务进度"""
-        self.current_task = task_name
-        self.taskNameLabel.setText(f"当前任务: {task_name}")
-        self.progressBar.setValue(percentage)
-        
-        # 显示进度区域
-        if not self.statusCard.isVisible():
-            self.statusCard.setVisible(True)
-
-    def task_finished(self, task_name=None):
-        """任务完成，隐藏进度条"""
-        # 如果指定了任务名，且不是当前任务，则忽略
-        if task_name and task_name != self.current_task:
-            return
-            
-        # 重置并隐藏进度区域
-        self.progressBar.setValue(0)
-        self.taskNameLabel.setText("当前任务: 无")
-        self.statusCard.setVisible(False)
-        self.current_task = None
+    def _show_finished(self, title, message):
+        """ 成功的消息只在最后一个传输结束时显示，批量传输不会连续弹出消息条 """
+        if not self.network_thread.transfers.pending():
+            self.show_message("success", title, message)
 
     def _on_download_finished(self, filename, success, message):
         """ 处理下载完成事件 """
-        self.task_finished(f"下载 '{filename}'")
         if success:
             logger.info(f"下载完成: {message}")
-            self.show_message("success", "下载完成", message)
+            self._show_finished("下载完成", message)
         else:
             logger.error(f"下载失败: {message}")
             self.show_message("error", "下载失败", message)
 
     def _on_upload_finished(self, filename, success, message):
         """ 处理上传完成事件 """
-        self.task_finished(f"上传 '{filename}'")
         if success:
             logger.info(f"上传完成: {message}")
-            self.show_message("success", "上传完成", message)
-            self.refresh_files_requested()  # 上传成功后刷新列表
+            self._show_finished("上传完成", message)
+            if not self.notifier.is_subscribed:
+                self.refresh_files_requested()  # 未订阅变更通知时，上传成功后刷新列表
         else:
             logger.error(f"上传失败: {message}")
             self.show_message("error", "上传失败", message)
             
     def _on_update_finished(self, filename, success, message):
         """ 处理更新完成事件 """
-        self.task_finished(f"更新 '{filename}'")
         if success:
             logger.info(f"更新完成: {message}")
-            self.show_message("success", "更新完成", message)
-            self.refresh_files_requested()  # 更新成功后刷新列表
+            self._show_finished("更新完成", message)
+            if not self.notifier.is_subscribed:
+                self.refresh_files_requested()  # 未订阅变更通知时，更新成功后刷新列表
         else:
             logger.error(f"更新失败: {message}")
             self.show_message("error", "更新失败", message)
 
+    def closeEvent(self, event):
+        """ 关闭窗口时停止变更通知线程 """
+        if self.notifier.isRunning():
+            self.notifier.stop()
+        super().closeEvent(event)
+
     def _show_general_message(self, msg_type, content):
         """ 显示一般消息 """
         if msg_type == "error":
@@ -0,0 +1,206 @@
+import logging
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
+from PySide6.QtWidgets import (
+    QHBoxLayout, QVBoxLayout, QStyledItemDelegate, QStyleOptionProgressBar, QStyle,
+    QApplication, QHeaderView, QAbstractItemView
+)
+from qfluentwidgets import CardWidget, StrongBodyLabel, PushButton, TableView, FluentIcon as FIF
+
+from common.transfers import (
+    TransferList, STATE_NAMES, ACTIVE, PAUSED, QUEUED, format_rate, format_eta
+)
+
+REFRESH_INTERVAL_MS = 250           # 刷新间隔，与传输的数据块多少无关
+KIND_NAMES = {'download': '下载', 'upload': '上传', 'update': '更新'}
+COLUMNS = ("文件名", "操作", "状态", "进度", "速度", "剩余时间")
+PROGRESS_COLUMN = 3
+
+logger = logging.getLogger('client_logger')
+
+
+class TransferTableModel(QAbstractTableModel):
+    """ TransferList 的表格模型，由定时器调用 refresh()，只通知新增和变化的行 """
+
+    def __init__(self, transfers: TransferList, parent=None):
+        super().__init__(parent)
+        self.transfers = transfers
+        self._rows = []             # Transfer 对象，与表格行一一对应
+        self._row_of = {}           # 条目 id -> 行号
+        self.summary = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        item = self._rows[index.row()]
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return item.name
+            if column == 1:
+                return KIND_NAMES.get(item.kind, item.kind)
+            if column == 2:
+                return STATE_NAMES[item.state]
+            if column == PROGRESS_COLUMN:
+                return f"{item.fraction * 100:.0f}%"
+            if column == 4:
+                return format_rate(item.rate) if item.state == ACTIVE else ''
+            if column == 5:
+                return format_eta(item.eta) if item.state == ACTIVE else ''
+        elif role == Qt.ItemDataRole.UserRole and column == PROGRESS_COLUMN:
+            return item.fraction
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            return item.message or item.name
+        elif role == Qt.ItemDataRole.TextAlignmentRole and column >= PROGRESS_COLUMN:
+            return int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        return None
+
+    def transfer_at(self, row):
+        return self._rows[row]
+
+    def refresh(self):
+        """ 从 TransferList 取变化，返回汇总 (TransferSummary) """
+        added, dirty, removed, self.summary = self.transfers.sample()
+        if removed:
+            self.beginResetModel()
+            self._rows = self.transfers.items()
+            self._row_of = {item.id: row for row, item in enumerate(self._rows)}
+            self.endResetModel()
+            return self.summary
+
+        if added:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            for item in added:
+                self._row_of[item.id] = len(self._rows)
+                self._rows.append(item)
+            self.endInsertRows()
+
+        # 变化的行合并成一个范围通知，几百个条目时也只触发一次重绘
+        rows = [self._row_of[i] for i in dirty if i in self._row_of]
+        if rows:
+            self.dataChanged.emit(self.index(min(rows), 0), self.index(max(rows), len(COLUMNS) - 1))
+        return self.summary
+
+
+class ProgressDelegate(QStyledItemDelegate):
+    """ 在进度列中绘制进度条，不为每行创建控件 """
+
+    def paint(self, painter, option, index):
+        fraction = index.data(Qt.ItemDataRole.UserRole)
+        if fraction is None:
+            return super().paint(painter, option, index)
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(4, 6, -4, -6)
+        bar.minimum = 0
+        bar.maximum = 1000
+        bar.progress = int(fraction * 1000)
+        bar.text = index.data(Qt.ItemDataRole.DisplayRole)
+        bar.textVisible = True
+        bar.state = option.state
+        QApplication.style().drawControl(QStyle.ControlElement.CE_ProgressBar, bar, painter)
+
+
+class TransferPanel(CardWidget):
+    """ 传输列表: 每个排队、进行中、暂停和已结束的传输一行，标题显示总吞吐量 """
+
+    def __init__(self, transfers: TransferList, parent=None):
+        super().__init__(parent)
+        self.model = TransferTableModel(transfers, self)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        headerLayout = QHBoxLayout()
+        headerLayout.setContentsMargins(20, 15, 20, 10)
+        self.summaryLabel = StrongBodyLabel("传输列表", self)
+        self.pauseButton = PushButton("暂停/继续", self)
+        self.pauseButton.setIcon(FIF.PAUSE)
+        self.pauseButton.setToolTip("暂停或继续选中的排队任务")
+        self.clearButton = PushButton("清除已结束", self)
+        self.clearButton.setIcon(FIF.DELETE)
+        headerLayout.addWidget(self.summaryLabel)
+        headerLayout.addStretch(1)
+        headerLayout.addWidget(self.pauseButton)
+        headerLayout.addWidget(self.clearButton)
+
+        self.table = TableView(self)
+        self.table.setModel(self.model)
+        self.table.setItemDelegateForColumn(PROGRESS_COLUMN, ProgressDelegate(self.table))
+        self.table.setWordWrap(False)
+        self.table.setShowGrid(False)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.table.verticalHeader().setVisible(False)
+        self.table.verticalHeader().setDefaultSectionSize(32)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        for column, width in ((1, 60), (2, 70), (3, 120), (4, 100), (5, 80)):
+            self.table.setColumnWidth(column, width)
+        self.table.setMinimumHeight(140)
+
+        layout.addLayout(headerLayout)
+        layout.addWidget(self.table)
+
+        self.pauseButton.clicked.connect(self._toggle_selected)
+        self.clearButton.clicked.connect(self._clear_finished)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_INTERVAL_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.setVisible(False)      # 第一个传输登记后才显示
+
+    def watch(self):
+        """ 有新的传输登记时调用，开始按固定间隔刷新 """
+        if not self.timer.isActive():
+            self.timer.start()
+        self.refresh()
+
+    def refresh(self):
+        summary = self.model.refresh()
+        if self.model.rowCount():
+            self.setVisible(True)
+        parts = []
+        if summary.active:
+            parts.append(f"进行中 {summary.active}")
+        if summary.queued:
+            parts.append(f"排队 {summary.queued}")
+        if summary.paused:
+            parts.append(f"暂停 {summary.paused}")
+        if summary.failed:
+            parts.append(f"失败 {summary.failed}")
+        if summary.done:
+            parts.append(f"完成 {summary.done}")
+        text = "传输列表"
+        if parts:
+            text += f" ({'，'.join(parts)})"
+        if summary.active:
+            text += f"  总速度 {format_rate(summary.rate)}"
+        self.summaryLabel.setText(text)
+        # 没有排队或进行中的传输时停止定时器，空闲时不占用界面线程
+        if not summary.queued and not summary.active:
+            self.timer.stop()
+
+    def _toggle_selected(self):
+        transfers = self.model.transfers
+        for index in self.table.selectionModel().selectedRows():
+            item = self.model.transfer_at(index.row())
+            if item.state == PAUSED:
+                transfers.resume(item.id)
+            elif item.state == QUEUED:
+                transfers.pause(item.id)
+        self.watch()
+
+    def _clear_finished(self):
+        removed = self.model.transfers.clear_finished()
+        logger.debug(f"已清除 {removed} 个结束的传输")
+        self.refresh()
+        if not self.model.rowCount():
+            self.setVisible(False)
@@ -0,0 +1,88 @@
+"""
+可复用的传输缓冲区
+
+上传和下载循环原来每个数据块都 recv()/read() 出一个新的 bytes，数据量大、并发高时
+分配器和垃圾回收的开销在性能剖析中很明显。BufferPool 保存一组可复用的 bytearray，
+传输循环用 recv_into()/readinto() 填充它们，稳定运行后每次传输几乎不再分配内存:
+
+    连接缓冲区   每个连接第一次接收数据时从池中租用一块 --chunk-size 大小的缓冲区
+                (ConnectionBuffers)，该连接上之后的上传和稀疏传输都复用它，连接关闭时归还
+    发送缓冲区   下载按 readahead 的块大小租用 (小文件一块，大文件若干块)，发送结束后归还
+
+池中空闲缓冲区的总字节数有上限 (max_idle_bytes)，超出时归还的缓冲区直接丢弃，
+并发高峰过去后内存会回落。
+"""
+import threading
+
+DEFAULT_CHUNK_SIZE = 65536          # 连接缓冲区大小，即上传接收的单次数据块
+DEFAULT_MAX_IDLE_BYTES = 64 << 20   # 池中空闲缓冲区的总字节数上限
+
+
+class BufferPool:
+    """ 按大小分组的 bytearray 空闲列表，线程安全 """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, max_idle_bytes: int = DEFAULT_MAX_IDLE_BYTES):
+        self.chunk_size = chunk_size
+        self.max_idle_bytes = max_idle_bytes
+        self._free = {}                 # 大小 -> 空闲缓冲区列表
+        self._idle_bytes = 0
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.leased = 0                 # 当前借出的缓冲区数
+
+    def acquire(self, size: int = None) -> bytearray:
+        """ 借出一块 size 字节 (默认 chunk_size) 的缓冲区，内容是上一次使用留下的数据 """
+        size = size or self.chunk_size
+        with self._lock:
+            self.leased += 1
+            free = self._free.get(size)
+            if free:
+                self.reused += 1
+                self._idle_bytes -= size
+                return free.pop()
+            self.created += 1
+        return bytearray(size)
+
+    def release(self, buf: bytearray):
+        """ 归还 acquire 借出的缓冲区；空闲缓冲区超过上限时丢弃 """
+        size = len(buf)
+        with self._lock:
+            self.leased -= 1
+            if self._idle_bytes + size <= self.max_idle_bytes:
+                self._free.setdefault(size, []).append(buf)
+                self._idle_bytes += size
+
+    def connection(self) -> 'ConnectionBuffers':
+        return ConnectionBuffers(self)
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = sum(len(free) for free in self._free.values())
+            return {
+                "chunk_size": self.chunk_size,
+                "created": self.created,
+                "reused": self.reused,
+                "leased": self.leased,
+                "idle": idle,
+                "idle_bytes": self._idle_bytes,
+            }
+
+
+class ConnectionBuffers:
+    """ 单个连接租用的缓冲区，第一次使用时才向池借出，不是线程安全的 """
+
+    def __init__(self, pool: BufferPool):
+        self.pool = pool
+        self._chunk = None
+
+    @property
+    def chunk(self) -> bytearray:
+        if self._chunk is None:
+            self._chunk = self.pool.acquire()
+        return self._chunk
+
+    def close(self):
+        if self._chunk is not None:
+            self.pool.release(self._chunk)
+            self._chunk = None
@@ -0,0 +1,489 @@
+"""
+集群模式
+
+多个 server.py 进程 (也可以在同一台机器上使用不同的端口和目录) 组成一个集群:
+
+    python server/server.py --port 7001 --dir n1 --cluster 127.0.0.1:7001,127.0.0.1:7002,127.0.0.1:7003
+    python server/server.py --port 7002 --dir n2 --cluster 127.0.0.1:7001,127.0.0.1:7002,127.0.0.1:7003
+    ...
+
+放置    文件名按一致性哈希映射到环上 (每个节点 DEFAULT_VNODES 个虚拟节点)，顺时针方向前
+        --replicas 个不同的节点是它的所有者，第一个为主节点。HELLO 返回节点列表，
+        客户端 (common.cluster) 用同样的算法直接连到所有者上传和下载
+写入    节点提交文件后放入复制队列，后台线程把它推送给其余所有者 (REPLICATE)。
+        写到非所有者节点的文件 (例如客户端还在使用旧的节点列表) 同样推送给所有者，
+        确认所有者都有了同一或更新的版本后从本节点删除
+读取    本节点没有请求的文件时，依次把下载请求转发给所有者，响应原样转给客户端
+列表    LIST_FILES 汇总所有节点的列表，同名文件取修改时间最新的一份；SEARCH / STAT 只查询本节点
+成员    CLUSTER_NODES|<json 节点列表> 设置新的节点列表，并转发给新旧列表中的所有节点
+        (cli.py cluster join / leave)；各节点随即重新平衡: 把文件推送给新的所有者，
+        再删除不再由自己负责的副本。离开的节点在 STATS 中 cluster.local_files 变为 0 后
+        即可停止。节点列表不持久化，重启时以 --cluster 为准
+平衡    另外每 --rebalance-interval 秒检查一遍全部文件，补齐推送失败或节点宕机期间缺少的副本
+
+副本沿用源文件的修改时间，同一版本在各节点上的 ETag 相同；同名文件以修改时间新的为准
+(最后写入者胜出)，本地版本不旧于推送来的版本时 REPLICATE 直接跳过。
+
+节点之间的连接先发送 CLUSTER_PEER，这样的连接上 LIST_FILES 只返回本节点的文件、
+下载不再转发，请求不会在节点之间循环:
+
+    CLUSTER_PEER                            -> OK|msg\n
+    REPLICATE|filename|filesize|mtime_ns    -> READY_TO_RECEIVE\n 或 SKIPPED|etag\n，发送数据后 -> OK|msg\n
+    CLUSTER_NODES|<json 节点列表>            -> OK|msg\n
+"""
+import bisect
+import hashlib
+import json
+import logging
+import queue
+import select
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import FileInfo
+
+DEFAULT_REPLICAS = 2
+DEFAULT_VNODES = 128                # 每个节点在环上的虚拟节点数，越多分布越均匀
+DEFAULT_REBALANCE_INTERVAL = 300    # 定期检查副本的间隔 (秒)，0 表示只在启动和成员变更时检查
+PEER_TIMEOUT = 30                   # 节点之间连接和读写的超时 (秒)
+STAT_BATCH = 1000                   # 重新平衡时每个 STAT 请求查询的文件数
+CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger('server_logger')
+
+
+class PeerError(Exception):
+    """ 另一个节点返回 ERROR 或无法识别的响应 """
+
+
+def parse_nodes(text) -> list:
+    """ 解析 'host:port,host:port' 或 JSON 列表形式的节点列表，去掉重复项 """
+    items = text.split(',') if isinstance(text, str) else text
+    nodes = []
+    for item in items:
+        node = str(item).strip()
+        if not node:
+            continue
+        host, sep, port = node.rpartition(':')
+        if not sep or not host or not port.isdigit() or not 0 < int(port) < 65536:
+            raise ValueError(f"无效的节点地址: '{node}' (应为 host:port)")
+        if node not in nodes:
+            nodes.append(node)
+    return nodes
+
+
+def split_address(node: str) -> tuple:
+    host, _, port = node.rpartition(':')
+    return host, int(port)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+def etag_mtime(etag: str) -> int:
+    """ 从 ETag (大小-纳秒修改时间，十六进制) 中取出修改时间 """
+    return int(etag.rpartition('-')[2], 16)
+
+
+class HashRing:
+    """ 一致性哈希环，客户端的 common.cluster.HashRing 必须使用相同的算法 """
+
+    def __init__(self, nodes: list, vnodes: int = DEFAULT_VNODES):
+        self.nodes = list(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [key for key, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owners(self, name: str, count: int) -> list:
+        """ 文件的所有者，主节点在前 """
+        count = min(count, len(self.nodes))
+        result = []
+        if not count:
+            return result
+        i = bisect.bisect(self._keys, _hash(name)) % len(self._keys)
+        while len(result) < count:
+            node = self._owners[i]
+            if node not in result:
+                result.append(node)
+            i = (i + 1) % len(self._keys)
+        return result
+
+
+class PeerClient:
+    """ 到另一个节点的内部连接，不是线程安全的 """
+
+    def __init__(self, node: str, timeout: float = PEER_TIMEOUT):
+        self.node = node
+        self.sock = socket.create_connection(split_address(node), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = bytearray()
+        try:
+            self.request(b"CLUSTER_PEER", "OK")
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def closed(self) -> bool:
+        """ 空闲的连接是否已被对方关闭；只检查，不阻塞 """
+        if self._buffer:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            return bool(readable) and self.sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+
+    def send(self, data: bytes):
+        self.sock.sendall(data)
+
+    def read_line(self) -> str:
+        while True:
+            index = self._buffer.find(b'\n')
+            if index >= 0:
+                line = bytes(self._buffer[:index])
+                del self._buffer[:index + 1]
+                return line.decode('utf-8')
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError(f"节点 {self.node} 关闭了连接")
+            self._buffer += data
+
+    def iter_body(self, size: int):
+        """ 按块产出 size 字节的数据体 """
+        remaining = size
+        if self._buffer:
+            head = bytes(self._buffer[:remaining])
+            del self._buffer[:len(head)]
+            remaining -= len(head)
+            yield head
+        while remaining > 0:
+            data = self.sock.recv(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise ConnectionError(f"节点 {self.node} 在发送数据时关闭了连接")
+            remaining -= len(data)
+            yield data
+
+    def read_exact(self, size: int) -> bytes:
+        return b''.join(self.iter_body(size))
+
+    def request(self, command: bytes, expected: str, body: bytes = b'') -> str:
+        """ 发送命令并读取响应头，状态不是 expected 时抛出 PeerError，返回 payload """
+        self.send(command + b'\n' + body)
+        status, _, payload = self.read_line().partition('|')
+        if status != expected:
+            raise PeerError(f"节点 {self.node} 回复 {status}: {payload}")
+        return payload
+
+    def list_files(self) -> list:
+        length = self.request(b"LIST_FILES", "OK_LIST")
+        return json.loads(self.read_exact(int(length)).decode('utf-8'))
+
+    def stat(self, names: list) -> list:
+        body = json.dumps(names).encode('utf-8')
+        length = self.request(f"STAT|{len(body)}".encode('utf-8'), "OK_STAT", body)
+        return json.loads(self.read_exact(int(length)).decode('utf-8'))
+
+    def replicate(self, f, info: FileInfo) -> bool:
+        """ 推送一个文件，对方已有同一或更新的版本时返回 False """
+        self.send(f"REPLICATE|{info.name}|{info.size}|{info.mtime_ns}\n".encode('utf-8'))
+        status, _, payload = self.read_line().partition('|')
+        if status == "SKIPPED":
+            return False
+        if status != "READY_TO_RECEIVE":
+            raise PeerError(f"节点 {self.node} 拒绝接收 '{info.name}': {payload}")
+        remaining = info.size
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise OSError(f"文件 '{info.name}' 在推送过程中变短")
+            self.sock.sendall(chunk)
+            remaining -= len(chunk)
+        status, _, payload = self.read_line().partition('|')
+        if status != "OK":
+            raise PeerError(f"节点 {self.node} 保存 '{info.name}' 失败: {payload}")
+        return True
+
+
+def _body_length(status: str, payload: str) -> int:
+    """ 下载响应头之后数据体的长度 """
+    fields = payload.split('|')
+    if status == "OK_DOWNLOAD":
+        return int(fields[0])
+    if status == "OK_RANGE":
+        return int(fields[1]) - int(fields[0])
+    if status == "NOT_MODIFIED":
+        return 0
+    raise ValueError(f"无法转发的响应: {status}")
+
+
+class Cluster:
+    """ 本节点的集群成员信息，以及负责复制和重新平衡的后台线程 """
+
+    def __init__(self, self_node: str, nodes: list, replicas: int = DEFAULT_REPLICAS,
+                 rebalance_interval: float = DEFAULT_REBALANCE_INTERVAL):
+        self.self_node = self_node
+        self.replicas = max(1, replicas)
+        self.rebalance_interval = rebalance_interval
+        self.ring = HashRing(nodes)
+        self.ctx = None
+        self._queue = queue.Queue()     # 待同步的文件名；None 表示检查全部文件
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._peers = {}                # 后台线程复用的节点连接
+        self.replicated = 0
+        self.skipped = 0
+        self.handed_off = 0
+        self.proxied = 0
+        self.failures = 0
+        self.rebalances = 0
+
+    @property
+    def nodes(self) -> list:
+        return self.ring.nodes
+
+    def owners(self, name: str) -> list:
+        return self.ring.owners(name, self.replicas)
+
+    def capability(self) -> dict:
+        """ 通过 HELLO 告知客户端，客户端据此直接连到所有者 """
+        return {"nodes": self.nodes, "replicas": self.replicas, "vnodes": DEFAULT_VNODES, "self": self.self_node}
+
+    def start(self, ctx):
+        """ ctx 为 ServerContext；启动后台线程并安排一次全量检查 """
+        self.ctx = ctx
+        threading.Thread(target=self._run, name='cluster', daemon=True).start()
+        self.request_rebalance()
+
+    def request_rebalance(self):
+        self._queue.put(None)
+
+    def file_committed(self, name: str):
+        """ 本节点提交了一个文件 (上传或分片上传)，在后台推送给其余所有者 """
+        with self._lock:
+            if name in self._queued:
+                return
+            self._queued.add(name)
+        self._queue.put(name)
+
+    def update_nodes(self, nodes: list, forward: bool = True) -> list:
+        """
+        设置新的节点列表并开始重新平衡；forward 为真时转发给新旧列表中的其他节点，
+        返回未能通知到的节点
+        """
+        old = self.nodes
+        self.ring = HashRing(nodes)
+        logger.info(f"集群节点列表已更新: {', '.join(nodes)}")
+        self.request_rebalance()
+        if not forward:
+            return []
+        body = json.dumps(nodes)
+        failed = []
+        for node in dict.fromkeys(old + nodes):
+            if node == self.self_node:
+                continue
+            try:
+                peer = PeerClient(node)
+                try:
+                    peer.request(f"CLUSTER_NODES|{body}".encode('utf-8'), "OK")
+                finally:
+                    peer.close()
+            except (OSError, PeerError) as e:
+                logger.error(f"无法把新的节点列表通知 {node}: {e}")
+                failed.append(node)
+        return failed
+
+    # ------------------------------------------------------------------
+    # 后台复制与重新平衡
+
+    def _run(self):
+        interval = self.rebalance_interval
+        next_check = time.monotonic() + interval if interval else None
+        while True:
+            timeout = max(0.0, next_check - time.monotonic()) if next_check is not None else None
+            try:
+                name = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                name = None
+            try:
+                if name is None:
+                    self._rebalance()
+                    next_check = time.monotonic() + interval if interval else None
+                else:
+                    with self._lock:
+                        self._queued.discard(name)
+                    info = self.ctx.storage.stat(name)
+                    if info is not None:
+                        self._sync([info])
+            except Exception as e:
+                logger.error(f"集群同步出错: {e}")
+
+    def _rebalance(self):
+        """ 检查本节点的全部文件，补齐所有者缺少的副本并交出不再负责的文件 """
+        started = time.perf_counter()
+        infos = self.ctx.storage.list()
+        handed_off = self.handed_off
+        for i in range(0, len(infos), STAT_BATCH):
+            self._sync(infos[i:i + STAT_BATCH])
+        self.rebalances += 1
+        logger.info(f"集群重新平衡完成: 检查 {len(infos)} 个文件，交出 {self.handed_off - handed_off} 个，"
+                    f"用时 {time.perf_counter() - started:.2f}s。")
+
+    def _peer(self, node: str) -> PeerClient:
+        """ 复用到 node 的连接，对方已按空闲超时关闭时重新连接 """
+        peer = self._peers.get(node)
+        if peer is not None and peer.closed():
+            self._close_peer(node)
+            peer = None
+        if peer is None:
+            peer = self._peers[node] = PeerClient(node)
+        return peer
+
+    def _close_peer(self, node: str):
+        peer = self._peers.pop(node, None)
+        if peer is not None:
+            peer.close()
+
+    def _sync(self, infos: list):
+        """ 让每个文件的所有者都有不旧于本地的版本；本节点不是所有者的文件确认后删除 """
+        targets = {}                    # 节点 -> 需要检查的本地文件
+        owners_of = {}
+        for info in infos:
+            owners = self.owners(info.name)
+            owners_of[info.name] = owners
+            for node in owners:
+                if node != self.self_node:
+                    targets.setdefault(node, []).append(info)
+
+        confirmed = {}                  # 文件名 -> 已确认的其他所有者数
+        for node, node_infos in targets.items():
+            try:
+                peer = self._peer(node)
+                remote = peer.stat([info.name for info in node_infos])
+                for info, entry in zip(node_infos, remote):
+                    if entry is not None and etag_mtime(entry["etag"]) >= info.mtime_ns:
+                        confirmed[info.name] = confirmed.get(info.name, 0) + 1
+                    elif self._push(peer, info):
+                        confirmed[info.name] = confirmed.get(info.name, 0) + 1
+            except (OSError, PeerError, ValueError) as e:
+                self.failures += 1
+                self._close_peer(node)
+                logger.warning(f"与节点 {node} 同步失败，稍后重试: {e}")
+
+        for info in infos:
+            owners = owners_of[info.name]
+            if owners and self.self_node not in owners and confirmed.get(info.name, 0) == len(owners):
+                self._hand_off(info)
+
+    def _push(self, peer: PeerClient, info: FileInfo) -> bool:
+        """ 把本地文件推送给 peer；本地文件已不存在时返回 False """
+        try:
+            f, current = self.ctx.storage.open_read(info.name)
+        except FileNotFoundError:
+            return False
+        with f:
+            if peer.replicate(f, current):
+                self.replicated += 1
+                logger.info(f"已把 '{info.name}' ({current.size}字节) 复制到节点 {peer.node}。")
+            else:
+                self.skipped += 1
+        return current.mtime_ns >= info.mtime_ns
+
+    def _hand_off(self, info: FileInfo):
+        """ 所有者都已确认，删除本节点上的副本；确认之后文件又被修改时保留 """
+        ctx = self.ctx
+        # 比较和删除在存储后端内原子完成，期间提交的上传或副本不会被误删
+        if not ctx.storage.delete_if_unchanged(info.name, info):
+            return
+        self.handed_off += 1
+        ctx.index.remove(info.name)
+        if ctx.file_cache is not None:
+            ctx.file_cache.invalidate(info.name)
+        ctx.events.publish("remove", info)
+        logger.info(f"'{info.name}' 已交给所有者 {', '.join(self.owners(info.name))}，从本节点删除。")
+
+    # ------------------------------------------------------------------
+    # 请求转发
+
+    def proxy_download(self, request: str, name: str, client_socket: socket.socket) -> bool:
+        """
+        把下载请求转发给所有者，响应原样转给客户端；所有者都没有该文件或无法连接时返回 False。
+        已经开始转发数据之后出错时抛出异常，由调用方关闭客户端连接
+        """
+        for node in self.owners(name):
+            if node == self.self_node:
+                continue
+            try:
+                peer = PeerClient(node)
+            except (OSError, PeerError) as e:
+                logger.warning(f"无法连接所有者 {node} 转发 '{name}' 的下载: {e}")
+                continue
+            try:
+                try:
+                    peer.send(request.encode('utf-8') + b'\n')
+                    header = peer.read_line()
+                    status, _, payload = header.partition('|')
+                    if status == "ERROR":
+                        continue
+                    length = _body_length(status, payload)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"所有者 {node} 转发 '{name}' 的下载失败: {e}")
+                    continue
+                client_socket.sendall(header.encode('utf-8') + b'\n')
+                for chunk in peer.iter_body(length):
+                    client_socket.sendall(chunk)
+            finally:
+                peer.close()
+            self.proxied += 1
+            logger.info(f"已从所有者 {node} 转发 '{name}' 的下载。")
+            return True
+        return False
+
+    def list_all(self, local_files: list) -> list:
+        """ 汇总所有节点的文件列表，同名文件取修改时间最新的一份；无法连接的节点跳过 """
+        peers = [node for node in self.nodes if node != self.self_node]
+        merged = {entry["name"]: entry for entry in local_files}
+        if not peers:
+            return local_files
+
+        def fetch(node):
+            try:
+                peer = PeerClient(node)
+                try:
+                    return peer.list_files()
+                finally:
+                    peer.close()
+            except (OSError, PeerError, ValueError) as e:
+                logger.warning(f"无法获取节点 {node} 的文件列表: {e}")
+                return []
+
+        with ThreadPoolExecutor(max_workers=len(peers)) as executor:
+            for entries in executor.map(fetch, peers):
+                for entry in entries:
+                    current = merged.get(entry["name"])
+                    if current is None or etag_mtime(entry["etag"]) > etag_mtime(current["etag"]):
+                        merged[entry["name"]] = entry
+        return list(merged.values())
+
+    def stats(self) -> dict:
+        return {
+            "self": self.self_node,
+            "nodes": self.nodes,
+            "replicas": self.replicas,
+            "queued": self._queue.qsize(),
+            "replicated": self.replicated,
+            "skipped": self.skipped,
+            "handed_off": self.handed_off,
+            "proxied": self.proxied,
+            "failures": self.failures,
+            "rebalances": self.rebalances,
+            "local_files": self.ctx.index.stats()["files"] if self.ctx else None,
+        }
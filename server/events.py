@@ -0,0 +1,133 @@
+"""
+文件变更通知
+
+客户端发送 SUBSCRIBE 后，这条连接就成为推送通道，服务器在文件被上传、更新或删除时
+推送一条事件，客户端据此增量更新界面，不必在每次操作后重新请求完整列表:
+
+    SUBSCRIBE   -> OK_SUBSCRIBED\n，之后不断推送 EVENT|json_len\n<json>
+    事件内容    {"type": "add" | "update" | "remove", "name", "size", "mtime", "etag"}
+                {"type": "resync"}  推送队列溢出丢失了事件，客户端应重新获取完整列表
+
+每个订阅者有一个有界队列，发布者只做 put_nowait，慢订阅者不会拖慢上传线程；
+队列满时丢弃事件并给该订阅者打上溢出标记，由其处理线程补发 resync。
+推送通道上客户端仍可发送 PING 作为心跳，服务器回复 PONG\n。
+"""
+import json
+import logging
+import queue
+import select
+import socket
+import threading
+
+from storage import FileInfo, file_etag
+
+DEFAULT_QUEUE_SIZE = 1024           # 每个订阅者最多积压的事件数
+POLL_INTERVAL = 1.0                 # 等待事件时检查连接状态的间隔 (秒)
+
+logger = logging.getLogger('server_logger')
+
+
+def _frame(event: dict) -> bytes:
+    body = json.dumps(event).encode('utf-8')
+    return f"EVENT|{len(body)}\n".encode('utf-8') + body
+
+
+class Subscription:
+    """ 一个订阅连接的事件队列 """
+
+    def __init__(self, queue_size: int):
+        self.queue = queue.Queue(queue_size)
+        self.overflowed = False
+
+
+class EventHub:
+    """ 把文件变更事件广播给所有订阅者 """
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, kind: str, info: FileInfo):
+        """ 发布 add/update/remove 事件；remove 事件只需要 info.name """
+        with self._lock:
+            if not self._subscribers:
+                return
+            subscribers = list(self._subscribers)
+        event = {"type": kind, "name": info.name}
+        if kind != "remove":
+            event.update(size=info.size, mtime=info.mtime_ns / 1e9, etag=file_etag(info))
+        # 只编码一次，所有订阅者共享同一份字节串
+        frame = _frame(event)
+        self.published += 1
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(frame)
+            except queue.Full:
+                subscription.overflowed = True
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"subscribers": self.subscriber_count, "published": self.published, "dropped": self.dropped}
+
+    def serve(self, sock: socket.socket, address):
+        """ 在订阅连接上推送事件，直到客户端断开 """
+        subscription = self.subscribe()
+        logger.info(f"{address} 已订阅文件变更通知 (当前订阅数 {self.subscriber_count})。")
+        try:
+            sock.sendall(b"OK_SUBSCRIBED\n")
+            while True:
+                if subscription.overflowed:
+                    _drain(subscription.queue)
+                    subscription.overflowed = False
+                    sock.sendall(_frame({"type": "resync"}))
+                    logger.warning(f"{address} 的通知队列溢出，已要求其重新获取文件列表。")
+                try:
+                    frame = subscription.queue.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    frame = None
+                if frame is not None:
+                    sock.sendall(frame)
+                if not _handle_incoming(sock):
+                    break
+        finally:
+            self.unsubscribe(subscription)
+            logger.info(f"{address} 取消订阅文件变更通知。")
+
+
+def _drain(q: queue.Queue):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
+
+
+def _handle_incoming(sock: socket.socket) -> bool:
+    """ 处理推送通道上客户端发来的心跳；连接已关闭时返回 False """
+    readable, _, _ = select.select([sock], [], [], 0)
+    if not readable:
+        return True
+    data = sock.recv(4096)
+    if not data:
+        return False
+    if b"PING" in data:
+        sock.sendall(b"PONG\n" * data.count(b"PING"))
+    return True
@@ -0,0 +1,97 @@
+"""
+服务器端热点文件内存缓存
+
+很多客户端反复下载同一个文件时，每次 DOWNLOAD_FILE 都要重新打开文件并分块读取。
+这里把中小文件整个读入内存，按总字节数限制容量、按 LRU 淘汰；命中时直接把只读
+memoryview 交给 sendall，多个连接共享同一份内存，不产生额外拷贝。
+
+缓存以 (文件名, ETag) 为键校验，上传或更新同名文件时由服务器主动失效。
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_FILE_SIZE = 16 << 20        # 默认只缓存不超过 16MB 的文件
+
+logger = logging.getLogger('server_logger')
+
+
+class HotFileCache:
+    """ 线程安全的 LRU 文件内容缓存 """
+
+    def __init__(self, max_bytes: int, max_file_size: int = DEFAULT_MAX_FILE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self._entries = OrderedDict()       # 文件名 -> (etag, 只读 memoryview)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.evictions = 0
+
+    def admits(self, size: int) -> bool:
+        """ 该大小的文件是否适合放入缓存 """
+        return 0 < size <= self.max_file_size
+
+    def get(self, name: str, etag: str):
+        """ 返回与 etag 匹配的缓存内容 (memoryview)，未命中返回 None """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            self.bytes_served += len(entry[1])
+            return entry[1]
+
+    def load(self, name: str, etag: str, f, size: int):
+        """ 从已打开的文件 f 读入整个内容并放入缓存，返回 memoryview；读取不完整时返回 None """
+        buf = bytearray(size)
+        view = memoryview(buf)
+        filled = 0
+        while filled < size:
+            n = f.readinto(view[filled:])
+            if not n:
+                return None     # 文件在读取过程中被截短
+            filled += n
+        data = view.toreadonly()
+        self.put(name, etag, data)
+        return data
+
+    def put(self, name: str, etag: str, data: memoryview):
+        if not self.admits(len(data)):
+            return
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self.total_bytes -= len(old[1])
+            while self._entries and self.total_bytes + len(data) > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.evictions += 1
+            self._entries[name] = (etag, data)
+            self.total_bytes += len(data)
+
+    def invalidate(self, name: str):
+        """ 上传/更新同名文件时调用，丢弃旧内容 """
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self.total_bytes -= len(entry[1])
+                logger.debug(f"缓存失效: '{name}'")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytes_served": self.bytes_served,
+                "evictions": self.evictions,
+            }
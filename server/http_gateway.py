@@ -0,0 +1,668 @@
+"""
+HTTP/1.1 网关
+
+自定义协议之外，用 --http-port 启动服务器时再在同一进程里提供一个 HTTP 入口，
+浏览器、curl 和 HTTP 缓存可以直接访问同一个存储:
+
+    GET  /files/            文件列表 (与 LIST_FILES 相同的 JSON)
+    GET  /files/<文件名>     下载；支持单个 Range (206 / 416)、If-None-Match (304) 和 If-Range
+    HEAD /files/<文件名>     只返回响应头 (大小、ETag、Last-Modified)
+    PUT  /files/<文件名>     上传或覆盖，请求体按 Content-Length 边收边写入临时文件，
+                            完整收到后才提交；支持 Expect: 100-continue (curl -T 默认发送)
+
+文件名按 URL 编码 (UTF-8)。ETag 与自定义协议的 etag 相同，加上双引号。
+连接默认保持 (HTTP/1.0 需要 Connection: keep-alive)，空闲超过 --idle-timeout 秒后关闭。
+
+网关运行在独立线程的 asyncio 事件循环中，一个线程服务所有 HTTP 连接；打开、写入、提交等
+阻塞的存储操作交给服务器的 I/O 线程池 (ServerContext.io):
+
+    下载   loop.sendfile()，平铺目录存储上由内核直接从页缓存发送 (os.sendfile)；文件没有
+           fileno() 时 (内存存储) asyncio 自动退回读取后发送。热点缓存命中时发送缓存中的
+           内存视图；不超过 --chunk-size 的小文件在打开的同时读入，与响应头一起发出
+    上传   请求体由 _Channel.read_into() 直接 recv_into 到从 BufferPool 借来的两块缓冲区，
+           一块写盘时另一块继续接收，不经过 StreamReader 的缓冲和复制
+
+上传前按 Content-Length 做与自定义协议相同的空间和配额预检，提交后同样更新索引、
+发布变更通知并在集群模式下触发复制。网关只提供本节点存储中的文件，不转发给其他节点。
+不支持分块编码 (Transfer-Encoding) 的请求体，PUT 必须带 Content-Length。
+"""
+import asyncio
+import json
+import logging
+import mimetypes
+import socket
+import threading
+import time
+import urllib.parse
+from collections import namedtuple
+from email.utils import formatdate
+from http import HTTPStatus
+
+from index import file_entry
+from quota import QuotaExceeded
+from storage import file_etag, validate_name
+
+FILES_PREFIX = '/files/'
+MAX_HEADER_SIZE = 65536             # 请求行加请求头的最大长度，也是每个连接的接收缓冲区大小
+UPLOAD_CHUNK = 1 << 20              # PUT 请求体每次接收并写入的字节数
+DRAIN_POLL_INTERVAL = 0.1
+
+logger = logging.getLogger('server_logger')
+
+Request = namedtuple('Request', ['method', 'path', 'version', 'headers'])
+
+
+class HttpError(Exception):
+    """ 以 status 回复客户端的错误；close 为 True 时回复后关闭连接 """
+
+    def __init__(self, status: int, message: str, close: bool = False, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.close = close
+        self.headers = list(headers)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(value: str, size: int):
+    """
+    解析 Range 请求头，返回 [start, end) 或 None (忽略，发送整个文件)
+
+    只支持单个字节范围；多个范围和无法解析的写法按 RFC 9110 忽略。
+    范围完全在文件之外时抛出 RangeNotSatisfiable。
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - suffix), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start < 0 or (last and end <= start):
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """ If-None-Match 的弱比较: 列表中任意一个与 etag 相同 (忽略 W/ 前缀)，或为 * """
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
+
+
+_date_cache = [0, '']
+
+
+def _http_date() -> str:
+    """ Date 响应头，同一秒内复用 (只在事件循环线程中调用) """
+    now = int(time.time())
+    if now != _date_cache[0]:
+        _date_cache[0], _date_cache[1] = now, formatdate(now, usegmt=True)
+    return _date_cache[1]
+
+
+def _response_head(status: int, headers, close: bool) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Date: {_http_date()}"]
+    lines.extend(f"{name}: {value}" for name, value in headers)
+    if close:
+        lines.append("Connection: close")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def _parse_head(head: bytes) -> Request:
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HttpError(400, "无效的请求行", close=True)
+    if not version.startswith('HTTP/1.'):
+        raise HttpError(505, "只支持 HTTP/1.x", close=True)
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise HttpError(400, "无效的请求头", close=True)
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return Request(method, urllib.parse.urlsplit(target).path, version, headers)
+
+
+def _wants_close(request: Request) -> bool:
+    tokens = {t.strip().lower() for t in request.headers.get('connection', '').split(',')}
+    if 'close' in tokens:
+        return True
+    return request.version == 'HTTP/1.0' and 'keep-alive' not in tokens
+
+
+def _has_body(request: Request) -> bool:
+    return request.headers.get('content-length', '0') != '0' or 'transfer-encoding' in request.headers
+
+
+def _listing(ctx) -> bytes:
+    """ 在 I/O 线程中扫描存储，返回与 LIST_FILES 相同的 JSON；集群模式下合并所有节点的列表 """
+    files = [file_entry(info) for info in ctx.storage.list()]
+    if ctx.cluster is not None:
+        files = ctx.cluster.list_all(files)
+    return json.dumps(files).encode('utf-8')
+
+
+def _open_for_send(storage, name: str, inline_max: int):
+    """ 在 I/O 线程中打开文件，不超过 inline_max 的文件顺便读入并关闭；返回 (f, info, data) """
+    f, info = storage.open_read(name)
+    if info.size > inline_max:
+        return f, info, None
+    with f:
+        return None, info, f.read(info.size)
+
+
+class _Channel(asyncio.BufferedProtocol):
+    """
+    一个 HTTP 连接: 请求头读入连接自己的缓冲区，请求体由 read_into() 直接 recv_into 到
+    调用方提供的缓冲区；另外实现写入的流控 (drain)。只在事件循环线程中使用
+    """
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.transport = None
+        self.task = None
+        self.busy = False               # 正在处理请求，关闭时等它完成
+        self._buf = bytearray(MAX_HEADER_SIZE)
+        self._start = self._end = 0     # _buf 中尚未消费的数据
+        self._target = None             # read_into() 正在填充的缓冲区
+        self._got = 0
+        self._waiter = None
+        self._eof = False
+        self._write_paused = False
+        self._drain_waiter = None
+
+    # 协议回调 -----------------------------------------------------------
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.task = asyncio.get_running_loop().create_task(self.gateway._serve_connection(self))
+
+    def get_buffer(self, sizehint):
+        if self._target is not None:
+            return self._target[self._got:]
+        return memoryview(self._buf)[self._end:]
+
+    def buffer_updated(self, nbytes):
+        if self._target is not None:
+            self._got += nbytes
+            full = self._got == len(self._target)
+        else:
+            self._end += nbytes
+            full = self._end == len(self._buf)
+        if full:
+            # 缓冲区满时暂停读取，数据留在内核中，等下一次 read_head() / read_into()
+            self.transport.pause_reading()
+        self._wake()
+
+    def eof_received(self):
+        self._eof = True
+        self._wake()
+        return False
+
+    def connection_lost(self, exc):
+        self._eof = True
+        self._wake()
+        waiter = self._drain_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(ConnectionResetError("连接已关闭"))
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        waiter = self._drain_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    # 读取 ---------------------------------------------------------------
+
+    def _wake(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def _wait(self):
+        self.transport.resume_reading()
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+    def _consume(self, n: int):
+        self._start += n
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    async def read_head(self):
+        """ 读取到空行为止的请求行和请求头；对端在两个请求之间关闭连接时返回 None """
+        while True:
+            index = self._buf.find(b'\r\n\r\n', self._start, self._end)
+            if index >= 0:
+                head = bytes(self._buf[self._start:index])
+                self._consume(index + 4 - self._start)
+                return head
+            if self._eof:
+                return None
+            if self._end == len(self._buf):
+                if self._start == 0:
+                    raise HttpError(431, "请求头过大", close=True)
+                pending = self._end - self._start
+                self._buf[:pending] = self._buf[self._start:self._end]
+                self._start, self._end = 0, pending
+            await self._wait()
+
+    async def read_into(self, view: memoryview) -> int:
+        """ 读满 view，返回读到的字节数；对端提前关闭时小于 len(view) """
+        n = min(len(view), self._end - self._start)
+        if n:
+            view[:n] = memoryview(self._buf)[self._start:self._start + n]
+            self._consume(n)
+        if n == len(view) or self._eof:
+            return n
+        self._target, self._got = view, n
+        try:
+            while self._got < len(view) and not self._eof:
+                await self._wait()
+            return self._got
+        finally:
+            self._target = None
+
+    # 写入 ---------------------------------------------------------------
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError("连接已关闭")
+        if self._write_paused:
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._drain_waiter
+            finally:
+                self._drain_waiter = None
+
+
+class HttpGateway:
+    """ 在后台线程中运行的 HTTP 服务，共享 ServerContext 的存储、索引、配额和缓存 """
+
+    def __init__(self, ctx, host: str, port: int):
+        self.ctx = ctx
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._error = None
+        self._closing = False
+        self._channels = set()
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    # ------------------------------------------------------------------
+    # 启动与关闭 (由服务器主线程调用)
+
+    def start(self):
+        """ 启动事件循环线程并绑定端口；绑定失败时抛出 OSError """
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name='http-gateway', daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self, ready):
+        loop = self._loop = asyncio.new_event_loop()
+        try:
+            # SO_REUSEPORT 让平滑重启的新进程在旧进程排空期间绑定同一端口
+            self._server = loop.run_until_complete(loop.create_server(
+                lambda: _Channel(self), self.host, self.port,
+                reuse_address=True, reuse_port=hasattr(socket, 'SO_REUSEPORT')))
+        except OSError as e:
+            self._error = e
+            ready.set()
+            loop.close()
+            return
+        ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def close(self):
+        """ 停止 accept 并关闭空闲的保持连接，正在处理的请求继续完成 """
+        if self._loop is None or self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+
+    async def _close(self):
+        self._closing = True
+        self._server.close()
+        for channel in list(self._channels):
+            if not channel.busy:
+                channel.task.cancel()
+
+    def drain(self, timeout: float) -> int:
+        """ 等待进行中的请求完成，最多 timeout 秒，然后停止事件循环；返回仍未结束的连接数 """
+        deadline = time.monotonic() + timeout
+        while self._channels and time.monotonic() < deadline:
+            time.sleep(DRAIN_POLL_INTERVAL)
+        remaining = len(self._channels)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        return remaining
+
+    def stats(self) -> dict:
+        return {
+            "port": self.port,
+            "connections": len(self._channels),
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+    # ------------------------------------------------------------------
+    # 连接与请求
+
+    def _io(self, fn, *args):
+        """ 在服务器的 I/O 线程池中执行阻塞的存储操作 """
+        return asyncio.wrap_future(self.ctx.io.submit(fn, *args))
+
+    async def _serve_connection(self, channel: _Channel):
+        peer = channel.transport.get_extra_info('peername') or ('?', 0)
+        self._channels.add(channel)
+        conn_id = self.ctx.tracer.connection()
+        seq = 0
+        logger.debug("接受来自 %s 的 HTTP 连接。", peer)
+        try:
+            while not self._closing:
+                try:
+                    head = await asyncio.wait_for(channel.read_head(), self.ctx.idle_timeout or None)
+                    if head is None:
+                        break
+                    request = _parse_head(head)
+                except asyncio.TimeoutError:
+                    break
+                except HttpError as e:
+                    self.errors += 1
+                    channel.write(self._error_response(e, True))
+                    await channel.drain()
+                    break
+
+                channel.busy = True
+                seq += 1
+                self.requests += 1
+                trace = self.ctx.tracer.begin(conn_id, seq, peer[0], f"HTTP_{request.method}")
+                try:
+                    keep_alive = await self._dispatch(request, channel, peer, trace)
+                except HttpError as e:
+                    self.errors += 1
+                    trace.set(status="error")
+                    # 出错时请求体可能没有读完 (PUT 被拒绝等)，连接不能继续使用
+                    keep_alive = not (e.close or _wants_close(request) or _has_body(request) or self._closing)
+                    channel.write(self._error_response(e, not keep_alive))
+                    await channel.drain()
+                except ConnectionError:
+                    trace.set(status="aborted")
+                    logger.info("HTTP 客户端 %s 在请求 %s %s 中途断开。", peer, request.method, request.path)
+                    break
+                finally:
+                    channel.busy = False
+                    trace.finish()
+                if not keep_alive:
+                    break
+        except asyncio.CancelledError:
+            pass        # 关闭服务器时取消空闲连接
+        except Exception as e:
+            logger.error("处理 HTTP 客户端 %s 的请求时出错: %s", peer, e)
+        finally:
+            self._channels.discard(channel)
+            channel.transport.close()
+
+    def _error_response(self, error: HttpError, close: bool) -> bytes:
+        body = (str(error) + '\n').encode('utf-8')
+        headers = [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", len(body)), *error.headers]
+        return _response_head(error.status, headers, close) + body
+
+    async def _dispatch(self, request: Request, channel: _Channel, peer, trace) -> bool:
+        """ 处理一个请求，返回连接是否可以继续使用 """
+        method = request.method
+        if method not in ('GET', 'HEAD', 'PUT'):
+            raise HttpError(405, f"不支持的方法: {method}", headers=[("Allow", "GET, HEAD, PUT")])
+        if not request.path.startswith(FILES_PREFIX) and request.path != FILES_PREFIX.rstrip('/'):
+            raise HttpError(404, "路径应为 /files/<文件名>")
+        # 除 PUT 外不读取请求体，带请求体的其他请求回复后关闭连接
+        close = _wants_close(request) or self._closing or (method != 'PUT' and _has_body(request))
+
+        try:
+            name = urllib.parse.unquote(request.path[len(FILES_PREFIX):], errors='strict')
+        except UnicodeDecodeError:
+            raise HttpError(400, "文件名不是有效的 UTF-8")
+        if not name:
+            if method == 'PUT':
+                raise HttpError(405, "不能上传到文件列表", headers=[("Allow", "GET, HEAD")])
+            await self._send_listing(request, channel, trace, close)
+            return not close
+        try:
+            validate_name(name)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        trace.set(name=name)
+        if method == 'PUT':
+            return await self._receive_file(request, name, channel, peer, trace, close)
+        await self._send_file(request, name, channel, peer, trace, close)
+        return not close
+
+    async def _send_listing(self, request, channel, trace, close):
+        with trace.span('list'):
+            body = await self._io(_listing, self.ctx)
+        headers = [("Content-Type", "application/json"), ("Content-Length", len(body)),
+                   ("Cache-Control", "no-cache")]
+        channel.write(_response_head(200, headers, close))
+        if request.method == 'GET':
+            channel.write(body)
+            self.bytes_sent += len(body)
+            trace.set(bytes=len(body))
+        with trace.span('net_send'):
+            await channel.drain()
+
+    async def _send_file(self, request, name, channel, peer, trace, close):
+        ctx = self.ctx
+        inline_max = ctx.buffers.chunk_size if request.method == 'GET' else -1
+        try:
+            with trace.span('open'):
+                f, info, data = await self._io(_open_for_send, ctx.storage, name, inline_max)
+        except (FileNotFoundError, ValueError):
+            raise HttpError(404, f"文件 '{name}' 未找到")
+
+        try:
+            size = info.size if data is None else len(data)
+            raw_etag = file_etag(info)
+            etag = f'"{raw_etag}"'
+            headers = [("ETag", etag),
+                       ("Last-Modified", formatdate(info.mtime_ns / 1e9, usegmt=True)),
+                       ("Accept-Ranges", "bytes")]
+
+            if etag_matches(request.headers.get('if-none-match', ''), etag):
+                channel.write(_response_head(304, headers, close))
+                await channel.drain()
+                return
+
+            status, start, end = 200, 0, size
+            range_header = request.headers.get('range')
+            if_range = request.headers.get('if-range')
+            if range_header and (if_range is None or if_range == etag):
+                try:
+                    selected = parse_range(range_header, size)
+                except RangeNotSatisfiable:
+                    raise HttpError(416, "请求的范围超出文件大小",
+                                    headers=[("Content-Range", f"bytes */{size}"), ("ETag", etag)])
+                if selected is not None:
+                    status, (start, end) = 206, selected
+                    headers.append(("Content-Range", f"bytes {start}-{end - 1}/{size}"))
+            headers.append(("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream"))
+            headers.append(("Content-Length", end - start))
+            head = _response_head(status, headers, close)
+            if request.method == 'HEAD':
+                channel.write(head)
+                await channel.drain()
+                return
+
+            trace.set(bytes=end - start)
+            if data is not None:
+                # 小文件: 响应头和内容一次写出
+                channel.write(head + (data[start:end] if status == 206 else data))
+                with trace.span('net_send'):
+                    await channel.drain()
+            else:
+                channel.write(head)
+                # 与自定义协议的下载相同: 热点缓存命中时发送内存视图，未命中且大小合适时整个读入
+                cached = None
+                file_cache = ctx.file_cache
+                if file_cache is not None and file_cache.admits(size):
+                    cached = file_cache.get(name, raw_etag)
+                    if cached is None:
+                        with trace.span('disk_read'):
+                            cached = await self._io(file_cache.load, name, raw_etag, f, size)
+                with trace.span('net_send'):
+                    if cached is not None:
+                        channel.write(cached[start:end])
+                        await channel.drain()
+                    else:
+                        await asyncio.get_running_loop().sendfile(channel.transport, f, start, end - start)
+            self.bytes_sent += end - start
+        finally:
+            if f is not None:
+                f.close()
+        logger.info("文件 '%s' (%s字节%s) 已通过 HTTP 发送给 %s。", name, end - start,
+                    f"，范围 {start}-{end - 1}" if status == 206 else "", peer)
+
+    async def _receive_file(self, request, name, channel, peer, trace, close) -> bool:
+        """ 处理 PUT；请求体没有完整读取时 (拒绝或出错) 回复后关闭连接 """
+        ctx = self.ctx
+        if 'transfer-encoding' in request.headers:
+            raise HttpError(501, "不支持分块编码的请求体，请提供 Content-Length", close=True)
+        length = request.headers.get('content-length')
+        if length is None:
+            raise HttpError(411, "PUT 请求需要 Content-Length", close=True)
+        try:
+            size = int(length)
+            if size < 0:
+                raise ValueError
+        except ValueError:
+            raise HttpError(400, "无效的 Content-Length", close=True)
+        trace.set(bytes=size)
+
+        with trace.span('stat'):
+            old = await self._io(ctx.storage.stat, name)
+        try:
+            with trace.span('quota'):
+                reservation = await self._io(ctx.quota.reserve, peer[0], size, old.size if old else 0)
+        except QuotaExceeded as e:
+            logger.warning("拒绝 %s 通过 HTTP 上传文件 '%s' (%s字节): %s", peer, name, size, e)
+            raise HttpError(507, str(e), close=True)
+
+        # 不超过一个连接缓冲区的请求体只用一块，否则两块 UPLOAD_CHUNK 交替接收和写盘
+        pool = ctx.buffers
+        block = pool.chunk_size if size <= pool.chunk_size else UPLOAD_CHUNK
+        buffers = [pool.acquire(block)]
+        if size > block:
+            buffers.append(pool.acquire(block))
+        committed_size = None
+        pending = None
+        writing = None
+        try:
+            with trace.span('open'):
+                pending = await self._io(ctx.storage.open_write, name)
+            if request.headers.get('expect', '').lower() == '100-continue':
+                channel.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                await channel.drain()
+
+            remaining = size
+            turn = 0
+            while remaining > 0:
+                view = memoryview(buffers[turn])[:min(remaining, block)]
+                turn = (turn + 1) % len(buffers)
+                with trace.span('net_recv'):
+                    n = await asyncio.wait_for(channel.read_into(view), ctx.idle_timeout or None)
+                if n < len(view):
+                    raise ConnectionResetError("请求体不完整")
+                remaining -= n
+                if writing is not None:
+                    with trace.span('disk_write'):
+                        await writing
+                writing = self._io(pending.file.write, view)
+            if writing is not None:
+                with trace.span('disk_write'):
+                    await writing
+            writing = None
+            self.bytes_received += size
+
+            with trace.span('commit'):
+                info = await self._io(ctx.storage.commit, pending)
+            pending = None
+            committed_size = info.size
+            if ctx.file_cache is not None:
+                ctx.file_cache.invalidate(name)
+            ctx.index.update(info)
+            ctx.events.publish("update" if old is not None else "add", info)
+            if ctx.cluster is not None:
+                ctx.cluster.file_committed(name)
+        except asyncio.TimeoutError:
+            trace.set(status="aborted")
+            logger.error("%s 通过 HTTP 上传 '%s' 时超时。", peer, name)
+            return False
+        except ConnectionError:
+            trace.set(status="aborted")
+            logger.error("%s 通过 HTTP 上传 '%s' 时连接中断。", peer, name)
+            return False
+        except OSError as e:
+            logger.error("通过 HTTP 接收来自 %s 的文件 '%s' 失败: %s", peer, name, e)
+            raise HttpError(500, f"服务器保存文件 '{name}' 时出错: {e}", close=True)
+        finally:
+            if writing is not None:
+                await asyncio.wait([writing])   # 等写盘结束再关闭临时文件、归还缓冲区
+            if pending is not None:
+                try:
+                    await self._io(ctx.storage.abort, pending)
+                except OSError:
+                    pass
+            for buf in buffers:
+                pool.release(buf)
+            ctx.quota.release(reservation, committed_size)
+
+        status = 204 if old is not None else 201
+        headers = [("ETag", f'"{file_etag(info)}"')]
+        if status == 201:
+            headers += [("Location", FILES_PREFIX + urllib.parse.quote(name)), ("Content-Length", 0)]
+        channel.write(_response_head(status, headers, close))
+        with trace.span('net_send'):
+            await channel.drain()
+        logger.info("文件 '%s' (%s字节) 已通过 HTTP 从 %s 接收并%s。", name, size, peer,
+                    "更新" if old is not None else "上传")
+        return not close
@@ -0,0 +1,226 @@
+"""
+文件元数据索引
+
+客户端只想找一个文件或确认几个文件的大小时，原来必须拉取完整的 LIST_FILES 再在本地筛选，
+文件多时每次都要扫描目录并传输整个列表。FileIndex 在内存中保存 名称 -> FileInfo 以及
+按名称排序的列表，SEARCH 和 STAT 都直接查索引，不再扫描目录:
+
+    SEARCH|<json 查询>          -> OK_SEARCH|json_len\n{"files": [...], "truncated": bool}
+    STAT|json_len\n<json 名称列表> -> OK_STAT|json_len\n[条目或 null, ...] (与请求的名称一一对应)
+
+查询条件 (均可省略，同时给出时取交集):
+    prefix                  名称前缀，在排序列表上二分定位，只检查前缀范围内的名称
+    contains                名称中包含的子串
+    glob                    fnmatch 通配符，例如 "*.log"，区分大小写
+    min_size / max_size     字节数范围 (含端点)
+    mtime_after / mtime_before
+                            修改时间范围，Unix 秒 (含端点)
+    limit                   最多返回的条目数 (默认 1000，上限 10000)，还有更多结果时 truncated 为 true
+
+条目格式与 LIST_FILES 相同: {"name", "size", "mtime", "etag"}，结果按名称排序。
+
+服务器自己的上传和分片提交会同步更新索引；绕过服务器直接修改存储目录的变化在下一次
+重新扫描 (--index-rescan 秒) 后反映出来，重新扫描在后台线程中进行，期间继续用旧索引回答查询。
+"""
+import bisect
+import fnmatch
+import json
+import logging
+import math
+import re
+import threading
+import time
+
+from storage import StorageBackend, FileInfo, file_etag
+
+DEFAULT_RESCAN_INTERVAL = 60        # 重新扫描存储的间隔 (秒)，0 表示只在启动时扫描一次
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+MAX_STAT_NAMES = 10000              # 一次 STAT 最多查询的名称数
+MAX_STAT_BODY = 4 << 20             # STAT 名称列表 JSON 的长度上限
+MAX_QUERY_NUMBER = 1 << 63          # 数值查询条件的绝对值上限 (大小和纳秒时间戳都在 int64 内)
+
+QUERY_FIELDS = ('prefix', 'contains', 'glob', 'min_size', 'max_size', 'mtime_after', 'mtime_before', 'limit')
+
+logger = logging.getLogger('server_logger')
+
+
+def file_entry(info: FileInfo) -> dict:
+    """ 与 LIST_FILES 相同格式的条目 """
+    return {"name": info.name, "size": info.size, "mtime": info.mtime_ns / 1e9, "etag": file_etag(info)}
+
+
+def _prefix_end(prefix: str) -> str:
+    """ 所有以 prefix 开头的名称都小于返回值 """
+    return prefix + '\U0010ffff'
+
+
+class FileIndex:
+    """ 存储中所有文件的内存索引，线程安全 """
+
+    def __init__(self, storage: StorageBackend, rescan_interval: float = DEFAULT_RESCAN_INTERVAL):
+        self.storage = storage
+        self.rescan_interval = rescan_interval
+        self._files = {}                # 名称 -> FileInfo
+        self._names = []                # 排序的名称列表
+        self._built_at = None           # 最近一次扫描完成的 monotonic 时间，None 表示尚未建立
+        self._journal = None            # 重新扫描期间的增量更新，扫描结束后重放
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.searches = 0
+        self.stats_served = 0
+        self.rescans = 0
+
+    # ------------------------------------------------------------------
+    # 建立与维护
+
+    def rebuild(self):
+        """ 扫描存储重建索引；扫描期间的 update/remove 记入日志，替换后重放 """
+        with self._build_lock:
+            with self._lock:
+                self._journal = []
+            started = time.perf_counter()
+            try:
+                infos = self.storage.list()
+            except OSError as e:
+                logger.error(f"建立文件索引时无法列出存储 {self.storage.describe()}: {e}")
+                with self._lock:
+                    self._journal = None
+                return
+            files = {info.name: info for info in infos}
+            with self._lock:
+                for name, info in self._journal:
+                    if info is None:
+                        files.pop(name, None)
+                    else:
+                        files[name] = info
+                self._journal = None
+                self._files = files
+                self._names = sorted(files)
+                self._built_at = time.monotonic()
+                self.rescans += 1
+            logger.info(f"文件索引已建立: {len(files)} 个文件，用时 {time.perf_counter() - started:.2f}s。")
+
+    def refresh_async(self):
+        """ 在后台线程中重建索引，已有重建在进行时不重复启动 """
+        if self._build_lock.locked():
+            return
+        threading.Thread(target=self.rebuild, name='index-rescan', daemon=True).start()
+
+    def _ensure_fresh(self):
+        """ 尚未建立时同步建立；超过重新扫描间隔时在后台刷新，本次查询仍用现有索引 """
+        if self._built_at is None:
+            with self._build_lock:
+                built = self._built_at is not None
+            if not built:
+                self.rebuild()
+            return
+        if self.rescan_interval and time.monotonic() - self._built_at > self.rescan_interval:
+            self.refresh_async()
+
+    def update(self, info: FileInfo):
+        """ 文件被上传或更新后调用 """
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((info.name, info))
+            if info.name not in self._files:
+                bisect.insort(self._names, info.name)
+            self._files[info.name] = info
+
+    def remove(self, name: str):
+        """ 文件被删除后调用 """
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((name, None))
+            if self._files.pop(name, None) is not None:
+                i = bisect.bisect_left(self._names, name)
+                if i < len(self._names) and self._names[i] == name:
+                    del self._names[i]
+
+    # ------------------------------------------------------------------
+    # 查询
+
+    def stat_many(self, names: list) -> list:
+        """ 按顺序返回每个名称的 FileInfo，不存在的为 None """
+        self._ensure_fresh()
+        files = self._files
+        self.stats_served += 1
+        return [files.get(name) for name in names]
+
+    def search(self, prefix: str = '', contains: str = None, glob: str = None,
+               min_size: int = None, max_size: int = None,
+               mtime_after: float = None, mtime_before: float = None,
+               limit: int = DEFAULT_LIMIT):
+        """ 返回 (按名称排序的匹配 FileInfo 列表, 是否还有更多结果) """
+        self._ensure_fresh()
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        match = re.compile(fnmatch.translate(glob)).match if glob else None
+        after_ns = int(mtime_after * 1e9) if mtime_after is not None else None
+        before_ns = int(mtime_before * 1e9) if mtime_before is not None else None
+
+        # 只在锁内复制候选名称的切片，过滤在锁外进行，长查询不阻塞上传对索引的更新
+        with self._lock:
+            if prefix:
+                lo = bisect.bisect_left(self._names, prefix)
+                hi = bisect.bisect_left(self._names, _prefix_end(prefix), lo)
+                candidates = self._names[lo:hi]
+            else:
+                candidates = self._names[:]
+            files = self._files
+        self.searches += 1
+
+        results = []
+        for name in candidates:
+            if contains and contains not in name:
+                continue
+            if match is not None and not match(name):
+                continue
+            info = files.get(name)
+            if info is None:            # 复制切片之后被删除
+                continue
+            if min_size is not None and info.size < min_size:
+                continue
+            if max_size is not None and info.size > max_size:
+                continue
+            if after_ns is not None and info.mtime_ns < after_ns:
+                continue
+            if before_ns is not None and info.mtime_ns > before_ns:
+                continue
+            if len(results) == limit:
+                return results, True
+            results.append(info)
+        return results, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = len(self._files)
+        return {
+            "files": count,
+            "age": round(time.monotonic() - self._built_at, 1) if self._built_at is not None else None,
+            "rescans": self.rescans,
+            "searches": self.searches,
+            "stat_requests": self.stats_served,
+        }
+
+
+def parse_query(payload: str) -> dict:
+    """ 解析 SEARCH 的 JSON 查询，未知字段或类型错误时抛出 ValueError """
+    query = json.loads(payload) if payload else {}
+    if not isinstance(query, dict):
+        raise ValueError("查询必须是 JSON 对象")
+    unknown = set(query) - set(QUERY_FIELDS)
+    if unknown:
+        raise ValueError(f"未知的查询条件: {', '.join(sorted(unknown))}")
+    for key in ('prefix', 'contains', 'glob'):
+        if query.get(key) is not None and not isinstance(query[key], str):
+            raise ValueError(f"{key} 必须是字符串")
+    for key in ('min_size', 'max_size', 'mtime_after', 'mtime_before', 'limit'):
+        if query.get(key) is not None and (isinstance(query[key], bool) or not isinstance(query[key], (int, float))):
+            raise ValueError(f"{key} 必须是数字")
+        # json.loads 接受 NaN 和 Infinity，它们无法换算成纳秒时间戳
+        if isinstance(query.get(key), float) and not math.isfinite(query[key]):
+            raise ValueError(f"{key} 必须是有限的数字")
+        # 超大的 JSON 整数在换算纳秒或与浮点数比较时会溢出
+        if query.get(key) is not None and abs(query[key]) > MAX_QUERY_NUMBER:
+            raise ValueError(f"{key} 超出范围")
+    return {k: v for k, v in query.items() if v is not None}
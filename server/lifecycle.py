@@ -0,0 +1,202 @@
+"""
+平滑关闭与零停机重启
+
+    SIGTERM / Ctrl+C   停止 accept，等待进行中的请求在 --drain-timeout 秒内完成后退出；
+                       排空期间再按一次 Ctrl+C 立即退出
+    SIGHUP             重启: 以 --inherit-fd 启动新的服务器进程并把监听套接字交给它，
+                       新进程就绪后旧进程停止 accept 并按上面的方式排空退出。监听队列中
+                       尚未 accept 的连接由新进程接手，客户端不会遇到连接被拒绝
+
+排空期间:
+    - 空闲连接 (阻塞在读取下一条命令) 用 shutdown(SHUT_RD) 唤醒后关闭，客户端在下一个
+      请求之前发现连接已关闭，直接连到新进程
+    - 正在处理的请求照常完成；已经读到但还没开始处理的请求 (例如流水线中排在后面的)
+      回复 ERROR|RETRY|原因 后关闭连接，客户端重连后重试，不算作失败
+    - 还有进行中的分片上传时，所有连接继续正常服务，直到分片上传全部提交、放弃或到达
+      截止时间；新进程不认识旧进程的上传 ID，分片只能在原来的连接上传完
+"""
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_DRAIN_TIMEOUT = 30          # 排空的最长等待时间 (秒)
+ACCEPT_POLL_INTERVAL = 0.5          # accept 循环检查停止请求的间隔 (秒)
+DRAIN_POLL_INTERVAL = 0.1
+READY_TIMEOUT = 15                  # 等待新进程就绪的最长时间 (秒)
+LINGER_TIMEOUT = 2.0                # 回复 RETRY 后等待对端关闭的时间 (秒)
+
+RETRY_RESPONSE = "ERROR|RETRY|服务器正在重启或关闭，请重新连接后重试\n".encode('utf-8')
+
+logger = logging.getLogger('server_logger')
+
+
+class ConnectionTracker:
+    """ 记录所有客户端连接及其是否正在处理请求，排空时据此关闭空闲连接 """
+
+    def __init__(self, multipart):
+        self.multipart = multipart      # 有进行中的分片上传时推迟关闭连接
+        self.draining = False
+        self._connections = {}          # socket -> 是否正在处理请求
+        self._woken = set()             # 已经 shutdown 过的空闲连接
+        self._lock = threading.Lock()
+
+    def add(self, sock: socket.socket):
+        with self._lock:
+            self._connections[sock] = False
+
+    def remove(self, sock: socket.socket):
+        with self._lock:
+            self._connections.pop(sock, None)
+            self._woken.discard(sock)
+
+    def _closing(self) -> bool:
+        return self.draining and not self.multipart.active
+
+    def begin(self, sock: socket.socket) -> bool:
+        """ 开始处理一个请求；排空中不再接受请求时返回 False，调用方用 reject_with_retry 回复后关闭连接 """
+        with self._lock:
+            if self._closing():
+                return False
+            self._connections[sock] = True
+            return True
+
+    def end(self, sock: socket.socket):
+        """ 当前请求处理完毕，连接回到空闲状态 """
+        with self._lock:
+            if sock in self._connections:
+                self._connections[sock] = False
+
+    def drain(self, timeout: float) -> int:
+        """ 进入排空状态并等待所有连接结束，返回到达截止时间时仍未结束的连接数 """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self.draining = True
+        while True:
+            with self._lock:
+                idle = []
+                if self._closing():
+                    idle = [s for s, busy in self._connections.items() if not busy and s not in self._woken]
+                    self._woken.update(idle)
+                remaining = len(self._connections)
+            for sock in idle:
+                try:
+                    sock.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+            if remaining == 0 or time.monotonic() >= deadline:
+                return remaining
+            time.sleep(DRAIN_POLL_INTERVAL)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "connections": len(self._connections),
+                "busy": sum(1 for busy in self._connections.values() if busy),
+                "draining": self.draining,
+            }
+
+
+def reject_with_retry(sock: socket.socket):
+    """
+    回复 RETRY 后半关闭连接，读掉对端已经发出的数据 (例如内联上传的内容) 再返回；
+    直接关闭带有未读数据的套接字会发出 RST，客户端可能来不及读到这条回复
+    """
+    sock.sendall(RETRY_RESPONSE)
+    try:
+        sock.shutdown(socket.SHUT_WR)
+        sock.settimeout(LINGER_TIMEOUT)
+        while sock.recv(65536):
+            pass
+    except OSError:
+        pass
+
+
+class StopRequest:
+    """ 信号处理函数交给 accept 循环的停止请求: None、'drain' 或 'restart' """
+
+    def __init__(self):
+        self.mode = None
+
+    def install(self):
+        """ 注册信号处理函数，必须在主线程中调用 """
+        signal.signal(signal.SIGINT, self._on_interrupt)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._request('drain'))
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self._request('restart'))
+
+    def _request(self, mode: str):
+        if self.mode != 'drain':
+            self.mode = mode
+
+    def _on_interrupt(self, signum, frame):
+        if self.mode == 'drain':
+            raise KeyboardInterrupt     # 第二次 Ctrl+C: 放弃排空，立即退出
+        self._request('drain')
+
+
+def start_successor(listen_sock: socket.socket) -> bool:
+    """
+    以相同的命令行参数启动新的服务器进程，通过 --inherit-fd 把监听套接字交给它，
+    等待它通过 --ready-fd 报告就绪；失败时返回 False，当前进程继续服务
+    """
+    if not hasattr(os, 'pipe') or sys.platform == 'win32':
+        logger.error("当前平台不支持传递监听套接字，无法平滑重启。")
+        return False
+
+    # 去掉旧进程自己继承来的参数，再附加新的
+    argv, skip = [], False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+            continue
+        key = arg.split('=', 1)[0]
+        if key in ('--inherit-fd', '--ready-fd'):
+            skip = '=' not in arg
+            continue
+        argv.append(arg)
+
+    listen_fd = listen_sock.fileno()
+    ready_r, ready_w = os.pipe()
+    try:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(sys.argv[0]), *argv,
+             '--inherit-fd', str(listen_fd), '--ready-fd', str(ready_w)],
+            pass_fds=(listen_fd, ready_w))
+    except OSError as e:
+        os.close(ready_r)
+        os.close(ready_w)
+        logger.error(f"无法启动新的服务器进程: {e}")
+        return False
+    os.close(ready_w)
+
+    try:
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            readable, _, _ = select.select([ready_r], [], [], 0.2)
+            if readable:
+                # 新进程退出而没有写入时读到 EOF
+                if os.read(ready_r, 1):
+                    logger.info(f"新的服务器进程 (PID {proc.pid}) 已就绪，开始排空当前进程。")
+                    return True
+                break
+    finally:
+        os.close(ready_r)
+
+    logger.error(f"新的服务器进程 (PID {proc.pid}) 未能就绪，继续由当前进程服务。")
+    if proc.poll() is None:
+        proc.terminate()
+    return False
+
+
+def notify_ready(ready_fd: int):
+    """ 新进程开始 accept 之前通知旧进程 """
+    try:
+        os.write(ready_fd, b'1')
+    finally:
+        os.close(ready_fd)
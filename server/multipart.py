@@ -0,0 +1,228 @@
+"""
+分片并行上传
+
+单条 TCP 连接在高带宽、高延迟的链路上跑不满带宽。客户端可以把大文件切成固定大小
+的分片，通过多条连接同时上传，服务器把每个分片按偏移 pwrite 到同一个预分配的
+临时文件中，所有分片都校验通过后才提交:
+
+    UPLOAD_BEGIN|filename|filesize|part_size    -> OK_BEGIN|upload_id|part_count\n
+    UPLOAD_PART|upload_id|index|sha256          -> READY_TO_RECEIVE\n，发送分片数据后
+                                                   -> OK_PART|index\n 或 ERROR|msg\n
+    UPLOAD_COMMIT|upload_id                     -> OK|msg\n (有分片未完成时 ERROR|msg\n)
+    UPLOAD_ABORT|upload_id                      -> OK|msg\n
+
+分片 index 的偏移固定为 index * part_size，长度为 part_size (最后一片为剩余字节)，
+由服务器根据 BEGIN 时声明的大小计算，客户端写不到文件范围之外。分片可以在任意连接
+上以任意顺序上传，校验失败的分片可以重传。长时间没有活动的会话会被自动丢弃。
+
+BEGIN 时按声明的大小做空间和配额预检 (见 quota.py)，预留一直保持到提交或放弃。
+放弃或超时丢弃会话时，其他连接上正在接收的分片仍在写临时文件，临时文件和预留要等
+最后一个分片结束后才释放；会话移出登记表之后不再接受新的分片。
+"""
+import logging
+import threading
+import time
+import uuid
+
+from storage import StorageBackend, PendingWrite, validate_name
+from quota import QuotaManager, Reservation
+
+MIN_PART_SIZE = 64 << 10
+MAX_PART_SIZE = 1 << 30
+MAX_SESSIONS = 64                   # 同时进行中的分片上传数上限
+SESSION_TTL = 3600                  # 会话无活动多久后丢弃 (秒)
+
+logger = logging.getLogger('server_logger')
+
+
+class MultipartUpload:
+    """ 一个进行中的分片上传 """
+
+    def __init__(self, upload_id: str, pending: PendingWrite, size: int, part_size: int, existed: bool,
+                 reservation: Reservation = None):
+        self.upload_id = upload_id
+        self.pending = pending
+        self.size = size
+        self.part_size = part_size
+        self.existed = existed          # BEGIN 时同名文件是否已存在，决定事件类型和提示文字
+        self.reservation = reservation  # 容量预留，未启用预检时为 None
+        self.part_count = max(1, -(-size // part_size))
+        self.done = set()
+        self.receiving = set()
+        self.closed = False             # 已移出登记表 (提交、放弃或超时)
+        self.last_activity = time.monotonic()
+        self._on_idle = None            # 移出时仍有分片在接收，最后一个分片结束后调用
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.pending.name
+
+    def part_range(self, index: int):
+        """ 返回分片的 (偏移, 长度) """
+        if not 0 <= index < self.part_count:
+            raise ValueError(f"分片序号超出范围: {index}")
+        offset = index * self.part_size
+        return offset, min(self.part_size, self.size - offset)
+
+    def start_part(self, index: int):
+        """ 标记分片开始接收；同一分片不能同时在两条连接上上传，会话已移出登记表时抛出 KeyError """
+        with self._lock:
+            if self.closed:
+                raise KeyError(self.upload_id)
+            if index in self.receiving:
+                raise ValueError(f"分片 {index} 正在另一条连接上传")
+            self.receiving.add(index)
+            self.done.discard(index)
+            self.last_activity = time.monotonic()
+
+    def finish_part(self, index: int, ok: bool):
+        with self._lock:
+            self.receiving.discard(index)
+            if ok:
+                self.done.add(index)
+            self.last_activity = time.monotonic()
+            cleanup = None
+            if self.closed and not self.receiving:
+                cleanup, self._on_idle = self._on_idle, None
+        if cleanup is not None:
+            cleanup()
+
+    def close_if_complete(self) -> int:
+        """ 所有分片都已校验通过时标记为已移出并返回 0，否则返回尚未完成的分片数 """
+        with self._lock:
+            missing = self.part_count - len(self.done)
+            if not missing:
+                self.closed = True
+            return missing
+
+    def retire(self, cleanup):
+        """ 标记为已移出；没有分片在接收时立即调用 cleanup，否则等最后一个分片结束后调用 """
+        with self._lock:
+            self.closed = True
+            if self.receiving:
+                self._on_idle = cleanup
+                return
+        cleanup()
+
+    def missing(self) -> int:
+        """ 尚未校验通过的分片数 (重传中的分片也计入) """
+        with self._lock:
+            return self.part_count - len(self.done)
+
+
+class MultipartRegistry:
+    """ 按 upload_id 管理进行中的分片上传 """
+
+    def __init__(self, storage: StorageBackend, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL,
+                 quota: QuotaManager = None):
+        self.storage = storage
+        self.quota = quota
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def begin(self, name: str, size: int, part_size: int, client: str = '') -> MultipartUpload:
+        """ 开始分片上传；空间或配额不足时抛出 quota.QuotaExceeded """
+        validate_name(name)
+        if size < 0:
+            raise ValueError("文件大小不能为负数")
+        if not MIN_PART_SIZE <= part_size <= MAX_PART_SIZE:
+            raise ValueError(f"分片大小应在 {MIN_PART_SIZE} 到 {MAX_PART_SIZE} 字节之间")
+        self.expire()
+        with self._lock:
+            if len(self._sessions) >= self.max_sessions:
+                raise ValueError("进行中的分片上传过多，请稍后重试")
+        old = self.storage.stat(name)
+        reservation = None
+        if self.quota is not None:
+            reservation = self.quota.reserve(client, size, old.size if old else 0)
+        try:
+            pending = self.storage.open_write(name)
+            try:
+                if pending.reserve(size) and reservation is not None:
+                    self.quota.mark_allocated(reservation)
+            except OSError:
+                self.storage.abort(pending)
+                raise
+        except OSError:
+            self._release(reservation)
+            raise
+        session = MultipartUpload(uuid.uuid4().hex, pending, size, part_size, old is not None, reservation)
+        with self._lock:
+            self._sessions[session.upload_id] = session
+        return session
+
+    def get(self, upload_id: str) -> MultipartUpload:
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is None:
+            raise KeyError(upload_id)
+        return session
+
+    def commit(self, upload_id: str) -> tuple:
+        """ 所有分片都已校验通过时提交文件，返回 (会话, FileInfo)；否则抛出 ValueError 且会话保留 """
+        with self._lock:
+            session = self._sessions.get(upload_id)
+            if session is None:
+                raise KeyError(upload_id)
+            # 检查和标记在会话锁内一起完成，之后开始的分片会被拒绝
+            missing = session.close_if_complete()
+            if missing:
+                raise ValueError(f"还有 {missing} 个分片未完成")
+            del self._sessions[upload_id]
+        try:
+            info = self.storage.commit(session.pending)
+        except OSError:
+            self._release(session.reservation)
+            raise
+        self._release(session.reservation, info.size)
+        return session, info
+
+    def _release(self, reservation: Reservation, committed_size: int = None):
+        if reservation is not None:
+            self.quota.release(reservation, committed_size)
+
+    def _discard(self, session: MultipartUpload):
+        """ 释放会话的预留并删除临时文件；在没有分片接收时调用 (见 MultipartUpload.retire) """
+        self._release(session.reservation)
+        try:
+            self.storage.abort(session.pending)
+        except OSError as e:
+            logger.warning(f"删除分片上传 {session.upload_id} 的临时文件失败: {e}")
+
+    def abort(self, upload_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(upload_id, None)
+        if session is None:
+            return False
+        session.retire(lambda: self._discard(session))
+        return True
+
+    def expire(self):
+        """ 丢弃长时间没有活动的会话，释放临时文件 """
+        now = time.monotonic()
+        with self._lock:
+            stale = [s for s in self._sessions.values() if not s.receiving and now - s.last_activity > self.ttl]
+            for session in stale:
+                del self._sessions[session.upload_id]
+        for session in stale:
+            logger.warning(f"分片上传 {session.upload_id} ('{session.name}') 超时未完成，已丢弃。")
+            session.retire(lambda session=session: self._discard(session))
+
+    def abort_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.retire(lambda session=session: self._discard(session))
+
+    @property
+    def active(self) -> int:
+        """ 进行中的分片上传数 """
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self) -> dict:
+        return {"active": self.active}
@@ -0,0 +1,82 @@
+"""
+请求分帧
+
+早期客户端每条命令单独一次 send，且不带结束符，服务器一次 recv() 就当作一条命令。
+新客户端的命令以换行符结尾，可以把多条命令 (以及内联上传的文件内容) 连续发送，
+不必等待上一条的响应。RequestReader 为每个连接维护一个接收缓冲区，同时兼容两种写法:
+
+    缓冲区中有换行符   取到换行符为止作为一条命令，其余数据留在缓冲区
+    没有换行符         按旧协议把收到的全部数据当作一条命令
+
+连接上一旦出现过以换行符结尾的命令，就认定对端使用新写法，之后不完整的命令会
+继续等待换行符，不会被误当作旧协议的命令。
+
+命令之后的数据体 (内联上传的文件内容、分片数据) 先从缓冲区取，不足的部分再从套接字读。
+"""
+import socket
+
+RECV_SIZE = 65536
+MAX_HEADER_SIZE = 8192              # 单条命令的最大长度，超过视为协议错误
+
+
+class RequestReader:
+    """ 单个连接上的命令读取器，不是线程安全的 """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._buffer = bytearray()
+        self.line_mode = False      # 对端是否使用以换行符结尾的命令
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def read_request(self):
+        """ 读取下一条命令 (不含结束符)；对端关闭连接时返回 None """
+        while True:
+            index = self._buffer.find(b'\n')
+            if index >= 0:
+                self.line_mode = True
+                line = bytes(self._buffer[:index])
+                del self._buffer[:index + 1]
+                break
+            if self._buffer and not self.line_mode:
+                line = bytes(self._buffer)
+                self._buffer.clear()
+                break
+            if len(self._buffer) > MAX_HEADER_SIZE:
+                raise ValueError("命令过长")
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                return None
+            self._buffer += data
+        return line.decode('utf-8').strip()
+
+    def take(self, size: int) -> bytes:
+        """ 取出缓冲区中最多 size 字节，用作数据体的开头部分 """
+        data = bytes(self._buffer[:size])
+        del self._buffer[:len(data)]
+        return data
+
+    def read_into(self, view: memoryview) -> int:
+        """ 填满 view，先取缓冲区再从套接字 recv_into；返回读到的字节数，对端提前关闭时小于 len(view) """
+        filled = min(len(self._buffer), len(view))
+        if filled:
+            view[:filled] = self._buffer[:filled]
+            del self._buffer[:filled]
+        while filled < len(view):
+            n = self.sock.recv_into(view[filled:])
+            if not n:
+                break
+            filled += n
+        return filled
+
+    def read_exact(self, size: int) -> bytes:
+        """ 读取 size 字节的数据体；对端提前关闭时返回的数据不足 size """
+        data = bytearray(self.take(size))
+        while len(data) < size:
+            chunk = self.sock.recv(min(RECV_SIZE, size - len(data)))
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
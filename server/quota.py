@@ -0,0 +1,132 @@
+"""
+上传预检与配额
+
+上传在回复 READY_TO_RECEIVE 之前 (内联上传在读取文件内容之前，分片上传在 UPLOAD_BEGIN 时)
+按客户端声明的文件大小预留容量，检查不通过直接回复 ERROR|原因，不再接收注定存不下的数据:
+
+    磁盘空间     存储的剩余空间 (statvfs) 减去进行中上传的预留量后，仍要留出 --min-free
+    存储配额     已存文件总大小加上进行中上传的净增量不超过 --store-quota
+    客户端配额   同一客户端 (按 IP 地址) 进行中上传的预留总量不超过 --client-quota
+
+预留在提交或放弃时释放。覆盖已有文件时，rename 之前新旧两份同时占用磁盘，磁盘检查按
+完整大小计算，存储配额只计算大小的增量。分片上传预分配了临时文件后，这部分空间已经
+体现在 statvfs 的结果里，不再重复扣除。
+"""
+import logging
+import threading
+import time
+
+from storage import StorageBackend
+
+DEFAULT_MIN_FREE = 64 << 20         # 磁盘至少保留的剩余空间
+USAGE_REFRESH = 60.0                # 重新扫描已用空间的间隔 (秒)，期间按提交结果增量更新
+
+logger = logging.getLogger('server_logger')
+
+
+class QuotaExceeded(Exception):
+    """ 预检不通过，异常消息会原样返回给客户端 """
+
+
+class Reservation:
+    """ 一次进行中上传的容量预留 """
+
+    def __init__(self, client: str, size: int, replaces: int):
+        self.client = client
+        self.size = size
+        self.replaces = replaces        # 被覆盖的旧文件大小
+        self.allocated = False          # 临时文件是否已预分配到 size 字节
+
+    @property
+    def growth(self) -> int:
+        """ 提交后存储总大小的增量，计入存储配额 """
+        return max(0, self.size - self.replaces)
+
+
+class QuotaManager:
+    """ 上传前的空间检查和预留；配额为 0 表示不限制 """
+
+    def __init__(self, storage: StorageBackend, store_quota: int = 0, client_quota: int = 0,
+                 min_free: int = DEFAULT_MIN_FREE):
+        self.storage = storage
+        self.store_quota = store_quota
+        self.client_quota = client_quota
+        self.min_free = min_free
+        self._lock = threading.Lock()
+        self._active = set()
+        self._pending_disk = 0          # 尚未在磁盘上分配的预留量
+        self._growth = 0                # 进行中上传对存储总大小的增量
+        self._by_client = {}
+        self._used = None               # 已存文件总大小，只在启用存储配额时统计
+        self._used_at = 0.0
+        self.rejected = 0
+
+    def _usage(self) -> int:
+        now = time.monotonic()
+        if self._used is None or now - self._used_at > USAGE_REFRESH:
+            used = sum(info.size for info in self.storage.list())
+            with self._lock:
+                self._used, self._used_at = used, now
+        return self._used
+
+    def _reject(self, message: str):
+        with self._lock:
+            self.rejected += 1
+        raise QuotaExceeded(message)
+
+    def reserve(self, client: str, size: int, replaces: int = 0) -> Reservation:
+        """ 为 size 字节的上传预留容量，不满足任一限制时抛出 QuotaExceeded """
+        if size < 0:
+            raise ValueError("文件大小不能为负数")
+        reservation = Reservation(client, size, replaces)
+        # 系统调用和目录扫描放在锁外，检查和登记在锁内一次完成
+        free = self.storage.free_space()
+        used = self._usage() if self.store_quota else 0
+        with self._lock:
+            if free is not None and free - self._pending_disk - self.min_free < size:
+                available = max(0, free - self._pending_disk - self.min_free)
+                message = f"服务器磁盘空间不足 (可用 {available} 字节，需要 {size} 字节)"
+            elif self.store_quota and used + self._growth + reservation.growth > self.store_quota:
+                message = f"超出服务器存储配额 ({self.store_quota} 字节)"
+            elif self.client_quota and self._by_client.get(client, 0) + size > self.client_quota:
+                message = f"超出单个客户端进行中上传的配额 ({self.client_quota} 字节)"
+            else:
+                self._active.add(reservation)
+                self._pending_disk += size
+                self._growth += reservation.growth
+                self._by_client[client] = self._by_client.get(client, 0) + size
+                return reservation
+        self._reject(message)
+
+    def mark_allocated(self, reservation: Reservation):
+        """ 临时文件已预分配，空间已从 statvfs 的结果中扣除 """
+        with self._lock:
+            if reservation in self._active and not reservation.allocated:
+                reservation.allocated = True
+                self._pending_disk -= reservation.size
+
+    def release(self, reservation: Reservation, committed_size: int = None):
+        """ 上传提交 (committed_size 为文件最终大小) 或放弃后释放预留 """
+        with self._lock:
+            if reservation not in self._active:
+                return
+            self._active.discard(reservation)
+            if not reservation.allocated:
+                self._pending_disk -= reservation.size
+            self._growth -= reservation.growth
+            remaining = self._by_client[reservation.client] - reservation.size
+            if remaining:
+                self._by_client[reservation.client] = remaining
+            else:
+                del self._by_client[reservation.client]
+            if committed_size is not None and self._used is not None:
+                self._used += committed_size - reservation.replaces
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": len(self._active),
+                "reserved": sum(r.size for r in self._active),
+                "rejected": self.rejected,
+                "store_used": self._used,
+            }
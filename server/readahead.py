@@ -0,0 +1,226 @@
+"""
+下载数据的发送路径
+
+原来的下载循环在同一个线程里交替执行 4KB 的 read() 和 sendall()，读盘时网卡空闲、
+发送时磁盘空闲，文件在机械硬盘或网络存储上时两边都跑不满。这里提供两种发送方式 (--send-mode):
+
+    sequential  原始实现: 单线程交替读取和发送，保留用于对比
+    readahead   在 I/O 线程池 (storage.IOPool) 中按大块 (1MB) 读入一组可复用的缓冲区
+                (默认 4 个)，发送线程同时把已读好的块发出去；同一文件的读取依次进行，
+                一块读完且有空闲缓冲区时提交下一块，缓冲区用完时等待发送线程归还，内存占用有上限。
+                读取前用 posix_fadvise(SEQUENTIAL) 提示顺序访问，并对后面即将读取的
+                区域发出 WILLNEED，让内核提前开始读盘
+
+读盘都在 I/O 线程池中进行，同时访问磁盘的线程数受 --io-threads 限制，与元数据操作共用
+同一个上限；没有传入线程池时每次发送临时建立一个单线程的池。
+不超过一个块的文件不值得流水线，readahead 模式下用 readinto() 读入一整块再发送。
+这些块都从 buffers.BufferPool 中租用，发送结束后归还。
+文件对象没有 fileno() (例如内存存储) 时跳过 fadvise，其余流程相同。
+预读的读盘耗时在发送结束后记为 disk_read (与 net_send 重叠)，发送线程等待预读数据的
+时间记为 disk_wait，它接近 0 说明瓶颈在网络一侧。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+from storage import IOPool
+from tracing import NULL_TRACE
+
+SEND_MODES = ('sequential', 'readahead')
+DEFAULT_SEND_MODE = 'readahead'
+LEGACY_CHUNK_SIZE = 4096            # sequential 模式沿用原实现的 4KB 块
+DEFAULT_BLOCK_SIZE = 1 << 20        # 预读的块大小
+DEFAULT_DEPTH = 4                   # 预读缓冲区个数，即最多领先发送线程的块数
+
+logger = logging.getLogger('server_logger')
+
+
+def _fileno(f):
+    try:
+        return f.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def advise(fd, offset: int, length: int, advice_name: str):
+    """ posix_fadvise 的包装，平台或文件系统不支持时静默跳过 """
+    if fd is None or length <= 0 or not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
+    except OSError as e:
+        logger.debug(f"posix_fadvise({advice_name}) 不可用: {e}")
+
+
+class _ReadAhead:
+    """
+    预读: 在 I/O 线程池中依次读取各块，读满的缓冲区放入就绪队列，发送线程用完后 release()；
+    出错时把异常放入就绪队列，读完后放入 None
+    """
+
+    def __init__(self, f, offset: int, size: int, block_size: int, depth: int, pool=None, io=None):
+        self.f = f
+        self.fd = _fileno(f)
+        self.offset = offset
+        self.end = offset + size
+        self.block_size = block_size
+        self.window = block_size * depth
+        self.pool = pool
+        self.io = io or IOPool(1)
+        self._own_io = io is None
+        self.read_seconds = 0.0
+        self.ready = queue.Queue()
+        self._buffers = [pool.acquire(block_size) if pool else bytearray(block_size) for _ in range(depth)]
+        self._free = list(self._buffers)
+        self._position = offset
+        self._reading = False           # 是否有进行中的读取，同一文件同时只有一个
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._schedule()
+
+    def _schedule(self):
+        """ 没有进行中的读取且有空闲缓冲区时提交下一块 """
+        with self._cond:
+            if self._reading or self._stopped or self._position >= self.end or not self._free:
+                return
+            buf = self._free.pop()
+            position = self._position
+            self._reading = True
+        # 提交放在锁外: 未启用线程池时 submit 同步执行，回调会再次进入 _schedule
+        future = self.io.submit(self._read, buf, position)
+        future.add_done_callback(lambda done: self._finished(done, buf))
+
+    def _read(self, buf, position):
+        """ 在 I/O 线程中读取一块 """
+        want = min(len(buf), self.end - position)
+        if position == self.offset:
+            advise(self.fd, position, self.end - position, 'POSIX_FADV_SEQUENTIAL')
+            advise(self.fd, position, min(self.window, self.end - position), 'POSIX_FADV_WILLNEED')
+        # 预取缓冲区全部用完之后才会读到的那一块
+        ahead = position + self.window
+        advise(self.fd, ahead, min(self.block_size, self.end - ahead), 'POSIX_FADV_WILLNEED')
+        started = time.perf_counter()
+        self.f.seek(position)
+        n = self.f.readinto(memoryview(buf)[:want])
+        self.read_seconds += time.perf_counter() - started
+        return n
+
+    def _finished(self, future, buf):
+        with self._cond:
+            self._reading = False
+            self._cond.notify_all()
+            if self._stopped:
+                return
+            error = future.exception()
+            n = None if error is not None else future.result()
+            if error is not None or not n:
+                # 出错或文件在发送过程中被截短，不再继续读
+                self._stopped = True
+            else:
+                self._position += n
+        if error is not None:
+            self.ready.put(error)
+            return
+        if not n:
+            self.ready.put(None)
+            return
+        self.ready.put((buf, n))
+        if self._position >= self.end:
+            self.ready.put(None)
+        else:
+            self._schedule()
+
+    def release(self, buf):
+        """ 发送线程归还发送完的缓冲区 """
+        with self._cond:
+            self._free.append(buf)
+        self._schedule()
+
+    def close(self):
+        """ 停止预读，等待进行中的读取结束后归还缓冲区 """
+        with self._cond:
+            self._stopped = True
+            while self._reading:
+                self._cond.wait()
+        if self._own_io:
+            self.io.shutdown()
+        if self.pool is not None:
+            for buf in self._buffers:
+                self.pool.release(buf)
+
+
+def send_from_file(sock, f, offset: int, size: int, mode: str = DEFAULT_SEND_MODE,
+                   block_size: int = DEFAULT_BLOCK_SIZE, depth: int = DEFAULT_DEPTH, trace=NULL_TRACE,
+                   pool=None, io=None) -> int:
+    """
+    把已打开的文件 f 从 offset 开始的 size 字节发送到 sock，返回实际发送的字节数
+
+    pool 是提供块缓冲区的 buffers.BufferPool，不传时每次发送各自分配。
+    io 是执行读盘的 storage.IOPool (服务器的 ctx.io)，sequential 模式不使用。
+    文件在发送过程中变短时提前返回，返回值小于 size；读取出错时异常原样抛出。
+    """
+    if size <= 0:
+        return 0
+    if mode == 'sequential':
+        return _send_sequential(sock, f, offset, size, LEGACY_CHUNK_SIZE, trace)
+    if size <= block_size:
+        if pool is None:
+            return _send_buffered(sock, f, offset, size, bytearray(size), trace, io)
+        buf = pool.acquire(block_size)
+        try:
+            return _send_buffered(sock, f, offset, size, buf, trace, io)
+        finally:
+            pool.release(buf)
+
+    reader = _ReadAhead(f, offset, size, block_size, depth, pool, io)
+    sent = 0
+    try:
+        while True:
+            with trace.span('disk_wait'):
+                item = reader.ready.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            buf, n = item
+            with trace.span('net_send'):
+                sock.sendall(memoryview(buf)[:n])
+            sent += n
+            reader.release(buf)
+    finally:
+        reader.close()
+        trace.add('disk_read', reader.read_seconds)
+    return sent
+
+
+def _send_buffered(sock, f, offset: int, size: int, buf: bytearray, trace, io=None) -> int:
+    """ 交替 readinto() 和 sendall()，每块都复用 buf；给出 io 时读盘在 I/O 线程池中进行 """
+    f.seek(offset)
+    view = memoryview(buf)
+    remaining = size
+    while remaining > 0:
+        with trace.span('disk_read'):
+            chunk = view[:min(len(buf), remaining)]
+            n = io.run(f.readinto, chunk) if io is not None else f.readinto(chunk)
+        if not n:
+            break
+        with trace.span('net_send'):
+            sock.sendall(view[:n])
+        remaining -= n
+    return size - remaining
+
+
+def _send_sequential(sock, f, offset: int, size: int, chunk_size: int, trace) -> int:
+    f.seek(offset)
+    remaining = size
+    while remaining > 0:
+        with trace.span('disk_read'):
+            chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        with trace.span('net_send'):
+            sock.sendall(chunk)
+        remaining -= len(chunk)
+    return size - remaining
@@ -1,178 +1,774 @@
 import socket
 import threading
-import os
+import time
 import json
+import re
 import argparse
 import logging
-from utils import setup_logger, ensure_dir
+from utils import setup_logger, ensure_dir, enable_keepalive
+from file_cache import HotFileCache, DEFAULT_MAX_FILE_SIZE
+from transfer import receive_to_file, receive_part, RECV_MODES, DEFAULT_RECV_MODE
+from events import EventHub
+from multipart import MultipartRegistry
+from protocol import RequestReader
+from quota import QuotaManager, QuotaExceeded, DEFAULT_MIN_FREE
+from tracing import Tracer, NULL_TRACER, NULL_TRACE
+from versions import VersionHistory, DEFAULT_KEEP
+from cluster import Cluster, parse_nodes, DEFAULT_REPLICAS, DEFAULT_REBALANCE_INTERVAL
+from index import FileIndex, file_entry, parse_query, DEFAULT_RESCAN_INTERVAL, MAX_STAT_NAMES, MAX_STAT_BODY
+from readahead import send_from_file, SEND_MODES, DEFAULT_SEND_MODE
+from buffers import BufferPool, ConnectionBuffers, DEFAULT_CHUNK_SIZE
+from http_gateway import HttpGateway
+from sparse import data_extents, is_sparse, encode_map, send_sparse, receive_sparse
+from lifecycle import (
+    ConnectionTracker, StopRequest, start_successor, notify_ready, reject_with_retry,
+    DEFAULT_DRAIN_TIMEOUT, ACCEPT_POLL_INTERVAL
+)
+from storage import (
+    StorageBackend, IOPool, create_storage, file_etag, validate_name,
+    STORAGE_TYPES, FSYNC_POLICIES, DEFAULT_FSYNC_POLICY, DEFAULT_IO_THREADS
+)
 
 # 服务器配置常量
 DEFAULT_HOST = '0.0.0.0'                            # 监听所有网络接口
 DEFAULT_PORT = 65432
 DEFAULT_SAVE_DIR = 'serverinfo/server_files'        # 文件存储目录
-BUFFER_SIZE = 4096                                  # 数据传输缓冲区大小
 MAX_CONNECTIONS = 5                                 # 最大并发连接数
+DEFAULT_INLINE_MAX = 64 << 10                       # 内联上传 (一次发送命令和文件内容) 的文件大小上限
+DEFAULT_IDLE_TIMEOUT = 300                          # 客户端连接空闲超时 (秒)，客户端心跳间隔应小于它
 
-# 全局logger
+# 全局logger；请求处理路径上的日志用 % 参数而不是 f-string，被 --log-level 过滤掉的消息不再格式化
 logger = setup_logger()
 
-def get_file_list(directory_path: str) -> list:
-    """ 获取指定目录下的文件列表，包含文件名和大小 """
+class ServerContext:
+    """ 服务器运行期间各客户端线程共享的状态和组件，由 start_server 创建 """
+
+    def __init__(self, save_dir: str, storage: StorageBackend, io_pool: IOPool = None,
+                 file_cache: HotFileCache = None, recv_mode: str = DEFAULT_RECV_MODE,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT, events: EventHub = None,
+                 multipart: MultipartRegistry = None, inline_max: int = DEFAULT_INLINE_MAX,
+                 quota: QuotaManager = None, tracer: Tracer = None,
+                 drain_timeout: float = DEFAULT_DRAIN_TIMEOUT, send_mode: str = DEFAULT_SEND_MODE,
+                 index_rescan: float = DEFAULT_RESCAN_INTERVAL, cluster: Cluster = None,
+                 buffers: BufferPool = None):
+        self.save_dir = save_dir
+        self.storage = storage              # 存储后端，所有文件访问都经过它
+        self.io = io_pool or IOPool(0)      # 有界 I/O 线程池
+        self.file_cache = file_cache        # 热点文件内存缓存，未启用时为 None
+        self.recv_mode = recv_mode          # 上传数据的接收方式，见 transfer.RECV_MODES
+        self.send_mode = send_mode          # 下载数据的发送方式，见 readahead.SEND_MODES
+        self.idle_timeout = idle_timeout    # 连接空闲超时 (秒)，0 表示不限制
+        self.events = events or EventHub()  # 文件变更通知，推送给 SUBSCRIBE 的连接
+        self.quota = quota or QuotaManager(storage)     # 上传前的空间检查和配额
+        self.multipart = multipart or MultipartRegistry(storage, quota=self.quota)    # 进行中的分片上传
+        self.inline_max = inline_max        # 内联上传的大小上限，通过 HELLO 告知客户端
+        self.tracer = tracer or NULL_TRACER # 请求级追踪，未启用时为空实现
+        self.connections = ConnectionTracker(self.multipart)   # 活动连接，关闭和重启时排空
+        self.drain_timeout = drain_timeout  # 关闭时等待进行中请求完成的最长时间 (秒)
+        self.index = FileIndex(storage, index_rescan)   # SEARCH / STAT 查询的内存索引
+        self.cluster = cluster              # 集群成员与复制，单机运行时为 None
+        self.buffers = buffers or BufferPool()  # 传输循环复用的缓冲区
+        self.http = None                    # HTTP 网关，由 start_server 按 --http-port 启动，未启用时为 None
+
+    def capabilities(self) -> dict:
+        """ 服务器支持的可选功能，供 HELLO 命令返回 """
+        features = ["inline", "pipeline", "range", "subscribe", "multipart", "sparse", "search"]
+        if self.storage.versioned:
+            features.append("versions")
+        capabilities = {
+            "inline_max": self.inline_max,
+            "features": features,
+        }
+        if self.cluster is not None:
+            features.append("cluster")
+            capabilities["cluster"] = self.cluster.capability()
+        if self.http is not None:
+            features.append("http")
+            capabilities["http_port"] = self.http.port
+        return capabilities
+
+    def stats(self) -> dict:
+        """ 运行时统计，供 STATS 命令返回 """
+        return {
+            "file_cache": self.file_cache.stats() if self.file_cache else None,
+            "events": self.events.stats(),
+            "multipart": self.multipart.stats(),
+            "quota": self.quota.stats(),
+            "tracing": self.tracer.stats(),
+            "versions": self.storage.history.stats() if self.storage.versioned else None,
+            "connections": self.connections.stats(),
+            "index": self.index.stats(),
+            "cluster": self.cluster.stats() if self.cluster else None,
+            "buffers": self.buffers.stats(),
+            "http": self.http.stats() if self.http else None,
+        }
+
+
+def get_version_list(storage: StorageBackend, filename: str) -> list:
+    """ 获取文件的历史版本列表，从新到旧 """
+    return [{"version": info.version, "size": info.size, "mtime": info.mtime_ns / 1e9}
+            for info in storage.list_versions(filename)]
+
+
+def get_file_list(storage: StorageBackend) -> list:
+    """ 获取存储中的文件列表，包含文件名、大小、修改时间和校验值 """
     files_info = []
     try:
-        for filename in os.listdir(directory_path):
-            filepath = os.path.join(directory_path, filename)
-            if os.path.isfile(filepath):
-                files_info.append({
-                    "name": filename,
-                    "size": os.path.getsize(filepath)
-                })
+        for info in storage.list():
+            files_info.append({
+                "name": info.name,
+                "size": info.size,
+                "mtime": info.mtime_ns / 1e9,
+                "etag": file_etag(info)
+            })
     except OSError as e:
-        logger.error(f"无法访问目录 '{directory_path}': {e}")
+        logger.error(f"无法列出存储 {storage.describe()} 中的文件: {e}")
     return files_info
 
 
-def handle_client_request(client_socket: socket.socket, client_address: tuple, save_dir: str):
-    """ 处理单个客户端的连接和请求 """
-    logger.info(f"接受来自 {client_address} 的连接。")
+def handle_multipart(command: str, payload_str: str, client_socket: socket.socket,
+                     client_address: tuple, ctx: ServerContext, reader: RequestReader,
+                     buffers: ConnectionBuffers, trace=NULL_TRACE) -> bool:
+    """ 处理分片上传命令 (见 multipart.py)，连接需要关闭时返回 False """
+    registry = ctx.multipart
+    try:
+        if command == "UPLOAD_BEGIN":
+            filename, filesize_str, part_size_str = payload_str.split('|', 2)
+            trace.set(name=filename)
+            with trace.span('open'):
+                session = ctx.io.run(registry.begin, filename, int(filesize_str), int(part_size_str),
+                                     client_address[0])
+            client_socket.sendall(f"OK_BEGIN|{session.upload_id}|{session.part_count}\n".encode('utf-8'))
+            logger.info("%s 开始分片上传 '%s' (%s字节，%s 个分片)，上传 ID %s。",
+                        client_address, filename, filesize_str, session.part_count, session.upload_id)
+
+        elif command == "UPLOAD_PART":
+            upload_id, index_str, expected = payload_str.split('|', 2)
+            index = int(index_str)
+            session = registry.get(upload_id)
+            offset, length = session.part_range(index)
+            trace.set(name=session.name, bytes=length)
+            session.start_part(index)
+            ok = False
+            try:
+                client_socket.sendall(b"READY_TO_RECEIVE\n")
+                received, digest = receive_part(client_socket, session.pending, offset, length,
+                                                initial=reader.take(length), trace=trace,
+                                                buffer=buffers.chunk)
+                if received < length:
+                    logger.error("%s 上传分片 %s 时连接中断。预期 %s, 收到 %s", client_address, index, length, received)
+                    trace.set(status="aborted")
+                    return False
+                ok = digest == expected.lower()
+            finally:
+                session.finish_part(index, ok)
+            if ok:
+                client_socket.sendall(f"OK_PART|{index}\n".encode('utf-8'))
+            else:
+                trace.set(status="error")
+                client_socket.sendall(f"ERROR|分片 {index} 校验失败，请重传。\n".encode('utf-8'))
+                logger.warning("%s 上传的分片 %s ('%s') 校验失败。", client_address, index, session.name)
+
+        elif command == "UPLOAD_COMMIT":
+            with trace.span('commit'):
+                session, info = ctx.io.run(registry.commit, payload_str)
+            trace.set(name=session.name)
+            if ctx.file_cache is not None:
+                ctx.file_cache.invalidate(session.name)
+            ctx.index.update(info)
+            ctx.events.publish("update" if session.existed else "add", info)
+            if ctx.cluster is not None:
+                ctx.cluster.file_committed(session.name)
+            operation_type = "更新" if session.existed else "上传"
+            client_socket.sendall(f"OK|文件 '{session.name}' 已成功{operation_type}。\n".encode('utf-8'))
+            logger.info("文件 '%s' (%s字节) 已通过分片上传从 %s 接收并%s。",
+                        session.name, info.size, client_address, operation_type)
+
+        elif command == "UPLOAD_ABORT":
+            aborted = ctx.io.run(registry.abort, payload_str)
+            client_socket.sendall(f"OK|{'已取消' if aborted else '没有'}该分片上传。\n".encode('utf-8'))
+
+    except KeyError:
+        trace.set(status="error")
+        client_socket.sendall("ERROR|分片上传不存在或已过期。\n".encode('utf-8'))
+    except QuotaExceeded as e:
+        trace.set(status="error")
+        client_socket.sendall(f"ERROR|{e}\n".encode('utf-8'))
+        logger.warning("拒绝 %s 的分片上传请求: %s", client_address, e)
+    except ValueError as e:
+        trace.set(status="error")
+        client_socket.sendall(f"ERROR|无效的分片上传请求: {e}\n".encode('utf-8'))
+        logger.error("%s 发送了无效的分片上传请求 %s: %s", client_address, command, e)
+    except OSError as e:
+        trace.set(status="error")
+        logger.error("处理来自 %s 的分片上传请求 %s 失败: %s", client_address, command, e)
+        if command == "UPLOAD_PART":
+            return False    # 分片数据的边界已无法确定，只能关闭连接
+        client_socket.sendall(f"ERROR|服务器处理分片上传时出错: {e}\n".encode('utf-8'))
+    return True
+
+
+def handle_replicate(payload_str: str, client_socket: socket.socket, client_address: tuple,
+                     ctx: ServerContext, reader: RequestReader, buffers: ConnectionBuffers,
+                     trace=NULL_TRACE) -> bool:
+    """ 接收另一个节点推送的副本 (见 cluster.py)，连接需要关闭时返回 False """
+    storage = ctx.storage
+    try:
+        filename, filesize_str, mtime_str = payload_str.rsplit('|', 2)
+        filesize, mtime_ns = int(filesize_str), int(mtime_str)
+        validate_name(filename)
+        if filesize < 0:
+            raise ValueError("文件大小不能为负数")
+    except ValueError as e:
+        trace.set(status="error")
+        client_socket.sendall(f"ERROR|无效的复制请求格式 (应为 filename|filesize|mtime_ns): {e}\n".encode('utf-8'))
+        return True
+    trace.set(name=filename, bytes=filesize)
+
+    with trace.span('stat'):
+        old = ctx.io.run(storage.stat, filename)
+    if old is not None and old.mtime_ns >= mtime_ns:
+        client_socket.sendall(f"SKIPPED|{file_etag(old)}\n".encode('utf-8'))
+        return True
+    try:
+        with trace.span('quota'):
+            reservation = ctx.io.run(ctx.quota.reserve, client_address[0], filesize, old.size if old else 0)
+    except QuotaExceeded as e:
+        trace.set(status="error")
+        client_socket.sendall(f"ERROR|{e}\n".encode('utf-8'))
+        logger.warning("拒绝节点 %s 推送的副本 '%s': %s", client_address, filename, e)
+        return True
+
+    pending = None
+    committed_size = None
+    try:
+        with trace.span('open'):
+            pending = ctx.io.run(storage.open_write, filename)
+        pending.mtime_ns = mtime_ns
+        client_socket.sendall(b"READY_TO_RECEIVE\n")
+        received = receive_to_file(client_socket, pending.file, filesize, ctx.recv_mode,
+                                   initial=reader.take(filesize), trace=trace, buffer=buffers.chunk)
+        if received < filesize:
+            trace.set(status="aborted")
+            logger.error("节点 %s 推送副本 '%s' 时连接中断。预期 %s, 收到 %s", client_address, filename, filesize, received)
+            ctx.io.run(storage.abort, pending)
+            return False
+        with trace.span('commit'):
+            info = ctx.io.run(storage.commit, pending)
+        committed_size = info.size
+        if ctx.file_cache is not None:
+            ctx.file_cache.invalidate(filename)
+        ctx.index.update(info)
+        ctx.events.publish("update" if old is not None else "add", info)
+        client_socket.sendall(f"OK|副本 '{filename}' 已保存。\n".encode('utf-8'))
+        logger.info("已保存节点 %s 推送的副本 '%s' (%s字节)。", client_address, filename, filesize)
+    except OSError as e:
+        trace.set(status="error")
+        logger.error("保存节点 %s 推送的副本 '%s' 失败: %s", client_address, filename, e)
+        if pending is not None:
+            try:
+                ctx.io.run(storage.abort, pending)
+            except OSError:
+                pass
+        return False    # 数据体可能还没有读完，只能关闭连接
+    finally:
+        ctx.quota.release(reservation, committed_size)
+    return True
+
+
+def handle_client_request(client_socket: socket.socket, client_address: tuple, ctx: ServerContext,
+                          accepted_at: float = None):
+    """ 处理单个客户端的连接和请求；accepted_at 为 accept 返回时的 perf_counter，用于追踪 """
+    # 从 accept 返回到处理线程开始运行的等待时间，记在连接的第一个请求上
+    accept_wait = time.perf_counter() - accepted_at if accepted_at is not None else None
+    logger.info("接受来自 %s 的连接。", client_address)
+    enable_keepalive(client_socket)
+    # 响应头和数据体分两次发送时，Nagle 算法会让第二段等待对端的延迟确认
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # 空闲超时同样作用于传输中途的收发，对端长时间无响应时释放线程
+    client_socket.settimeout(ctx.idle_timeout or None)
+    storage = ctx.storage
+    file_cache = ctx.file_cache
+    reader = RequestReader(client_socket)
+    buffers = ctx.buffers.connection()     # 第一次传输数据时才向池借出缓冲区，连接关闭时归还
+    conn_id = ctx.tracer.connection()
+    seq = 0
+    internal = False        # 集群中其他节点的连接 (CLUSTER_PEER)，不再汇总列表或转发下载
+    ctx.connections.add(client_socket)
 
     try:
         while True:
-            # 接收命令头部 (例如: "COMMAND|payload_info")
-            initial_data = client_socket.recv(BUFFER_SIZE)
-            if not initial_data:
-                logger.info(f"客户端 {client_address} 断开连接。")
+            # 接收命令头部 (例如: "COMMAND|payload_info")，新客户端的命令以换行符结尾并可连续发送
+            try:
+                request_str = reader.read_request()
+            except socket.timeout:
+                logger.info("客户端 %s 空闲超过 %s 秒，关闭连接。", client_address, ctx.idle_timeout)
+                break
+            if request_str is None:
+                logger.info("客户端 %s 断开连接。", client_address)
+                break
+            if not ctx.connections.begin(client_socket):
+                # 服务器正在排空: 已读到的请求不再处理，客户端收到后重新连接再重试
+                reject_with_retry(client_socket)
+                logger.info("服务器正在排空，已要求 %s 重试请求: %s", client_address, request_str[:100])
                 break
 
-            request_str = initial_data.decode('utf-8').strip()
-            logger.debug(f"来自 {client_address} 的原始请求: {request_str[:100]}")
+            logger.debug("来自 %s 的原始请求: %s", client_address, request_str[:100])
 
             parts = request_str.split('|', 1)
             command = parts[0]
             payload_str = parts[1] if len(parts) > 1 else ""
+            seq += 1
+            trace = ctx.tracer.begin(conn_id, seq, client_address[0], command)
+            if accept_wait is not None:
+                trace.add('accept', accept_wait)
+                accept_wait = None
 
-            # 根据命令执行不同操作
-            if command == "LIST_FILES":
-                logger.info(f"{client_address} 请求文件列表。")
-                files = get_file_list(save_dir)
-                response_data = json.dumps(files).encode('utf-8')
-
-                # 发送响应头部：状态码|数据长度
-                response_header = f"OK_LIST|{len(response_data)}".encode('utf-8')
-
-                client_socket.sendall(response_header)
-                client_socket.send(b'\n')
-                client_socket.sendall(response_data)
-
-                logger.info(f"已向 {client_address} 发送文件列表。")
-
-            elif command == "DOWNLOAD_FILE":
-                filename = payload_str
-                filepath = os.path.join(save_dir, filename)
-                logger.info(f"{client_address} 请求下载文件: {filename}")
-
-                if os.path.isfile(filepath):
-                    filesize = os.path.getsize(filepath)
-                    # 响应：OK_DOWNLOAD|filesize
-                    response_header = f"OK_DOWNLOAD|{filesize}".encode('utf-8')
-
-                    client_socket.sendall(response_header)
-                    client_socket.send(b'\n')
-
-                    with open(filepath, 'rb') as f:
-                        while True:
-                            chunk = f.read(BUFFER_SIZE)
-                            if not chunk:
-                                break
-                            client_socket.sendall(chunk)
-                    logger.info(f"文件 '{filename}' ({filesize}字节) 已发送给 {client_address}。")
-                
-                else:
-                    error_msg = f"ERROR|文件 '{filename}' 未找到。"
-                    client_socket.sendall(error_msg.encode('utf-8'))
-                    logger.error(f"请求的文件 '{filename}' 未找到，已告知 {client_address}。")
+            # 根据命令执行不同操作 (所有响应头都以换行符结尾，便于客户端分帧)
+            try:
+                if command == "LIST_FILES":
+                    logger.info("%s 请求文件列表。", client_address)
+                    with trace.span('list'):
+                        files = ctx.io.run(get_file_list, storage)
+                        if ctx.cluster is not None and not internal:
+                            files = ctx.cluster.list_all(files)
+                    response_data = json.dumps(files).encode('utf-8')
+                    trace.set(bytes=len(response_data))
 
-            elif command == "UPLOAD_FILE" or command == "UPDATE_FILE":
-                try:
-                    filename, filesize_str = payload_str.split('|', 1)
-                    filesize = int(filesize_str)
+                    # 响应头部 (状态码|数据长度) 和列表一次发出，省去一次等待确认
+                    response_header = f"OK_LIST|{len(response_data)}".encode('utf-8')
+                    with trace.span('net_send'):
+                        client_socket.sendall(response_header + b'\n' + response_data)
 
-                except ValueError:
-                    error_msg = "ERROR|无效的文件上传请求格式 (应为 filename|filesize)。"
-                    client_socket.sendall(error_msg.encode('utf-8'))
-                    logger.error(f"{client_address} 发送了无效的上传请求: {payload_str}")
-                    continue    # 这里不能用 break 要继续等待下一个命令
+                    logger.info("已向 %s 发送文件列表。", client_address)
+
+                elif command == "LIST_VERSIONS":
+                    # LIST_VERSIONS|filename -> OK_VERSIONS|json_len\n<json>，未启用版本历史时为空列表
+                    trace.set(name=payload_str)
+                    try:
+                        with trace.span('list'):
+                            versions = ctx.io.run(get_version_list, storage, payload_str)
+                    except (OSError, ValueError) as e:
+                        trace.set(status="error")
+                        client_socket.sendall(f"ERROR|无法获取 '{payload_str}' 的历史版本: {e}\n".encode('utf-8'))
+                        continue
+                    response_data = json.dumps(versions).encode('utf-8')
+                    with trace.span('net_send'):
+                        client_socket.sendall(f"OK_VERSIONS|{len(response_data)}\n".encode('utf-8') + response_data)
+                    logger.info("已向 %s 发送 '%s' 的 %s 个历史版本。", client_address, payload_str, len(versions))
+
+                elif command == "SEARCH":
+                    # SEARCH|<json 查询> -> OK_SEARCH|json_len\n{"files": [...], "truncated": bool} (见 index.py)
+                    try:
+                        with trace.span('parse'):
+                            query = parse_query(payload_str)
+                        with trace.span('list'):
+                            matches, truncated = ctx.index.search(**query)
+                    except (ValueError, TypeError, OverflowError, re.error) as e:
+                        trace.set(status="error")
+                        client_socket.sendall(f"ERROR|无效的搜索条件: {e}\n".encode('utf-8'))
+                        logger.error("%s 发送了无效的搜索请求: %s", client_address, payload_str[:100])
+                        continue
+                    response_data = json.dumps({"files": [file_entry(info) for info in matches],
+                                                "truncated": truncated}).encode('utf-8')
+                    trace.set(bytes=len(response_data))
+                    with trace.span('net_send'):
+                        client_socket.sendall(f"OK_SEARCH|{len(response_data)}\n".encode('utf-8') + response_data)
+                    logger.info("已向 %s 返回 %s 个搜索结果。", client_address, len(matches))
+
+                elif command == "STAT":
+                    # STAT|json_len\n<json 名称列表> -> OK_STAT|json_len\n[条目或 null, ...]
+                    try:
+                        body_len = int(payload_str)
+                        if not 0 <= body_len <= MAX_STAT_BODY:
+                            raise ValueError
+                    except ValueError:
+                        trace.set(status="error")
+                        client_socket.sendall(f"ERROR|无效的 STAT 请求格式 (应为 STAT|json_len，"
+                                              f"长度不超过 {MAX_STAT_BODY})。\n".encode('utf-8'))
+                        break   # 无法确定名称列表的长度，只能关闭连接
+                    with trace.span('net_recv'):
+                        body = reader.read_exact(body_len)
+                    if len(body) < body_len:
+                        logger.error("%s 在发送 STAT 名称列表时断开连接。", client_address)
+                        break
+                    try:
+                        names = json.loads(body.decode('utf-8'))
+                        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+                            raise ValueError("名称列表必须是字符串数组")
+                        if len(names) > MAX_STAT_NAMES:
+                            raise ValueError(f"一次最多查询 {MAX_STAT_NAMES} 个文件")
+                    except ValueError as e:
+                        trace.set(status="error")
+                        client_socket.sendall(f"ERROR|无效的 STAT 请求: {e}\n".encode('utf-8'))
+                        continue
+                    with trace.span('stat'):
+                        infos = ctx.index.stat_many(names)
+                    response_data = json.dumps([file_entry(info) if info is not None else None
+                                                for info in infos]).encode('utf-8')
+                    trace.set(bytes=len(response_data))
+                    with trace.span('net_send'):
+                        client_socket.sendall(f"OK_STAT|{len(response_data)}\n".encode('utf-8') + response_data)
+
+                elif command in ("DOWNLOAD_FILE", "DOWNLOAD_IF_CHANGED", "DOWNLOAD_RANGE", "DOWNLOAD_VERSION",
+                                 "DOWNLOAD_SPARSE"):
+                    # DOWNLOAD_IF_CHANGED|etag|filename: etag 与当前版本一致时只回复 NOT_MODIFIED
+                    # DOWNLOAD_RANGE|offset|etag|filename: 断线重连后续传，etag 不一致时退回完整下载
+                    # DOWNLOAD_VERSION|version|filename: 下载历史版本，响应与条件下载相同
+                    # DOWNLOAD_SPARSE|filename: 有空洞时只发送数据区段 (见 sparse.py)，否则同条件下载
+                    offset = 0
+                    version = None
+                    try:
+                        with trace.span('parse'):
+                            if command == "DOWNLOAD_RANGE":
+                                offset_str, known_etag, filename = payload_str.split('|', 2)
+                                offset = int(offset_str)
+                            elif command == "DOWNLOAD_IF_CHANGED":
+                                known_etag, _, filename = payload_str.partition('|')
+                            elif command == "DOWNLOAD_VERSION":
+                                version, filename = payload_str.split('|', 1)
+                                known_etag = version
+                            elif command == "DOWNLOAD_SPARSE":
+                                known_etag, filename = '', payload_str     # 响应头总是带上 etag
+                            else:
+                                known_etag, filename = None, payload_str
+                    except ValueError:
+                        trace.set(status="error")
+                        expected = "version|filename" if command == "DOWNLOAD_VERSION" else "offset|etag|filename"
+                        client_socket.sendall(f"ERROR|无效的下载请求格式 (应为 {expected})。\n".encode('utf-8'))
+                        logger.error("%s 发送了无效的下载请求: %s", client_address, payload_str)
+                        continue
+                    logger.info("%s 请求下载文件: %s%s%s", client_address, filename,
+                                f" (从 {offset} 字节处续传)" if offset else "",
+                                f" 的历史版本 {version}" if version else "")
+
+                    trace.set(name=filename)
+                    try:
+                        with trace.span('open'):
+                            if version is None:
+                                f, info = ctx.io.run(storage.open_read, filename)
+                            else:
+                                f, info = ctx.io.run(storage.open_version, filename, version)
+                    except (FileNotFoundError, ValueError):
+                        if ctx.cluster is not None and not internal and version is None:
+                            # 本节点没有这个文件，转发给所有者；稀疏下载退回普通下载
+                            forward = (f"DOWNLOAD_IF_CHANGED||{filename}" if command == "DOWNLOAD_SPARSE"
+                                       else request_str)
+                            with trace.span('proxy'):
+                                if ctx.cluster.proxy_download(forward, filename, client_socket):
+                                    continue
+                        trace.set(status="error")
+                        error_msg = (f"ERROR|文件 '{filename}' 未找到。\n" if version is None
+                                     else f"ERROR|文件 '{filename}' 的历史版本 {version} 不存在。\n")
+                        client_socket.sendall(error_msg.encode('utf-8'))
+                        logger.error("请求的文件 '%s' 未找到，已告知 %s。", filename, client_address)
+                        continue
+
+                    with f:
+                        filesize = info.size
+                        etag = file_etag(info)
 
-                filepath = os.path.join(save_dir, filename)
-                file_exists = os.path.exists(filepath)
-                operation_type = "更新" if (command == "UPDATE_FILE" or file_exists) else "上传"
+                        if command == "DOWNLOAD_IF_CHANGED" and known_etag == etag:
+                            client_socket.sendall(f"NOT_MODIFIED|{etag}\n".encode('utf-8'))
+                            logger.info("文件 '%s' 未变化，%s 可使用本地缓存。", filename, client_address)
+                            continue
+
+                        if command == "DOWNLOAD_RANGE" and (known_etag != etag or not 0 <= offset <= filesize):
+                            logger.info("文件 '%s' 已变化，%s 需要重新完整下载。", filename, client_address)
+                            offset = 0
+
+                        if command == "DOWNLOAD_SPARSE":
+                            with trace.span('stat'):
+                                extents = ctx.io.run(data_extents, f, filesize)
+                            if is_sparse(extents, filesize):
+                                map_data = encode_map(extents)
+                                with trace.span('net_send'):
+                                    client_socket.sendall(
+                                        f"OK_SPARSE|{filesize}|{etag}|{len(map_data)}\n".encode('utf-8'))
+                                sent = send_sparse(client_socket, f, map_data, extents, trace, buffers.chunk, ctx.io)
+                                trace.set(bytes=sent)
+                                logger.info("文件 '%s' (%s字节，%s 个数据区段共 %s字节) 已以稀疏方式发送给 %s。",
+                                            filename, filesize, len(extents), sent, client_address)
+                                continue
+                            f.seek(0)       # 探测区段移动了文件指针，没有空洞时按普通下载发送
+
+                        # 热点缓存命中时直接发送共享的内存视图，未命中且大小合适时整个读入缓存
+                        # (缓存按文件名只保存当前版本，历史版本不经过缓存)
+                        cached = None
+                        if file_cache is not None and version is None and file_cache.admits(filesize):
+                            cached = file_cache.get(filename, etag)
+                            if cached is None:
+                                with trace.span('disk_read'):
+                                    cached = ctx.io.run(file_cache.load, filename, etag, f, filesize)
+                        trace.set(bytes=filesize - offset)
+
+                        # 响应：OK_DOWNLOAD|filesize (条件下载时附带 |etag)，续传时 OK_RANGE|offset|filesize|etag
+                        if offset:
+                            response_header = f"OK_RANGE|{offset}|{filesize}|{etag}".encode('utf-8')
+                        elif known_etag is None:
+                            response_header = f"OK_DOWNLOAD|{filesize}".encode('utf-8')
+                        else:
+                            response_header = f"OK_DOWNLOAD|{filesize}|{etag}".encode('utf-8')
+                        with trace.span('net_send'):
+                            client_socket.sendall(response_header + b'\n')
+
+                        if cached is not None:
+                            with trace.span('net_send'):
+                                client_socket.sendall(cached[offset:])
+                        else:
+                            send_from_file(client_socket, f, offset, filesize - offset, ctx.send_mode, trace=trace,
+                                           pool=ctx.buffers, io=ctx.io)
+                    logger.info("文件 '%s' (%s字节) 已发送给 %s%s。", filename, filesize - offset, client_address,
+                                " (来自内存缓存)" if cached is not None else "")
+
+                elif command in ("UPLOAD_FILE", "UPDATE_FILE", "UPLOAD_INLINE", "UPDATE_INLINE",
+                                 "UPLOAD_SPARSE", "UPDATE_SPARSE"):
+                    # *_INLINE: 文件内容紧跟在命令之后，不等待 READY_TO_RECEIVE，只回复一次
+                    # *_SPARSE|filename|filesize|map_len: 只发送数据区段，空洞在服务器端保持为空洞
+                    inline = command.endswith("_INLINE")
+                    sparse = command.endswith("_SPARSE")
+                    try:
+                        with trace.span('parse'):
+                            if sparse:
+                                filename, filesize_str, map_len_str = payload_str.split('|', 2)
+                                map_len = int(map_len_str)
+                            else:
+                                filename, filesize_str = payload_str.split('|', 1)
+                            filesize = int(filesize_str)
+                            validate_name(filename)
+                            if filesize < 0:
+                                raise ValueError("文件大小不能为负数")
+                            if inline and filesize > ctx.inline_max:
+                                raise ValueError(f"内联上传的文件不能超过 {ctx.inline_max} 字节")
+
+                    except ValueError as e:
+                        trace.set(status="error")
+                        expected = "filename|filesize|map_len" if sparse else "filename|filesize"
+                        error_msg = f"ERROR|无效的文件上传请求格式 (应为 {expected}): {e}\n"
+                        client_socket.sendall(error_msg.encode('utf-8'))
+                        logger.error("%s 发送了无效的上传请求: %s", client_address, payload_str)
+                        if inline:
+                            return  # 无法确定内联数据的边界，只能关闭连接
+                        continue    # 这里不能用 break 要继续等待下一个命令
+
+                    trace.set(name=filename, bytes=filesize)
+                    with trace.span('stat'):
+                        old = ctx.io.run(storage.stat, filename)
+                    file_exists = old is not None
+                    operation_type = "更新" if (command.startswith("UPDATE") or file_exists) else "上传"
+
+                    # 预检: 按声明的大小预留空间，存不下时在接收数据之前拒绝
+                    try:
+                        with trace.span('quota'):
+                            reservation = ctx.io.run(ctx.quota.reserve, client_address[0], filesize,
+                                                     old.size if old else 0)
+                    except QuotaExceeded as e:
+                        trace.set(status="error")
+                        logger.warning("拒绝 %s %s文件 '%s' (%s字节): %s",
+                                       client_address, operation_type, filename, filesize, e)
+                        # 内联内容已随命令发出，读掉后连接仍可继续使用
+                        if inline and len(reader.read_exact(filesize)) < filesize:
+                            return
+                        client_socket.sendall(f"ERROR|{e}\n".encode('utf-8'))
+                        continue
+
+                    body = None
+                    if inline:
+                        with trace.span('net_recv'):
+                            body = reader.read_exact(filesize)
+                        if len(body) < filesize:
+                            trace.set(status="aborted")
+                            logger.error("%s 内联上传 '%s' 时连接中断。预期 %s, 收到 %s",
+                                         client_address, filename, filesize, len(body))
+                            ctx.quota.release(reservation)
+                            return
                 
-                logger.info(f"{client_address} 准备{operation_type}文件: {filename} ({filesize}字节)。")
-
-                # 告知客户端可以开始发送文件
-                client_socket.sendall(b"READY_TO_RECEIVE")
-                client_socket.send(b'\n')
-
-                received_bytes = 0
-                try:
-                    with open(filepath, 'wb') as f:
-                        while received_bytes < filesize:
-                            chunk = client_socket.recv(BUFFER_SIZE)
-                            if not chunk:
-                                logger.error(f"{client_address} 在{operation_type}文件 '{filename}' 时连接中断。")
-                                
-                                # 可以考虑删除不完整的文件
-
-                                if os.path.exists(filepath):
-                                    os.remove(filepath)
-                                return # 结束此客户端处理线程
-
-                            f.write(chunk)
-                            received_bytes += len(chunk)
-                    
-                    if received_bytes == filesize:
-                        success_msg = f"OK|文件 '{filename}' 已成功{operation_type}。"
+                    logger.info("%s 准备%s文件: %s (%s字节)。", client_address, operation_type, filename, filesize)
+
+                    pending = None
+                    committed_size = None
+                    try:
+                        # 数据先写入临时文件，提交前旧版本 (及其热点缓存) 仍可正常下载
+                        with trace.span('open'):
+                            pending = ctx.io.run(storage.open_write, filename)
+
+                        if inline:
+                            with trace.span('disk_write'):
+                                pending.file.write(body)
+                            received_bytes = filesize
+                        elif sparse:
+                            with trace.span('net_send'):
+                                client_socket.sendall(b"READY_TO_RECEIVE\n")
+                            data_bytes = receive_sparse(reader, pending, filesize, map_len, trace, buffers.chunk)
+                            received_bytes = filesize if data_bytes is not None else 0
+                            if data_bytes is not None:
+                                trace.set(bytes=data_bytes)
+                        else:
+                            # 告知客户端可以开始发送文件
+                            with trace.span('net_send'):
+                                client_socket.sendall(b"READY_TO_RECEIVE\n")
+                            received_bytes = receive_to_file(client_socket, pending.file, filesize, ctx.recv_mode,
+                                                             initial=reader.take(filesize), trace=trace,
+                                                             buffer=buffers.chunk)
+
+                        if received_bytes < filesize:
+                            trace.set(status="aborted")
+                            logger.error("%s 在%s文件 '%s' 时连接中断。预期 %s, 收到 %s",
+                                         client_address, operation_type, filename, filesize, received_bytes)
+                            # 丢弃不完整的临时文件，原文件保持不变
+                            ctx.io.run(storage.abort, pending)
+                            return # 结束此客户端处理线程
+
+                        with trace.span('commit'):
+                            info = ctx.io.run(storage.commit, pending)
+                        committed_size = info.size
+                        if file_cache is not None:
+                            file_cache.invalidate(filename)
+                        ctx.index.update(info)
+                        ctx.events.publish("update" if file_exists else "add", info)
+                        if ctx.cluster is not None:
+                            ctx.cluster.file_committed(filename)
+
+                        success_msg = f"OK|文件 '{filename}' 已成功{operation_type}。\n"
                         client_socket.sendall(success_msg.encode('utf-8'))
-                        logger.info(f"文件 '{filename}' ({filesize}字节) 已从 {client_address} 接收并{operation_type}。")
-                    
-                    else:
-                        # 文件接收不完整
-                        logger.warning(f"文件 '{filename}' 从 {client_address} 接收不完整。预期 {filesize}, 收到 {received_bytes}")
-                        error_msg = f"ERROR|文件 '{filename}' 接收不完整。"
+                        logger.info("文件 '%s' (%s字节) 已从 %s 接收并%s。",
+                                    filename, filesize, client_address, operation_type)
+
+                    except Exception as e:
+                        trace.set(status="error")
+                        error_msg = f"ERROR|服务器{operation_type}文件 '{filename}' 时出错: {e}\n"
+                        logger.error("%s来自 %s 的文件 '%s' 失败: %s", operation_type, client_address, filename, e)
                         try:
                             client_socket.sendall(error_msg.encode('utf-8'))
                         except socket.error:
-                            pass # 客户端可能已关闭连接
-                        if os.path.exists(filepath):
-                             os.remove(filepath) # 删除不完整的文件
+                            pass
+                        if pending is not None: # 如果出错，丢弃可能已写入的不完整文件
+                            try:
+                                ctx.io.run(storage.abort, pending)
+                            except OSError:
+                                pass
+                    finally:
+                        ctx.quota.release(reservation, committed_size)
+            
+                elif command in ("UPLOAD_BEGIN", "UPLOAD_PART", "UPLOAD_COMMIT", "UPLOAD_ABORT"):
+                    if not handle_multipart(command, payload_str, client_socket, client_address, ctx, reader,
+                                            buffers, trace):
+                        return # 分片数据不完整，结束此客户端处理线程
+
+                elif command in ("CLUSTER_PEER", "REPLICATE", "CLUSTER_NODES") and ctx.cluster is None:
+                    trace.set(status="error")
+                    client_socket.sendall("ERROR|服务器没有以集群模式运行。\n".encode('utf-8'))
+
+                elif command == "CLUSTER_PEER":
+                    internal = True
+                    client_socket.sendall("OK|集群内部连接\n".encode('utf-8'))
+
+                elif command == "REPLICATE":
+                    if not handle_replicate(payload_str, client_socket, client_address, ctx, reader, buffers, trace):
+                        return
 
-                except Exception as e:
-                    error_msg = f"ERROR|服务器{operation_type}文件 '{filename}' 时出错: {e}"
-                    logger.error(f"{operation_type}来自 {client_address} 的文件 '{filename}' 失败: {e}")
+                elif command == "CLUSTER_NODES":
+                    # CLUSTER_NODES|<json 节点列表>: 客户端发来时转发给新旧列表中的其他节点
                     try:
-                        client_socket.sendall(error_msg.encode('utf-8'))
-                    except socket.error:
-                        pass
-                    if os.path.exists(filepath): # 如果出错，删除可能已创建的不完整文件
-                        os.remove(filepath)
-            
-            else:
-                error_msg = f"ERROR|未知命令: {command}"
-                client_socket.sendall(error_msg.encode('utf-8'))
-                logger.warning(f"{client_address} 发送了未知命令: {command}")
+                        nodes = parse_nodes(json.loads(payload_str))
+                        if not nodes:
+                            raise ValueError("节点列表不能为空")
+                    except (ValueError, TypeError) as e:
+                        trace.set(status="error")
+                        client_socket.sendall(f"ERROR|无效的节点列表: {e}\n".encode('utf-8'))
+                        continue
+                    failed = ctx.cluster.update_nodes(nodes, forward=not internal)
+                    message = f"未能通知: {', '.join(failed)}" if failed else "所有节点已更新"
+                    client_socket.sendall(f"OK|{message}\n".encode('utf-8'))
+                    logger.info("%s 更新了集群节点列表: %s", client_address, ', '.join(nodes))
+
+                elif command == "SUBSCRIBE":
+                    # 此后这条连接只用于推送变更通知，返回时即连接结束；推送通道视为空闲，排空时直接关闭
+                    ctx.connections.end(client_socket)
+                    ctx.events.serve(client_socket, client_address)
+                    break
+
+                elif command == "HELLO":
+                    # 响应：OK_HELLO|json_len\n<json>，客户端据此决定是否使用内联上传等功能
+                    response_data = json.dumps(ctx.capabilities()).encode('utf-8')
+                    client_socket.sendall(f"OK_HELLO|{len(response_data)}\n".encode('utf-8') + response_data)
+
+                elif command == "PING":
+                    # 应用层心跳，客户端借此检测死连接并防止 NAT 回收空闲会话
+                    client_socket.sendall(b"PONG\n")
+
+                elif command == "STATS":
+                    # 响应：OK_STATS|json_len\n<json>
+                    response_data = json.dumps(ctx.stats()).encode('utf-8')
+                    client_socket.sendall(f"OK_STATS|{len(response_data)}\n".encode('utf-8') + response_data)
+
+                else:
+                    trace.set(status="error")
+                    error_msg = f"ERROR|未知命令: {command}\n"
+                    client_socket.sendall(error_msg.encode('utf-8'))
+                    logger.warning("%s 发送了未知命令: %s", client_address, command)
+            except Exception:
+                trace.set(status="aborted")
+                raise
+            finally:
+                trace.finish()
+                ctx.connections.end(client_socket)
 
     except socket.error as e:
-        logger.error(f"与客户端 {client_address} 通信时发生套接字错误: {e}")
+        logger.error("与客户端 %s 通信时发生套接字错误: %s", client_address, e)
     except Exception as e:
-        logger.critical(f"处理客户端 {client_address} 请求时发生意外错误: {e}")
+        logger.critical("处理客户端 %s 请求时发生意外错误: %s", client_address, e)
     finally:
-        logger.info(f"关闭与 {client_address} 的连接。")
+        logger.info("关闭与 %s 的连接。", client_address)
+        ctx.connections.remove(client_socket)
+        buffers.close()
         client_socket.close()
 
 
-def start_server(host: str, port: int, save_dir: str):
-    """启动文件服务器"""
+def build_context(args) -> ServerContext:
+    """ 根据命令行参数创建服务器共享组件 """
+    file_cache = None
+    if args.cache_size > 0:
+        file_cache = HotFileCache(args.cache_size << 20, args.cache_max_file << 20)
+    history = None
+    if args.versions > 0 and args.storage == 'flat':
+        history = VersionHistory(args.dir, args.versions, args.version_max_age * 86400)
+        removed = history.prune_all()
+        if removed:
+            logger.info(f"已按保留策略清理 {removed} 个过期的历史版本。")
+    # 接手旧进程的监听套接字时，.incoming 中可能有旧进程仍在写入的临时文件，不能清理
+    storage = create_storage(args.storage, args.dir, args.fsync, history,
+                             clean_incoming=args.inherit_fd is None)
+    cluster = None
+    if args.cluster:
+        cluster = Cluster(args.advertise or f"127.0.0.1:{args.port}", parse_nodes(args.cluster),
+                          args.replicas, args.rebalance_interval)
+    return ServerContext(
+        save_dir=args.dir,
+        storage=storage,
+        io_pool=IOPool(args.io_threads),
+        file_cache=file_cache,
+        recv_mode=args.recv_mode,
+        send_mode=args.send_mode,
+        idle_timeout=args.idle_timeout,
+        inline_max=args.inline_max << 10,
+        quota=QuotaManager(storage, args.store_quota << 20, args.client_quota << 20, args.min_free << 20),
+        tracer=Tracer(args.trace_file, args.trace_sample) if args.trace_file else None,
+        drain_timeout=args.drain_timeout,
+        index_rescan=args.index_rescan,
+        cluster=cluster,
+        buffers=BufferPool(args.chunk_size << 10),
+    )
+
+
+def start_server(host: str, port: int, ctx: ServerContext, inherit_fd: int = None, ready_fd: int = None,
+                 http_port: int = 0):
+    """
+    启动文件服务器；inherit_fd 为重启时从旧进程继承的监听套接字，此时不再 bind，
+    开始 accept 之前通过 ready_fd 通知旧进程 (见 lifecycle.py)；http_port 非 0 时同时启动 HTTP 网关
+    """
     # 1. 确保文件存储目录存在
+    save_dir = ctx.save_dir
     try:
         ensure_dir(save_dir)
     except Exception:
@@ -180,15 +776,32 @@ def start_server(host: str, port: int, save_dir: str):
         return
 
     # 2. 创建套接字并绑定
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # 设置 SO_REUSEADDR 选项，以便在服务器快速重启时可以立即重用相同的地址和端口
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
     try:
-        server_socket.bind((host, port))
-        server_socket.listen(MAX_CONNECTIONS)
-        logger.info(f"服务器已在 {host}:{port} 启动，监听中...")
-        logger.info(f"文件将保存在: {os.path.abspath(save_dir)}")
+        if inherit_fd is not None:
+            server_socket = socket.socket(fileno=inherit_fd)
+            logger.info(f"已从旧进程接手监听套接字 {server_socket.getsockname()}，监听中...")
+        else:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # 设置 SO_REUSEADDR 选项，以便在服务器快速重启时可以立即重用相同的地址和端口
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind((host, port))
+            server_socket.listen(MAX_CONNECTIONS)
+            logger.info(f"服务器已在 {host}:{port} 启动，监听中...")
+        # accept 定期超时返回，以便检查信号处理函数设置的停止请求
+        server_socket.settimeout(ACCEPT_POLL_INTERVAL)
+        if http_port:
+            ctx.http = HttpGateway(ctx, host, http_port)
+            ctx.http.start()
+            logger.info(f"HTTP 网关已在 {host}:{http_port} 启动，文件路径为 /files/<文件名>")
+        logger.info(f"文件存储: {ctx.storage.describe()}，I/O 线程数: {ctx.io.max_workers}")
+        logger.info(f"上传接收方式: {ctx.recv_mode}，下载发送方式: {ctx.send_mode}，连接空闲超时: {ctx.idle_timeout or '不限制'} 秒")
+        logger.info(f"存储配额: {ctx.quota.store_quota or '不限制'}，单客户端配额: {ctx.quota.client_quota or '不限制'}，"
+                    f"保留剩余空间: {ctx.quota.min_free} 字节")
+        if ctx.tracer.stats() is not None:
+            logger.info(f"请求追踪写入 {ctx.tracer.path}，抽样比例 {ctx.tracer.sample}")
+        if ctx.file_cache is not None:
+            logger.info(f"已启用热点文件缓存: 上限 {ctx.file_cache.max_bytes} 字节，"
+                        f"单文件不超过 {ctx.file_cache.max_file_size} 字节")
     except socket.error as e:
         logger.error(f"服务器启动失败: {e}")
         return
@@ -196,19 +809,42 @@ def start_server(host: str, port: int, save_dir: str):
         logger.error(f"服务器启动过程中发生未知错误: {e}")
         return
 
-    # 3. 循环接受客户端连接
+    # 在后台建立 SEARCH / STAT 使用的索引，首个查询最多等待这一次扫描
+    ctx.index.refresh_async()
+    if ctx.cluster is not None:
+        ctx.cluster.start(ctx)
+        logger.info(f"集群模式: 本节点 {ctx.cluster.self_node}，{len(ctx.cluster.nodes)} 个节点，"
+                    f"副本数 {ctx.cluster.replicas}")
+
+    stop = StopRequest()
+    stop.install()
+    if ready_fd is not None:
+        notify_ready(ready_fd)
+
+    # 3. 循环接受客户端连接，直到收到关闭 (SIGTERM、Ctrl + C) 或重启 (SIGHUP) 信号
     try:
         while True:
+            if stop.mode == 'restart':
+                if start_successor(server_socket):
+                    break
+                stop.mode = None
+            elif stop.mode == 'drain':
+                logger.info("收到关闭信号，服务器准备关闭...")
+                break
             try:
                 client_socket, client_address = server_socket.accept()
+                accepted_at = time.perf_counter()
                 # 为每个客户端连接创建一个新线程进行处理，使得服务器可以同时服务多个客户端
                 client_thread = threading.Thread(
                     target=handle_client_request,
-                    args=(client_socket, client_address, save_dir)
+                    args=(client_socket, client_address, ctx, accepted_at)
                 )
                 client_thread.daemon = True # 设置为守护线程，主线程退出时子线程也退出
                 client_thread.start()
 
+            except socket.timeout:
+                continue
+
             except socket.error as e:
                 # 在非阻塞模式下，accept 可能会抛出错误
                 logger.warning(f"接受连接时出错: {e}")
@@ -218,13 +854,26 @@ def start_server(host: str, port: int, save_dir: str):
                     logger.error("监听套接字已失效，服务器将停止。")
                     break
 
-            except KeyboardInterrupt:
-                logger.info("检测到 Ctrl + C，服务器准备关闭...")
-                break # 用户自己中断，跳出主循环
-    
     finally:
-        logger.info("服务器正在关闭所有连接...")
+        # 先停止 accept (重启时新进程仍持有监听套接字)，再等待进行中的请求完成
         server_socket.close()
+        if ctx.http is not None:
+            ctx.http.close()
+        logger.info(f"服务器正在排空连接，最多等待 {ctx.drain_timeout} 秒...")
+        try:
+            drain_deadline = time.monotonic() + ctx.drain_timeout
+            remaining = ctx.connections.drain(ctx.drain_timeout)
+            if ctx.http is not None:
+                remaining += ctx.http.drain(max(0.0, drain_deadline - time.monotonic()))
+            if remaining:
+                logger.warning(f"排空超时，仍有 {remaining} 个连接未结束，将被强制关闭。")
+        except KeyboardInterrupt:
+            logger.warning("再次检测到 Ctrl + C，放弃排空，立即关闭。")
+        ctx.multipart.abort_all()
+        ctx.io.shutdown()
+        ctx.tracer.close()
+        if ctx.file_cache is not None:
+            logger.info(f"热点文件缓存统计: {ctx.file_cache.stats()}")
         logger.info("服务器已成功关闭。")
         # 确保所有日志都已写入文件
         logging.shutdown()
@@ -253,7 +902,204 @@ if __name__ == "__main__":
         help=f"文件存储和读取的目录 (默认: {DEFAULT_SAVE_DIR})"
     )
 
+    parser.add_argument(
+        "--storage",
+        choices=STORAGE_TYPES,
+        default='flat',
+        help="存储后端: flat 为平铺目录，memory 为内存 (仅用于测试和压测) (默认: flat)"
+    )
+
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default=DEFAULT_FSYNC_POLICY,
+        help=f"上传提交前的刷盘策略: none 不刷盘，data 刷新数据，full 刷新数据和目录 (默认: {DEFAULT_FSYNC_POLICY})"
+    )
+
+    parser.add_argument(
+        "--versions",
+        type=int,
+        default=0,
+        help=f"覆盖文件时保留的历史版本数，0 表示不保留，只支持 flat 存储 (建议: {DEFAULT_KEEP}，默认: 0)"
+    )
+
+    parser.add_argument(
+        "--version-max-age",
+        type=float,
+        default=0,
+        help="历史版本的保留天数，0 表示只按个数清理 (默认: 0)"
+    )
+
+    parser.add_argument(
+        "--inline-max",
+        type=int,
+        default=DEFAULT_INLINE_MAX >> 10,
+        help=f"内联上传的文件大小上限，KB，0 表示禁用 (默认: {DEFAULT_INLINE_MAX >> 10})"
+    )
+
+    parser.add_argument(
+        "--store-quota",
+        type=int,
+        default=0,
+        help="存储中所有文件的总大小上限，MB (默认: 0，即不限制)"
+    )
+
+    parser.add_argument(
+        "--client-quota",
+        type=int,
+        default=0,
+        help="单个客户端 (按 IP) 同时进行中的上传总大小上限，MB (默认: 0，即不限制)"
+    )
+
+    parser.add_argument(
+        "--min-free",
+        type=int,
+        default=DEFAULT_MIN_FREE >> 20,
+        help=f"磁盘至少保留的剩余空间，MB，剩余空间不足时拒绝上传 (默认: {DEFAULT_MIN_FREE >> 20})"
+    )
+
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help=f"客户端连接空闲超时，秒，0 表示不限制 (默认: {DEFAULT_IDLE_TIMEOUT})"
+    )
+
+    parser.add_argument(
+        "--trace-file",
+        type=str,
+        default=None,
+        help="把每个请求的分阶段耗时以 JSONL 格式追加到该文件 (默认: 不记录)"
+    )
+
+    parser.add_argument(
+        "--trace-sample",
+        type=float,
+        default=1.0,
+        help="追踪的请求抽样比例，0~1 (默认: 1，即全部记录)"
+    )
+
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=DEFAULT_DRAIN_TIMEOUT,
+        help=f"关闭或重启时等待进行中请求完成的最长时间，秒 (默认: {DEFAULT_DRAIN_TIMEOUT})"
+    )
+
+    parser.add_argument(
+        "--cluster",
+        type=str,
+        default=None,
+        help="以集群模式运行，集群中所有节点的地址 (含本节点)，例如 127.0.0.1:7001,127.0.0.1:7002"
+    )
+
+    parser.add_argument(
+        "--advertise",
+        type=str,
+        default=None,
+        help="本节点在 --cluster 列表中的地址 (默认: 127.0.0.1:端口)"
+    )
+
+    parser.add_argument(
+        "--replicas",
+        type=int,
+        default=DEFAULT_REPLICAS,
+        help=f"集群模式下每个文件保存的副本数 (默认: {DEFAULT_REPLICAS})"
+    )
+
+    parser.add_argument(
+        "--rebalance-interval",
+        type=float,
+        default=DEFAULT_REBALANCE_INTERVAL,
+        help=f"集群模式下定期检查副本的间隔，秒；0 表示只在启动和成员变更时检查 (默认: {DEFAULT_REBALANCE_INTERVAL})"
+    )
+
+    parser.add_argument(
+        "--inherit-fd",
+        type=int,
+        default=None,
+        help="使用继承来的已监听套接字而不是重新绑定端口，由 SIGHUP 平滑重启时自动传入"
+    )
+
+    parser.add_argument(
+        "--ready-fd",
+        type=int,
+        default=None,
+        help=argparse.SUPPRESS
+    )
+
+    parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=DEFAULT_IO_THREADS,
+        help=f"磁盘操作线程池大小，0 表示在连接线程中直接执行 (默认: {DEFAULT_IO_THREADS})"
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=0,
+        help="热点文件内存缓存的总大小，MB (默认: 0，即不启用)"
+    )
+
+    parser.add_argument(
+        "--cache-max-file",
+        type=int,
+        default=DEFAULT_MAX_FILE_SIZE >> 20,
+        help=f"可放入热点缓存的单个文件上限，MB (默认: {DEFAULT_MAX_FILE_SIZE >> 20})"
+    )
+
+    parser.add_argument(
+        "--recv-mode",
+        choices=RECV_MODES,
+        default=DEFAULT_RECV_MODE,
+        help=f"上传数据的接收方式 (默认: {DEFAULT_RECV_MODE})"
+    )
+
+    parser.add_argument(
+        "--index-rescan",
+        type=float,
+        default=DEFAULT_RESCAN_INTERVAL,
+        help=f"SEARCH/STAT 索引重新扫描存储的间隔，秒；0 表示只在启动时扫描 (默认: {DEFAULT_RESCAN_INTERVAL})"
+    )
+
+    parser.add_argument(
+        "--send-mode",
+        choices=SEND_MODES,
+        default=DEFAULT_SEND_MODE,
+        help=f"下载数据的发送方式，readahead 在独立线程中预读 (默认: {DEFAULT_SEND_MODE})"
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE >> 10,
+        help=f"每个连接复用的传输缓冲区大小，KB，即上传接收和稀疏传输的单次数据块 (默认: {DEFAULT_CHUNK_SIZE >> 10})"
+    )
+
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        default=0,
+        help="HTTP/1.1 网关的端口，浏览器和 curl 可通过 /files/<文件名> 下载和上传；0 表示不启用 (默认: 0)"
+    )
+
+    parser.add_argument(
+        "--log-level",
+        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+        default='INFO',
+        help="日志级别，DEBUG 会记录每条原始请求 (默认: INFO)"
+    )
+
     args = parser.parse_args()
+    logger.setLevel(args.log_level)
+    if args.chunk_size <= 0:
+        parser.error("--chunk-size 必须大于 0")
+    if args.cluster:
+        try:
+            parse_nodes(args.cluster)
+        except ValueError as e:
+            parser.error(str(e))
 
     # 启动服务器
-    start_server(args.host, args.port, args.dir) 
\ No newline at end of file
+    start_server(args.host, args.port, build_context(args), args.inherit_fd, args.ready_fd, args.http_port) 
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+稀疏文件传输
+
+虚拟机镜像、数据库文件等大部分是空洞，普通传输逐字节读出、发送并稠密地写入这些零。
+稀疏传输用 lseek(SEEK_DATA/SEEK_HOLE) 找出有数据的区段，只发送区段表和区段数据，
+接收方按偏移写入区段，再把文件截断到完整大小，空洞保持为空洞:
+
+    DOWNLOAD_SPARSE|filename                    -> OK_SPARSE|filesize|etag|map_len\n<区段数据>
+                                                   (文件没有空洞时回复普通的 OK_DOWNLOAD|filesize|etag)
+    UPLOAD_SPARSE|filename|filesize|map_len     -> READY_TO_RECEIVE\n，发送区段数据后 -> OK|msg\n
+    UPDATE_SPARSE|filename|filesize|map_len
+
+区段数据依次为: map_len 字节的区段表 JSON [[offset, length], ...] (按偏移升序、互不重叠)，
+各区段的内容按表中顺序首尾相接，最后是 64 字节十六进制 SHA-256，覆盖区段表和全部区段内容，
+接收方据此校验区段表和数据都没有出错。
+不支持 SEEK_DATA 的平台或没有文件描述符的存储 (内存后端) 把整个文件当作一个区段。
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import socket
+
+from tracing import NULL_TRACE
+
+CHUNK_SIZE = 1 << 20
+DIGEST_SIZE = 64                    # 十六进制 SHA-256 的长度
+
+logger = logging.getLogger('server_logger')
+
+
+def data_extents(f, size: int) -> list:
+    """ 返回文件中有数据的区段 [(offset, length), ...]，会移动文件指针 """
+    dense = [(0, size)] if size else []
+    try:
+        fd = f.fileno()
+    except (AttributeError, OSError, ValueError):
+        return dense
+    if not hasattr(os, 'SEEK_DATA'):
+        return dense
+    extents = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:      # offset 之后只剩空洞
+                    break
+                raise
+            if start >= size:
+                break
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            extents.append((start, end - start))
+            offset = end
+    except OSError:
+        return dense                # 文件系统不支持，按稠密文件处理
+    return extents
+
+
+def is_sparse(extents: list, size: int) -> bool:
+    return extents != ([(0, size)] if size else [])
+
+
+def encode_map(extents: list) -> bytes:
+    return json.dumps(extents, separators=(',', ':')).encode('utf-8')
+
+
+def send_sparse(sock: socket.socket, f, map_data: bytes, extents: list, trace=NULL_TRACE,
+                buffer: bytearray = None, io=None) -> int:
+    """
+    发送区段表、各区段内容和校验值，返回发送的区段字节数；buffer 为复用的读缓冲区，
+    给出 io (storage.IOPool) 时读盘在 I/O 线程池中进行
+    """
+    digest = hashlib.sha256(map_data)
+    with trace.span('net_send'):
+        sock.sendall(map_data)
+    view = memoryview(buffer or bytearray(CHUNK_SIZE))
+    sent = 0
+    for offset, length in extents:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            with trace.span('disk_read'):
+                chunk = view[:min(len(view), remaining)]
+                n = io.run(f.readinto, chunk) if io is not None else f.readinto(chunk)
+            if not n:
+                raise OSError(f"文件在发送过程中变短 (偏移 {offset + length - remaining})")
+            chunk = view[:n]
+            digest.update(chunk)
+            with trace.span('net_send'):
+                sock.sendall(chunk)
+            remaining -= n
+            sent += n
+    sock.sendall(digest.hexdigest().encode('ascii'))
+    return sent
+
+
+def parse_map(map_data: bytes, size: int) -> list:
+    """ 解析并检查区段表，区段必须按偏移升序、互不重叠且不超出文件大小 """
+    extents = json.loads(map_data.decode('utf-8'))
+    end = 0
+    result = []
+    for offset, length in extents:
+        offset, length = int(offset), int(length)
+        if offset < end or length <= 0 or offset + length > size:
+            raise ValueError(f"无效的区段: ({offset}, {length})")
+        result.append((offset, length))
+        end = offset + length
+    return result
+
+
+def _extend(f, size: int):
+    """ 把文件扩展到 size 字节，末尾的空洞不分配磁盘空间 """
+    try:
+        os.ftruncate(f.fileno(), size)
+    except (AttributeError, OSError, ValueError):
+        # 内存文件 (BytesIO) 的 truncate 不能扩展，直接补零
+        f.seek(0, os.SEEK_END)
+        if f.tell() < size:
+            f.write(bytes(size - f.tell()))
+
+
+def receive_sparse(reader, pending, size: int, map_len: int, trace=NULL_TRACE, buffer: bytearray = None):
+    """
+    接收区段表和区段内容写入 pending，最后截断到 size 字节，buffer 为复用的接收缓冲区
+
+    返回收到的区段字节数；对端提前关闭或区段表无效 (无法确定后续数据的长度) 时
+    返回 None，调用方应关闭连接。校验失败时抛出 ValueError，此时数据已全部读完，
+    连接仍可继续使用。
+    """
+    with trace.span('net_recv'):
+        map_data = reader.read_exact(map_len)
+    if len(map_data) < map_len:
+        return None
+    digest = hashlib.sha256(map_data)
+    try:
+        extents = parse_map(map_data, size)
+    except (ValueError, TypeError) as e:
+        logger.error(f"稀疏上传 '{pending.name}' 的区段表无效: {e}")
+        return None
+
+    view = memoryview(buffer or bytearray(CHUNK_SIZE))
+    received = 0
+    for offset, length in extents:
+        done = 0
+        while done < length:
+            want = min(len(view), length - done)
+            chunk = view[:want]
+            with trace.span('net_recv'):
+                n = reader.read_into(chunk)
+            if n < want:
+                return None
+            digest.update(chunk)
+            with trace.span('disk_write'):
+                pending.write_at(offset + done, chunk)
+            done += want
+        received += length
+
+    expected = reader.read_exact(DIGEST_SIZE)
+    if len(expected) < DIGEST_SIZE:
+        return None
+    with trace.span('disk_write'):
+        _extend(pending.file, size)
+    if expected.decode('ascii', 'replace') != digest.hexdigest():
+        raise ValueError("稀疏文件校验失败")
+    return received
@@ -0,0 +1,424 @@
+"""
+存储后端
+
+把文件的列出、查询、读取、写入、提交和删除抽象成 StorageBackend 接口，
+服务器的请求处理只通过这个接口访问文件:
+
+    FlatDirectoryStorage  现有的平铺目录布局 (默认)
+    MemoryStorage         全部保存在内存中，用于测试和压测，排除磁盘的影响
+
+写入分两步: open_write() 返回一个 PendingWrite，数据写入 PendingWrite.file，
+完整收到后调用 commit() 发布，失败时调用 abort() 丢弃。平铺目录后端把数据先写到
+临时文件，commit 时用原子 rename 替换目标，正在下载旧版本的读者继续读取自己
+打开的那份快照，读路径上不需要任何锁。commit 前的刷盘策略 (--fsync):
+
+    none  不主动刷盘，吞吐最高，掉电可能丢失最近写入的文件
+    data  fdatasync 刷新文件数据，rename 之后文件内容一定完整
+    full  fsync 文件并在 rename 后 fsync 目录，rename 本身也持久化
+
+IOPool 是一个有界的 I/O 线程池，元数据操作、打开/提交/删除文件以及下载的读盘
+(readahead.send_from_file、稀疏下载、热点缓存的载入) 都在池中执行，限制同时访问磁盘的
+线程数，磁盘变慢时排队的是池中的任务，而不是无限多的并发系统调用。上传的数据写入仍在
+连接线程中进行: 写入先落到页缓存 (刷盘在 commit 中，已经在池中)，splice/mmap 接收方式
+的数据在内核中直接进入文件，逐块切换线程只会增加开销。
+
+IOPool.run() 会等待结果，调用它的连接线程在磁盘操作期间仍然阻塞，只是不再和其他连接
+争抢磁盘；要让网络收发和磁盘操作真正重叠，需要用 submit() 在等待结果之前先做别的事
+(例如下载的预读和 http_gateway 的上传)。
+"""
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from stat import S_ISREG
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+STORAGE_TYPES = ('flat', 'memory')
+FSYNC_POLICIES = ('none', 'data', 'full')
+DEFAULT_FSYNC_POLICY = 'none'
+DEFAULT_IO_THREADS = 8
+INCOMING_DIR = '.incoming'          # 平铺目录中存放未提交上传的子目录
+
+logger = logging.getLogger('server_logger')
+
+# mkstemp 创建的临时文件权限为 0600，提交前按进程 umask 恢复普通文件的权限
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+# 文件元数据: 名称、字节数、纳秒级修改时间
+FileInfo = namedtuple('FileInfo', ['name', 'size', 'mtime_ns'])
+
+
+def file_etag(info: FileInfo) -> str:
+    """ 由文件大小和纳秒级修改时间生成版本校验值 (ETag) """
+    return f"{info.size:x}-{info.mtime_ns:x}"
+
+
+def validate_name(name: str):
+    """ 文件按名称平铺存储，拒绝空名、路径分隔符和特殊目录名 """
+    if not name or name in ('.', '..') or '/' in name or '\\' in name or '\0' in name:
+        raise ValueError(f"无效的文件名: '{name}'")
+
+
+class PendingWrite:
+    """ 尚未提交的写入: 数据写入 file，commit 后才对读者可见 """
+
+    def __init__(self, name: str, file, path: str = None):
+        self.name = name
+        self.file = file
+        self.path = path        # 临时文件路径 (内存后端为 None)
+        self.target = None      # 提交后的目标路径
+        self.mtime_ns = None    # 提交后的修改时间，None 为提交时刻；集群复制时沿用源文件的，各副本 ETag 一致
+        self._lock = threading.Lock()
+
+    def write_at(self, offset: int, data):
+        """ 在 offset 处写入 data，分片上传时多个连接线程并发调用 """
+        try:
+            fd = self.file.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd is not None and hasattr(os, 'pwrite'):
+            # pwrite 不移动文件指针，各线程互不干扰，无需加锁
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view = view[written:]
+                offset += written
+            return
+        with self._lock:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def reserve(self, size: int) -> bool:
+        """ 把文件扩展到 size 字节，之后各分片可按任意顺序写入；磁盘空间已实际分配时返回 True """
+        try:
+            fd = self.file.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd is not None and size > 0 and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, size)
+                return True
+            except OSError:
+                pass
+        with self._lock:
+            self.file.truncate(size)
+        return False
+
+
+class StorageBackend:
+    """ 存储后端接口 """
+    versioned = False       # 是否保留被覆盖的旧版本，见 versions.VersionHistory
+
+    def list(self) -> list:
+        """ 返回所有文件的 FileInfo 列表 """
+        raise NotImplementedError
+
+    def stat(self, name: str):
+        """ 返回文件的 FileInfo，不存在时返回 None """
+        raise NotImplementedError
+
+    def open_read(self, name: str):
+        """ 打开文件用于读取，返回 (文件对象, FileInfo)；不存在时抛出 FileNotFoundError """
+        raise NotImplementedError
+
+    def open_write(self, name: str) -> PendingWrite:
+        raise NotImplementedError
+
+    def commit(self, pending: PendingWrite) -> FileInfo:
+        raise NotImplementedError
+
+    def abort(self, pending: PendingWrite):
+        raise NotImplementedError
+
+    def delete(self, name: str) -> bool:
+        """ 删除文件，返回文件原先是否存在 """
+        raise NotImplementedError
+
+    def delete_if_unchanged(self, name: str, info: FileInfo) -> bool:
+        """ 文件仍是 info 描述的版本时删除，返回是否删除；比较和删除之间不会插入提交 """
+        raise NotImplementedError
+
+    def free_space(self):
+        """ 可用于新文件的剩余字节数，无法确定时返回 None (不做磁盘空间检查) """
+        return None
+
+    def list_versions(self, name: str) -> list:
+        """ 返回文件历史版本的 VersionInfo 列表，从新到旧 """
+        return []
+
+    def open_version(self, name: str, version: str):
+        """ 打开历史版本用于读取，返回 (文件对象, FileInfo)；不存在时抛出 FileNotFoundError """
+        raise FileNotFoundError(f"{name}@{version}")
+
+    def describe(self) -> str:
+        return self.__class__.__name__
+
+
+class FlatDirectoryStorage(StorageBackend):
+    """ 所有文件平铺在一个目录中，上传先写入 .incoming 子目录再原子替换 """
+
+    def __init__(self, root: str, fsync_policy: str = DEFAULT_FSYNC_POLICY, history=None,
+                 clean_incoming: bool = True):
+        self.root = root
+        self.fsync_policy = fsync_policy
+        self.incoming_dir = os.path.join(root, INCOMING_DIR)
+        self.history = history          # VersionHistory，不保留旧版本时为 None
+        self.versioned = history is not None
+        # 提交时的 rename 都在这个锁内进行: 保存旧版本和 rename 必须成对完成，否则并发提交的
+        # 中间版本可能没被保存；delete_if_unchanged 的比较和删除之间也不能插入提交
+        self._replace_lock = threading.Lock()
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        if clean_incoming:
+            self._cleanup_incoming()
+
+    def _cleanup_incoming(self):
+        """ 清理上次运行中断后残留的临时文件 """
+        for entry in os.scandir(self.incoming_dir):
+            if entry.is_file() and entry.name.endswith('.part'):
+                try:
+                    os.remove(entry.path)
+                    logger.info(f"已清理残留的临时文件: {entry.name}")
+                except OSError:
+                    pass
+
+    def _path(self, name: str) -> str:
+        validate_name(name)
+        return os.path.join(self.root, name)
+
+    def describe(self) -> str:
+        versions = f"，{self.history.describe()}" if self.history is not None else ""
+        return f"目录 {os.path.abspath(self.root)} (fsync: {self.fsync_policy}{versions})"
+
+    def free_space(self):
+        # 临时文件写在 .incoming 中，与目标在同一文件系统；f_bavail 不含 root 保留块
+        if not hasattr(os, 'statvfs'):
+            return shutil.disk_usage(self.incoming_dir).free
+        st = os.statvfs(self.incoming_dir)
+        return st.f_bavail * st.f_frsize
+
+    def list(self) -> list:
+        files = []
+        # scandir 每个条目只需一次 stat，比 listdir + isfile + getsize 少两次系统调用
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append(FileInfo(entry.name, stat.st_size, stat.st_mtime_ns))
+        return files
+
+    def stat(self, name: str):
+        try:
+            stat = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        return FileInfo(name, stat.st_size, stat.st_mtime_ns)
+
+    def open_read(self, name: str):
+        path = self._path(name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(name)
+        f = open(path, 'rb')
+        # 以打开后的 fstat 为准，保证元数据和读到的内容对应同一版本
+        stat = os.fstat(f.fileno())
+        return f, FileInfo(name, stat.st_size, stat.st_mtime_ns)
+
+    def open_write(self, name: str) -> PendingWrite:
+        path = self._path(name)
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self.incoming_dir)
+        if hasattr(os, 'fchmod'):
+            os.fchmod(fd, 0o666 & ~_UMASK)
+        # 以读写方式打开，mmap 接收方式需要可读的文件描述符
+        pending = PendingWrite(name, os.fdopen(fd, 'w+b'), tmp_path)
+        pending.target = path
+        return pending
+
+    def commit(self, pending: PendingWrite) -> FileInfo:
+        f = pending.file
+        try:
+            f.flush()
+            if self.fsync_policy == 'data':
+                _fdatasync(f.fileno())
+            elif self.fsync_policy == 'full':
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+        if pending.mtime_ns is not None:
+            os.utime(pending.path, ns=(pending.mtime_ns, pending.mtime_ns))
+        with self._replace_lock:
+            if self.history is not None:
+                self.history.preserve(pending.name, pending.target)
+            os.replace(pending.path, pending.target)
+        if self.history is not None:
+            self.history.prune(pending.name)
+        if self.fsync_policy == 'full':
+            _fsync_dir(self.root)
+        stat = os.stat(pending.target)
+        return FileInfo(pending.name, stat.st_size, stat.st_mtime_ns)
+
+    def abort(self, pending: PendingWrite):
+        pending.file.close()
+        try:
+            os.remove(pending.path)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, name: str) -> bool:
+        path = self._path(name)
+        try:
+            if self.history is None:
+                os.remove(path)
+            else:
+                with self._replace_lock:
+                    self.history.preserve(name, path)
+                    os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete_if_unchanged(self, name: str, info: FileInfo) -> bool:
+        path = self._path(name)
+        with self._replace_lock:
+            if self.stat(name) != info:
+                return False
+            try:
+                if self.history is not None:
+                    self.history.preserve(name, path)
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def list_versions(self, name: str) -> list:
+        return self.history.list(name) if self.history is not None else []
+
+    def open_version(self, name: str, version: str):
+        if self.history is None:
+            raise FileNotFoundError(f"{name}@{version}")
+        return self.history.open(name, version)
+
+
+def _fdatasync(fd: int):
+    if hasattr(os, 'fdatasync'):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+
+def _fsync_dir(path: str):
+    """ 持久化目录项 (rename 结果)；Windows 不支持打开目录，直接跳过 """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class MemoryStorage(StorageBackend):
+    """ 文件内容保存在内存中的存储后端 """
+
+    def __init__(self):
+        self._files = {}            # 文件名 -> (bytes, mtime_ns)
+        self._lock = threading.Lock()
+
+    def describe(self) -> str:
+        return "内存"
+
+    def list(self) -> list:
+        with self._lock:
+            return [FileInfo(name, len(data), mtime_ns) for name, (data, mtime_ns) in self._files.items()]
+
+    def stat(self, name: str):
+        with self._lock:
+            entry = self._files.get(name)
+        return FileInfo(name, len(entry[0]), entry[1]) if entry else None
+
+    def open_read(self, name: str):
+        with self._lock:
+            entry = self._files.get(name)
+        if entry is None:
+            raise FileNotFoundError(name)
+        data, mtime_ns = entry
+        return io.BytesIO(data), FileInfo(name, len(data), mtime_ns)
+
+    def open_write(self, name: str) -> PendingWrite:
+        validate_name(name)
+        return PendingWrite(name, io.BytesIO())
+
+    def commit(self, pending: PendingWrite) -> FileInfo:
+        data = pending.file.getvalue()
+        pending.file.close()
+        mtime_ns = pending.mtime_ns if pending.mtime_ns is not None else time.time_ns()
+        with self._lock:
+            self._files[pending.name] = (data, mtime_ns)
+        return FileInfo(pending.name, len(data), mtime_ns)
+
+    def abort(self, pending: PendingWrite):
+        pending.file.close()
+
+    def delete(self, name: str) -> bool:
+        with self._lock:
+            return self._files.pop(name, None) is not None
+
+    def delete_if_unchanged(self, name: str, info: FileInfo) -> bool:
+        with self._lock:
+            entry = self._files.get(name)
+            if entry is None or FileInfo(name, len(entry[0]), entry[1]) != info:
+                return False
+            del self._files[name]
+            return True
+
+
+def create_storage(storage_type: str, save_dir: str, fsync_policy: str = DEFAULT_FSYNC_POLICY,
+                   history=None, clean_incoming: bool = True) -> StorageBackend:
+    """
+    history 为 VersionHistory 时保留被覆盖的旧版本，只有平铺目录后端支持；
+    clean_incoming 为 False 时保留 .incoming 中的临时文件 (平滑重启时旧进程仍在写入)
+    """
+    if storage_type == 'memory':
+        return MemoryStorage()
+    return FlatDirectoryStorage(save_dir, fsync_policy, history, clean_incoming)
+
+
+class IOPool:
+    """ 有界 I/O 线程池；max_workers 为 0 时直接在调用线程中执行 """
+
+    def __init__(self, max_workers: int = DEFAULT_IO_THREADS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='io') if max_workers > 0 else None
+
+    def submit(self, fn, *args) -> Future:
+        """ 提交到线程池，返回 Future；未启用线程池时同步执行并返回已完成的 Future """
+        if self._executor is not None:
+            return self._executor.submit(fn, *args)
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run(self, fn, *args):
+        """
+        在线程池中执行 fn(*args) 并等待结果，异常原样抛出
+
+        调用线程会一直等到 fn 完成，得到的只是并发数的上限，不是与调用线程的重叠
+        """
+        if self._executor is None:
+            return fn(*args)
+        return self._executor.submit(fn, *args).result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
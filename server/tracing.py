@@ -0,0 +1,175 @@
+"""
+请求级追踪
+
+用 --trace-file 启动服务器后，每处理完一个请求就写一行 JSON，记录该请求各阶段的耗时:
+
+    {"ts": 开始时间 (Unix 秒), "conn": 连接序号, "seq": 连接内的请求序号, "client": 客户端 IP,
+     "cmd": 命令, "name": 文件名, "bytes": 传输的数据体字节数, "status": "ok" | "error" | "aborted",
+     "total_ms": 总耗时, "spans": {阶段名: 累计毫秒}}
+
+阶段名:
+    accept                  连接被 accept 到处理线程开始运行 (只记在连接的第一个请求上)
+    parse                   解析命令参数
+    stat / open / commit / list / quota
+                            元数据查询、打开、提交、列目录和空间预检 (含 I/O 线程池排队)
+    disk_read / disk_write  文件读写
+    net_send / net_recv     套接字发送 (包括等待对端接收窗口的背压) / 接收；splice 模式下
+                            套接字到管道计为 net_recv，管道到文件计为 disk_write
+    proxy                   集群模式下本节点没有请求的文件，转发给所有者下载的全过程
+    disk_wait               readahead 发送方式下等待预读交出数据的时间；此时 disk_read
+                            在 I/O 线程池中与 net_send 重叠，各阶段之和可能超过总耗时
+
+同一阶段在一个请求中出现多次 (例如按块读写) 时累加。--trace-sample 按比例抽样请求。
+记录由后台线程写入文件，队列满时丢弃并计数，不会阻塞请求处理。
+未启用时使用 NULL_TRACER，各处的计时调用都是空操作。
+"""
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+
+DEFAULT_QUEUE_SIZE = 10000                 # 等待写入文件的记录数上限
+
+
+class _Span:
+    """ 计时上下文，退出时把耗时累加到所属请求 """
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class RequestTrace:
+    """ 一个请求的追踪记录 """
+    enabled = True
+
+    def __init__(self, tracer, conn: int, seq: int, client: str, command: str):
+        self.tracer = tracer
+        self.record = {"ts": time.time(), "conn": conn, "seq": seq, "client": client,
+                       "cmd": command, "name": None, "bytes": 0, "status": "ok"}
+        self.spans = {}
+        self._start = time.perf_counter()
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def set(self, **fields):
+        """ 补充文件名、字节数、状态等字段 """
+        self.record.update(fields)
+
+    def finish(self):
+        record = self.record
+        record["total_ms"] = round((time.perf_counter() - self._start) * 1000, 3)
+        record["spans"] = {k: round(v * 1000, 3) for k, v in self.spans.items()}
+        self.tracer.write(record)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _NullTrace:
+    """ 未启用或未被抽中时使用，所有方法都是空操作 """
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name):
+        return self._span
+
+    def add(self, name, seconds):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Tracer:
+    """ 把请求追踪记录以 JSONL 格式写入文件 """
+
+    def __init__(self, path: str, sample: float = 1.0, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.path = path
+        self.sample = sample
+        self.written = 0
+        self.dropped = 0
+        self._connections = itertools.count(1)
+        self._queue = queue.Queue(queue_size)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._writer = threading.Thread(target=self._write_loop, name='trace-writer', daemon=True)
+        self._writer.start()
+
+    def connection(self) -> int:
+        """ 为新连接分配序号 """
+        return next(self._connections)
+
+    def begin(self, conn: int, seq: int, client: str, command: str):
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return NULL_TRACE
+        return RequestTrace(self, conn, seq, client, command)
+
+    def write(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.written += 1
+            # 队列暂时为空时刷新，突发请求时合并写入
+            if self._queue.empty():
+                self._file.flush()
+        self._file.close()
+
+    def stats(self) -> dict:
+        return {"path": self.path, "written": self.written, "dropped": self.dropped}
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+
+
+class _NullTracer:
+    def connection(self) -> int:
+        return 0
+
+    def begin(self, conn, seq, client, command):
+        return NULL_TRACE
+
+    def stats(self):
+        return None
+
+    def close(self):
+        pass
+
+
+NULL_TRACER = _NullTracer()
@@ -0,0 +1,221 @@
+"""
+上传数据的接收路径
+
+原来的上传循环每 4KB 调用一次 recv() 得到新的 bytes 对象再 f.write()，
+每块数据都要一次分配和一次拷贝。这里提供几种接收方式 (--recv-mode):
+
+    copy       原始实现: recv() + write()，保留用于对比
+    recv_into  recv_into() 到一个可复用的缓冲区，再 os.write() 到文件
+    mmap       把目标文件映射到内存，recv_into() 直接写入映射区域 (文件需以读写方式打开)
+    splice     Linux 专用: os.splice() 经管道把数据从套接字搬到文件，不经过用户态
+
+除 copy 外都会先按客户端声明的 filesize 用 posix_fallocate 预分配磁盘空间。
+文件对象没有 fileno() (例如内存存储) 时自动退回 recv_into + write。
+分片上传的每个分片由 receive_part() 接收，按偏移 pwrite 到同一个临时文件。
+recv_into 和分片接收可以传入连接租用的缓冲区 (buffers.ConnectionBuffers)，不传时每次传输分配一块。
+传入 trace 时把套接字接收和文件写入的耗时分别记为 net_recv 和 disk_write。
+"""
+import hashlib
+import logging
+import mmap
+import os
+import select
+import socket
+import sys
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+
+from tracing import NULL_TRACE
+
+RECV_MODES = ('copy', 'recv_into', 'mmap', 'splice')
+SPLICE_AVAILABLE = sys.platform.startswith('linux') and hasattr(os, 'splice')
+DEFAULT_RECV_MODE = 'splice' if SPLICE_AVAILABLE else 'recv_into'
+DEFAULT_CHUNK_SIZE = 65536
+LEGACY_CHUNK_SIZE = 4096            # copy 模式沿用原实现的 4KB 块
+SPLICE_CHUNK_SIZE = 1 << 20
+
+logger = logging.getLogger('server_logger')
+
+
+def _fileno(f):
+    try:
+        return f.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def preallocate(f, size: int) -> bool:
+    """ 为即将写入的 size 字节预分配磁盘空间，文件系统不支持时静默跳过 """
+    fd = _fileno(f)
+    if fd is None or size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+        return True
+    except OSError as e:
+        logger.debug(f"posix_fallocate 不可用，跳过预分配: {e}")
+        return False
+
+
+def receive_to_file(sock: socket.socket, f, size: int, mode: str = DEFAULT_RECV_MODE,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE, initial: bytes = b'', trace=NULL_TRACE,
+                    buffer: bytearray = None) -> int:
+    """
+    从 sock 接收 size 字节写入已打开的文件 f，返回实际收到的字节数
+
+    initial 是命令读取器缓冲区中已经收到的数据体开头部分，先写入文件。
+    buffer 是 recv_into 复用的缓冲区，给出时忽略 chunk_size。
+    对端提前关闭连接时返回值小于 size，由调用方决定如何清理。
+    """
+    fd = _fileno(f)
+    if mode == 'copy':
+        f.write(initial)
+        return len(initial) + _receive_copy(sock, f, size - len(initial), LEGACY_CHUNK_SIZE, trace)
+    if fd is None:
+        f.write(initial)
+        return len(initial) + _receive_recv_into(sock, f, None, size - len(initial),
+                                                 buffer or bytearray(chunk_size), trace)
+
+    f.flush()
+    with trace.span('disk_write'):
+        preallocate(f, size)
+        if initial:
+            _write_all(fd, memoryview(initial))
+    remaining = size - len(initial)
+    if mode == 'splice' and SPLICE_AVAILABLE:
+        return len(initial) + _receive_splice(sock, fd, remaining, trace)
+    if mode == 'mmap' and size > 0 and not initial:
+        # 映射从文件开头写起，已有开头数据时退回 recv_into
+        return _receive_mmap(sock, fd, size, trace)
+    return len(initial) + _receive_recv_into(sock, f, fd, remaining, buffer or bytearray(chunk_size), trace)
+
+
+def _receive_copy(sock, f, size, chunk_size, trace):
+    """ 原始实现: 每块 recv() 一个新的 bytes 再写入 """
+    received = 0
+    while received < size:
+        with trace.span('net_recv'):
+            chunk = sock.recv(min(chunk_size, size - received))
+        if not chunk:
+            break
+        with trace.span('disk_write'):
+            f.write(chunk)
+        received += len(chunk)
+    return received
+
+
+def _write_all(fd, view):
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _receive_recv_into(sock, f, fd, size, buf, trace):
+    view = memoryview(buf)
+    chunk_size = len(buf)
+    received = 0
+    while received < size:
+        with trace.span('net_recv'):
+            n = sock.recv_into(view, min(chunk_size, size - received))
+        if n == 0:
+            break
+        with trace.span('disk_write'):
+            if fd is not None:
+                _write_all(fd, view[:n])
+            else:
+                f.write(view[:n])
+        received += n
+    return received
+
+
+def _receive_mmap(sock, fd, size, trace):
+    # 预分配可能失败，先保证文件长度足够映射
+    if os.fstat(fd).st_size < size:
+        os.ftruncate(fd, size)
+    received = 0
+    with mmap.mmap(fd, size, access=mmap.ACCESS_WRITE) as mapped:
+        view = memoryview(mapped)
+        try:
+            while received < size:
+                # 数据直接落入映射区域，缺页和写回都计在接收里
+                with trace.span('net_recv'):
+                    n = sock.recv_into(view[received:])
+                if n == 0:
+                    break
+                received += n
+        finally:
+            view.release()
+    if received < size:
+        os.ftruncate(fd, received)
+    os.lseek(fd, received, os.SEEK_SET)
+    return received
+
+
+def _wait_readable(sock):
+    """ 套接字设置了超时 (内部为非阻塞) 时，splice 前等待数据到达 """
+    timeout = sock.gettimeout()
+    ready, _, _ = select.select([sock], [], [], timeout)
+    if not ready:
+        raise socket.timeout("接收上传数据超时")
+
+
+def _receive_splice(sock, fd, size, trace):
+    sock_fd = sock.fileno()
+    read_end, write_end = os.pipe()
+    try:
+        # 默认管道容量只有 64KB，调大后每次 splice 能搬运更多数据
+        fcntl.fcntl(write_end, fcntl.F_SETPIPE_SZ, SPLICE_CHUNK_SIZE)
+    except (AttributeError, OSError):
+        pass
+    received = 0
+    try:
+        while received < size:
+            try:
+                with trace.span('net_recv'):
+                    n = os.splice(sock_fd, write_end, min(SPLICE_CHUNK_SIZE, size - received))
+            except BlockingIOError:
+                with trace.span('net_recv'):
+                    _wait_readable(sock)
+                continue
+            if n == 0:
+                break
+            # 把管道中的数据全部搬到文件
+            pending = n
+            with trace.span('disk_write'):
+                while pending:
+                    pending -= os.splice(read_end, fd, pending)
+            received += n
+    finally:
+        os.close(read_end)
+        os.close(write_end)
+    return received
+
+
+def receive_part(sock: socket.socket, pending, offset: int, length: int,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, initial: bytes = b'', trace=NULL_TRACE,
+                 buffer: bytearray = None):
+    """
+    接收一个上传分片写入 pending 的 offset 处，边收边计算 SHA-256
+
+    返回 (实际收到的字节数, 十六进制摘要)；对端提前关闭时字节数小于 length。
+    """
+    digest = hashlib.sha256(initial)
+    if initial:
+        pending.write_at(offset, initial)
+    buf = buffer or bytearray(chunk_size)
+    view = memoryview(buf)
+    chunk_size = len(buf)
+    received = len(initial)
+    while received < length:
+        with trace.span('net_recv'):
+            n = sock.recv_into(view, min(chunk_size, length - received))
+        if n == 0:
+            break
+        digest.update(view[:n])
+        with trace.span('disk_write'):
+            pending.write_at(offset + received, view[:n])
+        received += n
+    return received, digest.hexdigest()
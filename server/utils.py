@@ -1,5 +1,6 @@
 import os
 import sys
+import socket
 import logging
 
 LOG_DIR = 'serverinfo/log'
@@ -34,4 +35,14 @@ def setup_logger():
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
     
-    return logger
\ No newline at end of file
+    return logger
+def enable_keepalive(sock, idle: int = 60, interval: int = 15, count: int = 4):
+    """ 开启 TCP keepalive，探测 NAT 超时或对端掉线后残留的死连接；平台不支持的选项直接跳过 """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        option = getattr(socket, name, None)
+        if option is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, option, value)
+            except OSError:
+                pass
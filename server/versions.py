@@ -0,0 +1,179 @@
+"""
+文件版本历史
+
+启用 --versions N 后，覆盖已有文件的提交 (UPDATE_FILE、内联更新、分片上传) 在 rename
+之前先把旧文件硬链接到 .versions/<文件名>/<版本号>。rename 只替换目录项，旧内容所在的
+inode 继续由历史目录引用，不复制任何数据，更新路径上只多一次 stat 和一次 link。
+版本号就是该版本的 ETag (大小和修改时间)，与下载和条件下载中使用的校验值一致。
+
+文件系统不支持硬链接时依次退回:
+    reflink   FICLONE 创建共享数据块的副本 (Btrfs、XFS 等)，同样不复制数据
+    copy      完整复制，代价与文件大小成正比
+
+保留策略: 每个文件只保留最近 keep 个历史版本，并删除移入历史超过 max_age 秒的版本
+(按 inode 的 ctime 计算，link 和复制都会更新它)。每次保存新版本后对该文件执行，
+启动时对所有文件执行一次，清理长期没有更新的文件留下的过期版本。
+"""
+import errno
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+from storage import FileInfo, file_etag, validate_name
+
+HISTORY_DIR = '.versions'           # 平铺目录中存放历史版本的子目录
+DEFAULT_KEEP = 5
+FICLONE = 0x40049409                # linux/fs.h: _IOW(0x94, 9, int)
+
+try:
+    import fcntl
+except ImportError:                 # Windows
+    fcntl = None
+
+logger = logging.getLogger('server_logger')
+
+# 历史版本: 版本号 (即当时的 ETag)、字节数、纳秒级修改时间
+VersionInfo = namedtuple('VersionInfo', ['version', 'size', 'mtime_ns'])
+
+
+class VersionHistory:
+    """ 平铺目录中各文件的历史版本 """
+
+    def __init__(self, root: str, keep: int = DEFAULT_KEEP, max_age: float = 0):
+        self.dir = os.path.join(root, HISTORY_DIR)
+        self.keep = keep                # 每个文件保留的版本数，0 表示只按时间清理
+        self.max_age = max_age          # 版本保留的秒数，0 表示不限制
+        self.saved = {"link": 0, "reflink": 0, "copy": 0}
+        self.pruned = 0
+        self._link_ok = True            # 硬链接失败一次后不再尝试
+        self._lock = threading.Lock()
+        os.makedirs(self.dir, exist_ok=True)
+
+    def describe(self) -> str:
+        age = f"{self.max_age / 86400:g} 天" if self.max_age else "不限"
+        return f"每个文件保留 {self.keep or '不限'} 个历史版本，保留时间 {age}"
+
+    def _folder(self, name: str) -> str:
+        validate_name(name)
+        return os.path.join(self.dir, name)
+
+    def preserve(self, name: str, path: str):
+        """ 在 path 被替换或删除之前保存它的当前内容，返回版本号；文件不存在时返回 None """
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = file_etag(FileInfo(name, st.st_size, st.st_mtime_ns))
+        folder = self._folder(name)
+        dest = os.path.join(folder, version)
+        os.makedirs(folder, exist_ok=True)
+        if os.path.exists(dest):
+            return version              # 同一版本已保存过 (例如上次更新失败后重试)
+
+        if self._link_ok:
+            try:
+                os.link(path, dest)
+                self._count("link")
+                return version
+            except FileExistsError:
+                return version
+            except OSError as e:
+                if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK, errno.ENOSYS):
+                    raise
+                logger.warning(f"历史目录不支持硬链接 ({e})，改用 reflink 或复制保存旧版本")
+                self._link_ok = False
+
+        # 先写入临时文件再改名，复制中途失败不会留下不完整的版本
+        tmp = dest + '.tmp'
+        try:
+            with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+                method = "reflink" if _reflink(src.fileno(), dst.fileno()) else "copy"
+                if method == "copy":
+                    shutil.copyfileobj(src, dst, 1 << 20)
+            # 保持原修改时间，版本号和文件的 ETag 才能对应
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp, dest)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._count(method)
+        return version
+
+    def _count(self, method: str):
+        with self._lock:
+            self.saved[method] += 1
+
+    def _entries(self, folder: str) -> list:
+        """ 返回 [(VersionInfo, 移入历史的 ctime_ns), ...]，按修改时间从新到旧排列 """
+        entries = []
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        st = entry.stat()
+                        entries.append((VersionInfo(entry.name, st.st_size, st.st_mtime_ns), st.st_ctime_ns))
+        except FileNotFoundError:
+            pass
+        entries.sort(key=lambda e: e[0].mtime_ns, reverse=True)
+        return entries
+
+    def list(self, name: str) -> list:
+        """ 文件的历史版本，从新到旧 """
+        return [info for info, _ in self._entries(self._folder(name))]
+
+    def open(self, name: str, version: str):
+        """ 打开历史版本用于读取，返回 (文件对象, FileInfo)；不存在时抛出 FileNotFoundError """
+        validate_name(version)
+        f = open(os.path.join(self._folder(name), version), 'rb')
+        stat = os.fstat(f.fileno())
+        return f, FileInfo(name, stat.st_size, stat.st_mtime_ns)
+
+    def prune(self, name: str) -> int:
+        """ 按保留策略删除文件的旧版本，返回删除的个数 """
+        folder = self._folder(name)
+        expire_before = time.time_ns() - int(self.max_age * 1e9) if self.max_age else None
+        removed = 0
+        for index, (info, saved_ns) in enumerate(self._entries(folder)):
+            if (self.keep and index >= self.keep) or (expire_before is not None and saved_ns < expire_before):
+                try:
+                    os.remove(os.path.join(folder, info.version))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            try:
+                os.rmdir(folder)        # 版本全部清理后删除空目录，非空时忽略
+            except OSError:
+                pass
+            with self._lock:
+                self.pruned += removed
+        return removed
+
+    def prune_all(self) -> int:
+        removed = 0
+        with os.scandir(self.dir) as it:
+            names = [entry.name for entry in it if entry.is_dir()]
+        for name in names:
+            removed += self.prune(name)
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"saved": dict(self.saved), "pruned": self.pruned}
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    """ 让 dst 与 src 共享数据块，文件系统不支持时返回 False """
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError:
+        return False